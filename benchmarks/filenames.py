@@ -0,0 +1,46 @@
+"""Compares FileNameChecker's pattern index with matching one by one.
+
+Run from the repository root with:
+
+    PYTHONPATH=src python benchmarks/filenames.py
+"""
+import fnmatch
+import timeit
+from spot_check_files.filenames import FileNameChecker
+
+
+def linear(checker, name):
+    """How FileNameChecker matched patterns before they were indexed."""
+    for pattern in checker.blacklist:
+        if fnmatch.fnmatch(name, pattern):
+            return None
+    for pattern, checker in checker.checkers:
+        if fnmatch.fnmatch(name, pattern):
+            return checker
+    return None
+
+
+def indexed(checker, name):
+    blacklist, checkers = checker._index()
+    if blacklist.first(name) is not None:
+        return None
+    i = checkers.first(name)
+    return None if i is None else checker.checkers[i][1]
+
+
+def main():
+    checker = FileNameChecker.default()
+    checker.blacklist.extend(f'*/skipped{i}/*' for i in range(30))
+    checker.blacklist.extend(f'*.ext{i}' for i in range(20))
+    names = [f'backup/2020/{i}/file{i}.{ext}' for i in range(200)
+             for ext in ['txt', 'tar.gz', 'jpeg', 'unknown', 'webp']]
+    for func in [linear, indexed]:
+        seconds = min(timeit.repeat(
+            lambda: [func(checker, name) for name in names],
+            number=10, repeat=5))
+        per_name = seconds / 10 / len(names) * 1e6
+        print(f'{func.__name__:>8}: {per_name:.2f} us per name')
+
+
+if __name__ == '__main__':
+    main()
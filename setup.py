@@ -15,7 +15,7 @@ setuptools.setup(
     packages=setuptools.find_packages('src'),
     package_data={
         'spot_check_files._monoid_font': ['Monoid-Regular.ttf'],
-        'spot_check_files._templates': ['report.html'],
+        'spot_check_files._templates': ['*.html', '*.css'],
     },
     package_dir={'': 'src'},
     entry_points={
@@ -2,6 +2,7 @@
 
 The cli module implements the command-line interface. It inspects files
 using checker.CheckerRunner (which uses Checkers from the archives,
-basics, filenames, and quicklook modules) and displays results using
-report.CheckReport.
+basics, filenames, magic, and quicklook modules) and displays results using
+report.CheckReport. The events module reports the progress of a check as
+it runs.
 """
\ No newline at end of file
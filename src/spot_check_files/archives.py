@@ -1,59 +1,249 @@
 """Implementations of Checker for zip and tar files."""
+import os
 from pathlib import Path
+import shutil
 import tarfile
 import tempfile
+from typing import IO, Iterator, List, Optional
 import zipfile
 from zipfile import ZipFile
-from spot_check_files.checker import Checker, CheckResult, CheckRequest
+from spot_check_files.checker import ArchiveMember, Checker, CheckResult,\
+    CheckRequest
+
+
+# Members larger than this are copied to a temporary file rather than
+# held in memory while they're checked
+_SPOOL_MAX = 16 * 1024 * 1024
+
+
+def _spool(file: IO, name: str, tmpdir: Path) -> ArchiveMember:
+    """Reads an archive member into memory or a temporary file."""
+    # Don't let absolute member names replace the archive's path when
+    # they're joined to it
+    name = name.lstrip('/')
+    data = file.read(_SPOOL_MAX + 1)
+    if len(data) <= _SPOOL_MAX:
+        return ArchiveMember(name=name, size=len(data), data=data)
+    fd, tmppath = tempfile.mkstemp(dir=tmpdir)
+    try:
+        with open(fd, 'wb') as out:
+            out.write(data)
+            shutil.copyfileobj(file, out)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+    return ArchiveMember(name=name, size=os.stat(tmppath).st_size,
+                         realpath=Path(tmppath))
+
+
+def _discard(member: ArchiveMember):
+    if member.realpath:
+        member.realpath.unlink()
+
+
+def _selected(req: CheckRequest, name: str, size: int) -> bool:
+    return req.select is None or req.select(name.lstrip('/'), size)
+
+
+def _exceeded(req: CheckRequest, sizes: List[int]) -> Optional[str]:
+    """Checks the sizes of an archive's members against the request's
+    limits."""
+    if req.limits is None:
+        return None
+    return req.limits.exceeded(req, len(sizes), sum(sizes))
 
 
 class ZipChecker(Checker):
     def __str__(self):
         return 'ZipChecker'
 
-    """Extracts zip files."""
+    """Extracts zip files, or reads their members directly from the zip.
+
+    For a quick check, only the zip's central directory is read. Members
+    the request does not select are neither extracted nor read. The sizes
+    of the members given in the central directory are checked against the
+    request's limits before anything is extracted.
+    """
     def check(self, req: CheckRequest) -> CheckResult:
         result = CheckResult()
 
         try:
-            if not zipfile.is_zipfile(req.realpath):
-                result.errors.append('not a zipfile')
-                return result
+            with req.open() as file:
+                if not zipfile.is_zipfile(file):
+                    result.errors.append('not a zipfile')
+                    return result
 
             result.recognizer = self
 
-            with ZipFile(req.realpath, 'r') as zf:
+            with req.open() as file, ZipFile(file, 'r') as zf:
+                if req.quick:
+                    return result
+                error = _exceeded(req, [info.file_size for info
+                                        in zf.infolist() if not info.is_dir()])
+                if error:
+                    result.errors.append(error)
+                    return result
+
+            if not req.extract:
+                result.members = self._members(req, result)
+                return result
+
+            with req.open() as file, ZipFile(file, 'r') as zf:
                 result.extracted = Path(tempfile.mkdtemp(dir=req.tmpdir))
-                zf.extractall(result.extracted)
+                zf.extractall(result.extracted, [
+                    info for info in zf.infolist() if info.is_dir()
+                    or _selected(req, info.filename, info.file_size)])
         except Exception as e:
             result.errors.append(e)
 
         return result
 
+    def _members(self, req: CheckRequest,
+                 result: CheckResult) -> Iterator[ArchiveMember]:
+        try:
+            with req.open() as file, ZipFile(file, 'r') as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or not _selected(req, info.filename,
+                                                      info.file_size):
+                        continue
+                    try:
+                        with zf.open(info) as mfile:
+                            member = _spool(mfile, info.filename, req.tmpdir)
+                    except zipfile.BadZipFile as e:
+                        # e.g. a CRC error; the member is known to be bad,
+                        # so don't bother checking it
+                        result.errors.append(e)
+                        continue
+                    try:
+                        yield member
+                    finally:
+                        _discard(member)
+        except Exception as e:
+            result.errors.append(e)
+
 
 class TarChecker(Checker):
     def __str__(self):
         return 'TarChecker'
 
-    """Extracts tar files.
+    """Extracts tar files, or reads their members as a stream.
 
     Tars may be compressed with any formats the python tarfile lib supports,
     including gz, bz2, and xz.
+
+    When the request says not to extract, the tar is read (and decompressed)
+    only once, in tarfile's stream mode, and each member is provided to the
+    runner as it is reached. Links are skipped in that mode, since they
+    cannot be resolved without seeking backwards in the stream.
+
+    For a quick check, only the first member's header is read. Members the
+    request does not select are not extracted (though in a compressed tar,
+    they still have to be decompressed to reach the members after them).
+
+    The sizes of the members given in their headers are checked against
+    the request's limits, using the totals so far as each header is read,
+    so a tar that exceeds a limit is only read as far as the header that
+    exceeds it. When extracting, all the headers are read before anything
+    is extracted. In stream mode, no more members are provided once a limit
+    is exceeded.
     """
     def check(self, req: CheckRequest) -> CheckResult:
         result = CheckResult()
 
+        if req.quick or not req.extract:
+            return self._check_stream(req, result)
+
         try:
-            if not tarfile.is_tarfile(req.realpath):
-                result.errors.append('not a tarfile')
-                return result
+            with req.open() as file:
+                try:
+                    tf = tarfile.open(fileobj=file, mode='r')
+                except tarfile.TarError:
+                    result.errors.append('not a tarfile')
+                    return result
 
-            result.recognizer = self
+                result.recognizer = self
 
-            with tarfile.open(req.realpath, 'r') as tf:
-                result.extracted = Path(tempfile.mkdtemp(dir=req.tmpdir))
-                tf.extractall(result.extracted)
+                with tf:
+                    # For the nesting limit, which doesn't depend on the
+                    # members
+                    error = _exceeded(req, [])
+                    if error:
+                        result.errors.append(error)
+                        return result
+                    count = total = 0
+                    members = []
+                    for info in tf:
+                        if info.isfile():
+                            count += 1
+                            total += info.size
+                            error = req.limits and req.limits.exceeded(
+                                req, count, total)
+                            if error:
+                                result.errors.append(error)
+                                return result
+                            if not _selected(req, info.name, info.size):
+                                continue
+                        members.append(info)
+                    result.extracted = Path(tempfile.mkdtemp(dir=req.tmpdir))
+                    tf.extractall(result.extracted, members)
+        except Exception as e:
+            result.errors.append(e)
+
+        return result
+
+    def _check_stream(self, req: CheckRequest,
+                      result: CheckResult) -> CheckResult:
+        try:
+            file = req.open()
+        except Exception as e:
+            result.errors.append(e)
+            return result
+        try:
+            tf = tarfile.open(fileobj=file, mode='r|*')
+        except tarfile.ReadError:
+            file.close()
+            result.errors.append('not a tarfile')
+            return result
         except Exception as e:
+            file.close()
             result.errors.append(e)
+            return result
 
+        result.recognizer = self
+        # For the nesting limit, which doesn't depend on the members
+        error = None if req.quick else _exceeded(req, [])
+        if req.quick or error:
+            if error:
+                result.errors.append(error)
+            tf.close()
+            file.close()
+            return result
+        result.members = self._members(req, result, file, tf)
         return result
+
+    def _members(self, req: CheckRequest, result: CheckResult, file: IO,
+                 tf: tarfile.TarFile) -> Iterator[ArchiveMember]:
+        count = total = 0
+        try:
+            for info in tf:
+                if not info.isfile():
+                    continue
+                count += 1
+                total += info.size
+                error = req.limits and req.limits.exceeded(req, count, total)
+                if error:
+                    result.errors.append(error)
+                    break
+                if not _selected(req, info.name, info.size):
+                    continue
+                mfile = tf.extractfile(info)
+                member = _spool(mfile, info.name, req.tmpdir)
+                try:
+                    yield member
+                finally:
+                    _discard(member)
+        except Exception as e:
+            result.errors.append(e)
+        finally:
+            tf.close()
+            file.close()
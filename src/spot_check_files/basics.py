@@ -1,12 +1,20 @@
 """Implementations of Checker for various basic file types."""
+import codecs
+from concurrent.futures import ProcessPoolExecutor
 import csv
 from importlib import resources
+import io
 import json
+import locale
+import multiprocessing
+from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
-from typing import List
-from xml.dom import minidom
-from spot_check_files import _monoid_font
-from spot_check_files.checker import Checker, CheckRequest, CheckResult
+from typing import Dict, List, Optional, Tuple
+from xml.parsers import expat
+from spot_check_files import _monoid_font, csvcheck, jsonstream
+from spot_check_files.checker import HEADER_SIZE, Checker, CheckRequest,\
+    CheckResult
+from spot_check_files.preview import TextPreview
 
 
 _FONTS = []
@@ -19,6 +27,16 @@ def _font():
     return _FONTS[0]
 
 
+def _header_text(req: CheckRequest) -> str:
+    """Decodes the file's header the way req.open('r') would."""
+    header = req.read_header()
+    decoder = codecs.getincrementaldecoder(
+        locale.getpreferredencoding(False))()
+    # Unless the header is the whole file, it may end partway through a
+    # multibyte character
+    return decoder.decode(header, len(header) < HEADER_SIZE)
+
+
 def table_thumb(rows: List[List[str]]) -> bytes:
     """Builds a thumbnail for a table."""
     img = Image.new('L', (300, 300), color=255)
@@ -54,36 +72,160 @@ def text_thumb(text: str) -> bytes:
     return img
 
 
-class CSVChecker(Checker):
-    def __str__(self):
-        return 'CSVChecker'
+def _check_csv_range(path: Path, start: int, end: int,
+                     dialect: csvcheck.Dialect, columns: Optional[int],
+                     encoding: str, head: int) -> csvcheck.ChunkResult:
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return csvcheck.check_chunk(file.read(end - start), dialect, columns,
+                                    encoding, head)
 
+
+class CSVChecker(Checker):
     """Checks a CSV or TSV file for problems.
 
-    Python's csv.Sniffer is used to try to determine the column delimiter;
-    if it can't figure it out, this checker will not mark the file as
-    recognized.
+    The dialect (such as the column delimiter) is determined from the
+    start of the file by csvcheck.sniff; if it can't be, this checker will
+    not mark the file as recognized. For a quick check, only that is done.
+    Otherwise an error is added for each invalid row (up to a limit),
+    giving its row and line numbers: rows that can't be decoded, that
+    aren't quoted properly, or that have a different number of columns
+    than the first row.
+
+    The file is checked in chunks of about chunk_size bytes, each ending at
+    what seems to be the end of a record (see csvcheck.split); a chunk
+    that turns out to end inside a record is checked again along with the
+    next one, so the results don't depend on the chunk size. If jobs is
+    more than 1, a file on disk larger than one chunk has its chunks
+    checked in parallel by a pool of that many processes started for the
+    file, unless this checker is already running in a worker process (as
+    it is when CheckerRunner uses multiple jobs). By default, parallelism
+    is left to CheckerRunner.
+
+    Attributes:
+        jobs - maximum number of processes to use for one file
+        chunk_size - number of bytes to check at once (checking a chunk
+                     takes several times this much memory)
     """
+    def __init__(self, jobs: int = 1, chunk_size: int = 4 * 1024 * 1024):
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+
+    def __str__(self):
+        return 'CSVChecker'
+
     def check(self, req: CheckRequest) -> CheckResult:
         result = CheckResult()
         try:
-            rows = []
-            with open(req.realpath, 'r', newline='') as file:
-                dialect = csv.Sniffer().sniff(file.read(1024))
-                result.recognizer = self
-                file.seek(0)
-                for row in csv.reader(file, dialect):
-                    if req.thumb and len(rows) < 30:
-                        rows.append(row[0:7])
-                if req.thumb:
-                    result.thumb = table_thumb(rows)
-        except csv.Error as e:
+            header = _header_text(req)
+            complete = len(req.read_header()) < HEADER_SIZE
+            dialect = csvcheck.sniff(header[:1024],
+                                     complete and len(header) <= 1024)
+        except (csv.Error, ValueError) as e:
             result.errors.append(e)
+            return result
+        result.recognizer = self
+        if req.quick:
+            return result
+        counts = self._check_chunks(req, dialect, 30 if req.thumb else 0)
+        bad = sum(count.bad for count in counts)
+        rows = 0
+        lines = 0
+        for count in counts:
+            for row, line, description in count.errors:
+                if len(result.errors) < csvcheck.MAX_ERRORS:
+                    result.errors.append(f'row {row + rows} (line'
+                                         f' {line + lines}): {description}')
+            rows += count.rows
+            lines += count.lines
+        if bad > len(result.errors):
+            result.errors.append(
+                f'{bad - len(result.errors)} more invalid rows')
+        if req.thumb and counts and counts[0].head:
+            result.thumb = table_thumb([row[0:7] for row in counts[0].head])
         return result
 
+    def _check_chunks(self, req: CheckRequest, dialect: csvcheck.Dialect,
+                      head: int) -> List[csvcheck.ChunkResult]:
+        encoding = locale.getpreferredencoding(False)
+        chunk_size = self.chunk_size
+        quote = dialect.quotechar.encode('ascii')
+        columns = None
+        if dialect.quotechar.encode(encoding) != quote \
+                or '\n'.encode(encoding) != b'\n':
+            # Records can't be found in the bytes of the file
+            chunk_size = -1
+        else:
+            # Use the number of columns in the first row, if it's all in
+            # the header (the strict reader fails if it isn't)
+            header = req.read_header()
+            if len(header) == HEADER_SIZE:
+                header = header[:header.rfind(b'\n') + 1]
+            try:
+                first = next(dialect.reader(io.StringIO(
+                    header.decode(encoding, 'replace'), newline=''),
+                    strict=True))
+                columns = len(first) or None
+            except (csv.Error, StopIteration):
+                pass
+        jobs = self.jobs or 1
+        if req.realpath is None or jobs < 2 or chunk_size < 0 \
+                or multiprocessing.current_process().daemon:
+            counts = []
+            data = b''
+            count = None
+            with req.open() as file:
+                while True:
+                    if chunk_size < 0:
+                        more = file.read()
+                    else:
+                        more = csvcheck.read_chunk(file, chunk_size, quote)
+                    if not more:
+                        if data:
+                            counts.append(count)
+                        return counts
+                    # If the last chunk ended inside a record, check it
+                    # again along with this one
+                    data += more
+                    count = csvcheck.check_chunk(data, dialect, columns,
+                                                 encoding,
+                                                 0 if counts else head)
+                    if count.complete:
+                        counts.append(count)
+                        data = b''
+        view = req.view()
+        ranges = csvcheck.split(view, chunk_size, quote)
+        if len(ranges) < 2:
+            return [csvcheck.check_chunk(bytes(view), dialect, columns,
+                                         encoding, head)]
+        with ProcessPoolExecutor(min(jobs, len(ranges))) as executor:
+            results = list(executor.map(
+                _check_csv_range,
+                *zip(*((req.realpath, start, end, dialect, columns, encoding,
+                        0 if start else head)
+                       for start, end in ranges))))
+        counts = []
+        i = 0
+        while i < len(ranges):
+            start, end = ranges[i]
+            count = results[i]
+            while not count.complete and i + 1 < len(ranges):
+                # The chunk ended inside a record, so the next one didn't
+                # start at the start of one; check them again together
+                i += 1
+                end = ranges[i][1]
+                count = _check_csv_range(req.realpath, start, end, dialect,
+                                         columns, encoding,
+                                         0 if start else head)
+            counts.append(count)
+            i += 1
+        return counts
+
 
 class ImageChecker(Checker):
     """Checks an image by loading it with PIL.
+
+    For a quick check, only the image's header is read.
     """
     def __str__(self):
         return 'ImageChecker'
@@ -91,7 +233,10 @@ class ImageChecker(Checker):
     def check(self, req: CheckRequest) -> CheckResult:
         result = CheckResult()
         try:
-            with Image.open(req.realpath, 'r') as img:
+            with req.open() as file, Image.open(file, 'r') as img:
+                if req.quick:
+                    result.recognizer = self
+                    return result
                 img.load()
                 result.recognizer = self
                 if req.thumb:
@@ -111,27 +256,181 @@ class ImageChecker(Checker):
 class JSONChecker(Checker):
     """Checks that a file is valid JSON.
 
-    If the file cannot be parsed, it will not be marked as recognized.
+    The file is validated as it is read (see the jsonstream module), so
+    large files don't need to fit in memory, and the thumbnail is made
+    from just the start of the file. If the file cannot be parsed, it will
+    not be marked as recognized. For a quick check, the file is recognized
+    if it starts like a JSON value.
     """
     def __str__(self):
         return 'JSONChecker'
 
     def check(self, req: CheckRequest) -> CheckResult:
         result = CheckResult()
-        parsed = None
-        with req.realpath.open('r') as file:
+        if req.quick:
             try:
-                parsed = json.load(file)
+                start = _header_text(req).lstrip()
+            except ValueError as e:
+                result.errors.append(e)
+                return result
+            if start[:1] and start[0] in '{["-0123456789tfn':
+                result.recognizer = self
+            else:
+                result.errors.append('does not start with a JSON value')
+            return result
+        # Don't send an excessive amount of text to Pillow
+        preview = TextPreview(100, 100) if req.thumb else None
+        with req.open('r') as file:
+            try:
+                jsonstream.validate(file, preview)
                 result.recognizer = self
             except json.JSONDecodeError as e:
                 result.errors.append(e)
-        if req.thumb and parsed is not None:
-            pretty = json.dumps(parsed, indent=2)
-            # Don't send an excessive amount of text to Pillow
-            lines = [s[0:100] for s in pretty.splitlines()[0:100]]
+        if req.thumb and result.recognizer:
+            result.thumb = text_thumb('\n'.join(preview.lines()))
+        return result
+
+
+# Number of bytes XMLChecker gives the parser at once
+_XML_CHUNK_SIZE = 1024 * 1024
+
+# Maximum number of invalid lines NDJSONChecker describes
+_MAX_LINE_ERRORS = 10
+
+
+def _check_json_lines(data: bytes) -> Tuple[int, int, int, List[Tuple]]:
+    """Checks each line of data is a JSON value.
+
+    Returns the number of lines, the number of valid (non-blank) lines,
+    the number of invalid lines, and a (line number, description) tuple for
+    each of the first few invalid lines, where the line numbers start at 1
+    for the start of data. Blank lines are allowed, but aren't counted as
+    valid.
+    """
+    lines = data.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    valid = 0
+    bad = 0
+    errors = []
+    for number, line in enumerate(lines, 1):
+        try:
+            try:
+                json.loads(line)
+            except RecursionError:
+                # Nested too deeply for json, which recurses
+                jsonstream.validate(io.StringIO(
+                    line.decode(json.detect_encoding(line))))
+            valid += 1
+        except ValueError as e:
+            if not line.strip():
+                continue
+            bad += 1
+            if len(errors) < _MAX_LINE_ERRORS:
+                if isinstance(e, json.JSONDecodeError):
+                    errors.append((number, f' column {e.colno}: {e.msg}'))
+                else:
+                    errors.append((number, f': {e}'))
+    return len(lines), valid, bad, errors
+
+
+def _check_json_lines_range(path: Path, start: int,
+                            end: int) -> Tuple[int, int, int, List[Tuple]]:
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return _check_json_lines(file.read(end - start))
+
+
+class NDJSONChecker(Checker):
+    """Checks that each line of a file is valid JSON (NDJSON or JSON Lines).
+
+    Blank lines are allowed. An error is added for each invalid line (up to
+    a limit), giving its line number. If no non-blank lines can be parsed,
+    the file will not be marked as recognized. For a quick check, only the
+    lines in the file's header are checked.
+
+    The file is checked in chunks of about chunk_size bytes, each ending at
+    the end of a line. If jobs is more than 1, a file on disk larger than
+    one chunk has its chunks checked in parallel by a pool of that many
+    processes started for the file, unless this checker is already running
+    in a worker process (as it is when CheckerRunner uses multiple jobs).
+    By default, parallelism is left to CheckerRunner, which checks whole
+    files in parallel and can enforce its timeouts on them.
+
+    Attributes:
+        jobs - maximum number of processes to use for one file
+        chunk_size - number of bytes to check at once
+    """
+    def __init__(self, jobs: int = 1, chunk_size: int = 16 * 1024 * 1024):
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+
+    def __str__(self):
+        return 'NDJSONChecker'
+
+    def check(self, req: CheckRequest) -> CheckResult:
+        result = CheckResult()
+        if req.quick:
+            header = req.read_header()
+            complete = header
+            if len(header) == HEADER_SIZE:
+                # The last line may be incomplete
+                complete = header[:header.rfind(b'\n') + 1]
+                if not complete:
+                    # The first line is longer than the header
+                    result.recognizer = self
+                    return result
+            counts = [_check_json_lines(complete)]
+        else:
+            counts = self._check_chunks(req)
+        valid = sum(valid for _, valid, _, _ in counts)
+        bad = sum(bad for _, _, bad, _ in counts)
+        offset = 0
+        for lines, _, _, errors in counts:
+            for number, description in errors:
+                if len(result.errors) < _MAX_LINE_ERRORS:
+                    result.errors.append(
+                        f'line {number + offset}{description}')
+            offset += lines
+        if bad > len(result.errors):
+            result.errors.append(
+                f'{bad - len(result.errors)} more invalid lines')
+        if valid:
+            result.recognizer = self
+        elif not result.errors:
+            result.errors.append('no JSON lines found')
+        if req.thumb and not req.quick and result.recognizer:
+            with req.open('r', newline='') as file:
+                lines = [line[0:100].rstrip('\r\n')
+                         for _, line in zip(range(100), file)]
             result.thumb = text_thumb('\n'.join(lines))
         return result
 
+    def _check_chunks(self, req: CheckRequest) -> List[Tuple]:
+        jobs = self.jobs or 1
+        if req.realpath is None or jobs < 2 \
+                or multiprocessing.current_process().daemon:
+            counts = []
+            with req.open() as file:
+                while True:
+                    data = file.read(self.chunk_size) + file.readline()
+                    if not data:
+                        return counts
+                    counts.append(_check_json_lines(data))
+        view = req.view()
+        ranges = []
+        start = 0
+        while start < len(view):
+            end = view.find(b'\n', start + self.chunk_size) + 1 or len(view)
+            ranges.append((start, end))
+            start = end
+        if len(ranges) < 2:
+            return [_check_json_lines(bytes(view))]
+        with ProcessPoolExecutor(min(jobs, len(ranges))) as executor:
+            return list(executor.map(_check_json_lines_range,
+                                     *zip(*((req.realpath, start, end)
+                                            for start, end in ranges))))
+
 
 class PlaintextChecker(Checker):
     """Checks a plaintext file for encoding problems.
@@ -139,7 +438,8 @@ class PlaintextChecker(Checker):
     This will read the input as a text file, relying on Python's default
     behavior to select the encoding. The checker will mark the file as
     recognized as long as it is able to open it. It will attempt to read
-    the entire file and add an error if it cannot decode it.
+    the entire file (or only the start of it, for a quick check) and add an
+    error if it cannot decode it.
     """
     def __str__(self):
         return 'PlaintextChecker'
@@ -148,7 +448,12 @@ class PlaintextChecker(Checker):
         result = CheckResult()
         try:
             lines = []
-            with open(req.realpath, 'r') as file:
+            if req.quick:
+                req.read_header()
+                result.recognizer = self
+                _header_text(req)
+                return result
+            with req.open('r') as file:
                 result.recognizer = self
                 for line in file:
                     if req.thumb and len(lines) < 100:
@@ -161,25 +466,141 @@ class PlaintextChecker(Checker):
         return result
 
 
+def _escape_xml(data: str) -> str:
+    return data.replace('&', '&amp;').replace('<', '&lt;')\
+        .replace('"', '&quot;').replace('>', '&gt;')
+
+
+class _XMLPreview:
+    """Pretty-prints the start of an XML document to a TextPreview as expat
+    parses it.
+
+    The output is formatted like minidom's toprettyxml(indent='  '), except
+    that text that is only whitespace is left out. Once the preview is
+    full, the parser's handlers are removed so the rest of the document is
+    parsed without calling back into Python.
+    """
+    def __init__(self, parser, out: TextPreview):
+        self.parser = parser
+        self.out = out
+        # Enough of a text node to fill the preview
+        self.max_text = out.max_lines * (out.max_columns + 1)
+        self.depth = 0
+        # The start tag of the innermost element, if it hasn't been written
+        # because it's not yet known whether the element is empty or only
+        # contains text (in which case it's written on one line)
+        self.start = None
+        # Text not yet written
+        self.text = []
+        self.text_size = 0
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.processing_instruction
+        self._write('<?xml version="1.0" ?>\n')
+
+    def start_element(self, name: str, attrs: Dict[str, str]):
+        self._flush()
+        self.start = '<' + name + ''.join(
+            f' {key}="{_escape_xml(value)}"' for key, value in attrs.items())
+        self.depth += 1
+
+    def end_element(self, name: str):
+        indent = '  ' * (self.depth - 1)
+        text = self._take_text()
+        if self.start is not None:
+            if text:
+                self._write(f'{indent}{self.start}>{text}</{name}>\n')
+            else:
+                self._write(f'{indent}{self.start}/>\n')
+            self.start = None
+        else:
+            if text:
+                self._write(f'{indent}  {text}\n')
+            self._write(f'{indent}</{name}>\n')
+        self.depth -= 1
+
+    def character_data(self, data: str):
+        if self.text_size < self.max_text:
+            self.text.append(data)
+            self.text_size += len(data)
+
+    def comment(self, data: str):
+        self._flush()
+        self._write(f'{"  " * self.depth}<!--{data}-->\n')
+
+    def processing_instruction(self, target: str, data: str):
+        self._flush()
+        self._write(f'{"  " * self.depth}<?{target} {data}?>\n')
+
+    def _take_text(self) -> str:
+        text = ''.join(self.text)[:self.max_text]
+        self.text = []
+        self.text_size = 0
+        return _escape_xml(text) if text.strip() else ''
+
+    def _flush(self):
+        # Writes the innermost element's start tag and text, since another
+        # node is starting inside it
+        indent = '  ' * self.depth
+        if self.start is not None:
+            self._write(f'{indent[2:]}{self.start}>\n')
+            self.start = None
+        text = self._take_text()
+        if text:
+            self._write(f'{indent}{text}\n')
+
+    def _write(self, text: str):
+        self.out.write(text)
+        if self.out.full:
+            for handler in ['StartElementHandler', 'EndElementHandler',
+                            'CharacterDataHandler', 'CommentHandler',
+                            'ProcessingInstructionHandler']:
+                setattr(self.parser, handler, None)
+
+
 class XMLChecker(Checker):
     """Checks that a file is valid XML.
 
-    If the file cannot be parsed, it will not be marked as recognized.
+    The file is parsed with expat as it is read, so memory use doesn't
+    depend on the size of the file, and errors give the line and column
+    where the document stopped being well-formed. The thumbnail is made
+    from the first elements of the document. If the file cannot be parsed,
+    it will not be marked as recognized. For a quick check, only the start
+    of the file is parsed.
     """
     def __str__(self):
         return 'XMLChecker'
 
     def check(self, req: CheckRequest) -> CheckResult:
         result = CheckResult()
-        parsed = None
+        if req.quick:
+            try:
+                data = req.read_header()
+                # If that was the whole file, the parser can check that the
+                # document is complete
+                expat.ParserCreate().Parse(data, len(data) < HEADER_SIZE)
+                result.recognizer = self
+            except expat.ExpatError as e:
+                result.errors.append(e)
+            return result
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        # Don't send an excessive amount of text to Pillow
+        preview = TextPreview(100, 100) if req.thumb else None
+        if preview:
+            _XMLPreview(parser, preview)
         try:
-            parsed = minidom.parse(str(req.realpath))
+            with req.open() as file:
+                while True:
+                    data = file.read(_XML_CHUNK_SIZE)
+                    parser.Parse(data, not data)
+                    if not data:
+                        break
             result.recognizer = self
         except Exception as e:
             result.errors.append(e)
-        if req.thumb and parsed is not None:
-            pretty = parsed.toprettyxml(indent='  ')
-            # Don't send an excessive amount of text to Pillow
-            lines = [s[0:100] for s in pretty.splitlines()[0:100]]
-            result.thumb = text_thumb('\n'.join(lines))
+        if req.thumb and result.recognizer:
+            result.thumb = text_thumb('\n'.join(preview.lines()))
         return result
@@ -0,0 +1,154 @@
+"""Stores results between runs so unchanged files need not be rechecked.
+
+The ResultCache class keeps the summaries CheckerRunner produces for each
+file (including the contents of archives) in a SQLite database. A cached
+result is used if the file's size and modification time (or, optionally,
+a hash of its contents) are unchanged, and the runner's configuration and
+the version of this package are the same as when it was stored. As in
+results files, the Checker that recognized each file is only stored by
+name, so cached results are smaller and don't depend on the Checkers'
+classes.
+"""
+import hashlib
+from pathlib import Path
+import pickle
+import sqlite3
+import time
+from typing import List, Optional
+import zlib
+from spot_check_files import thumbs
+from spot_check_files.checker import FileSummary
+from spot_check_files.results import load_result, result_record
+
+
+try:
+    from importlib.metadata import version
+    _VERSION = version('spot_check_files')
+except Exception:
+    # Python < 3.8, or the package isn't installed
+    _VERSION = 'unknown'
+
+
+def _digest(path: Path) -> str:
+    sha = hashlib.sha256()
+    with path.open('rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _pack(summaries: List[FileSummary], virtpath: Path) -> bytes:
+    entries = []
+    for summary in summaries:
+        thumb = summary.result.thumb
+        entries.append((
+            str(summary.virtpath.relative_to(virtpath)),
+            summary.size,
+            result_record(summary.result),
+            thumb and thumbs.encode(thumb)))
+    return zlib.compress(pickle.dumps(entries))
+
+
+def _unpack(data: bytes, virtpath: Path) -> List[FileSummary]:
+    summaries = []
+    for relpath, size, result, thumb in pickle.loads(zlib.decompress(data)):
+        result = load_result(result)
+        if thumb:
+            result.thumb = thumbs.decode(thumb)
+        summaries.append(FileSummary(
+            size=size, virtpath=virtpath.joinpath(relpath), result=result))
+    return summaries
+
+
+class ResultCache:
+    """Caches the results of checking files, in a SQLite database file.
+
+    Results are stored per file given to CheckerRunner.check_path (or found
+    in a directory given to it), together with the results for everything
+    inside the file if it is an archive. When the total size of the stored
+    results exceeds max_size, the least recently used ones are removed.
+    Changes are saved when flush or close is called.
+
+    Attributes:
+        path - location of the database file
+        max_size - approximate maximum size in bytes of the stored results
+        hash - if True, a file's contents are hashed to decide whether it
+               has changed, instead of relying on its modification time
+    """
+    def __init__(self, path: Path, max_size: int = 1024 * 1024 * 1024,
+                 hash: bool = False):
+        self.path = path
+        self.max_size = max_size
+        self.hash = hash
+        self._db = sqlite3.connect(str(path))
+        self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                         'path TEXT PRIMARY KEY, config TEXT, size INTEGER,'
+                         ' mtime INTEGER, digest TEXT, data BLOB,'
+                         ' used REAL)')
+
+    def get(self, path: Path, virtpath: Path,
+            config: str) -> Optional[List[FileSummary]]:
+        """Returns the stored summaries for a file, or None.
+
+        config must be the value CheckerRunner.config() returned when the
+        summaries were stored. The virtpaths of the returned summaries are
+        based on the given virtpath, which may differ from the one the file
+        had when it was stored.
+        """
+        key = str(path.resolve())
+        row = self._db.execute(
+            'SELECT size, mtime, digest, data FROM results'
+            ' WHERE path = ? AND config = ?',
+            (key, f'{_VERSION} {config}')).fetchone()
+        if not row:
+            return None
+        size, mtime, digest, data = row
+        stat = path.stat()
+        if size != stat.st_size:
+            return None
+        if self.hash:
+            if digest != _digest(path):
+                return None
+        elif mtime != stat.st_mtime_ns:
+            return None
+        self._db.execute('UPDATE results SET used = ? WHERE path = ?',
+                         (time.time(), key))
+        return _unpack(data, virtpath)
+
+    def put(self, path: Path, virtpath: Path, config: str,
+            summaries: List[FileSummary]):
+        """Stores the summaries for a file.
+
+        Summaries that cannot be pickled (for example, because a Checker
+        recorded an unusual exception as an error) are not stored.
+        """
+        try:
+            data = _pack(summaries, virtpath)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        stat = path.stat()
+        self._db.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (str(path.resolve()), f'{_VERSION} {config}', stat.st_size,
+             stat.st_mtime_ns, _digest(path) if self.hash else None, data,
+             time.time()))
+
+    def flush(self):
+        """Evicts results if the cache is too big, and saves changes."""
+        total = self._db.execute(
+            'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM results').fetchone()[0]
+        if total > self.max_size:
+            evict = []
+            for key, size in self._db.execute(
+                    'SELECT path, LENGTH(data) FROM results ORDER BY used'):
+                if total <= self.max_size:
+                    break
+                evict.append((key,))
+                total -= size
+            self._db.executemany('DELETE FROM results WHERE path = ?', evict)
+        self._db.commit()
+
+    def close(self):
+        """Saves changes and closes the database."""
+        self.flush()
+        self._db.close()
@@ -4,38 +4,303 @@ The Checker abstract class defines the interface that must be implemented
 for each type of file that spotcheck will support. A Checker is given a
 CheckRequest containing the path to a file and other info, and returns a
 CheckResult indicating whether it knew how to interpret the file, any errors
-it found in the file, and a thumbnail of the file. The Checker also extracts
-files if the file is an archive (e.g. a zip or tar).
+it found in the file, and a thumbnail of the file. If the file is an archive
+(e.g. a zip or tar), the Checker also either extracts it or provides its
+members to be checked directly from the archive.
 
 The CheckerRunner class recursively checks all the files in a given path
 (including files inside archives, if it's configured with a Checker that
-can extract the archive) using a given set of Checkers.
+can extract the archive) using a given set of Checkers. It can optionally
+spread the work across a pool of processes (see the workers module), give
+up on files that take too long to check, and can check a random sample of
+the files instead of all of them.
 """
 from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, wait
+import copy
+from collections import deque
 from dataclasses import dataclass, field
+import errno
+from functools import partial
+import hashlib
+from io import BufferedReader, RawIOBase, TextIOWrapper
+import mmap
+import os
 from PIL import Image
 from pathlib import Path
+import pickle
 import platform
+import shutil
 from tempfile import TemporaryDirectory
-from typing import List, Union
+import time
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Tuple,\
+    Union
+from spot_check_files import thumbs, workers
+from spot_check_files.dedup import ContentIndex
+from spot_check_files.sampling import Sampler
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+# Number of bytes at the start of a file that CheckRequest.read_header reads
+HEADER_SIZE = 4096
+
+# Files at least this big are memory-mapped by CheckRequest.view; smaller
+# ones are just read into memory
+_MMAP_MIN = 1024 * 1024
+
+
+class _ViewReader(RawIOBase):
+    """A binary stream that reads from a buffer without copying it.
+
+    If given, counter is called with the number of bytes read by each read.
+    """
+    def __init__(self, buffer, counter: Callable[[int], None] = None):
+        self._view = memoryview(buffer)
+        self._pos = 0
+        self._counter = counter
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = max(min(len(b), len(self._view) - self._pos), 0)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        if self._counter:
+            self._counter(n)
+        return n
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            # like a real file, rather than BytesIO
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
 
 
 @dataclass
 class CheckRequest:
     """Represents a file that should be checked.
 
+    Checkers should read the file using the open method, since the file
+    may only exist in memory (see the data attribute). Checkers that only
+    need the start of the file should use read_header, which only reads
+    the header (once, for every checker given the request). open reads
+    from a view of the whole file that is shared by every checker given
+    the request, so the file is only read once no matter how many checkers
+    look at it.
+    Whoever creates the request should call close when the checkers are
+    done with it.
+
     Attributes:
-        realpath - path to (possibly temporary) location of file
+        realpath - path to (possibly temporary) location of file, or None
+                   if the file's contents are given by data
         tmpdir - a shared temporary directory
         virtpath - logical path associated with the file. For example,
                    if the file "foo/bar.txt" was extracted from "a.zip",
                    this might be "a.zip/foo/bar.txt".
         thumb - if True, a thumbnail should be generated
+        quick - if True, only a quick check of the file's header or magic
+                bytes should be done, rather than validating the whole
+                file. Archives should not be extracted.
+        extract - if False, archives should not be extracted to tmpdir;
+                  instead their members should be read directly from the
+                  archive (see CheckResult.members)
+        data - contents of the file, if it is held in memory rather than
+               stored at realpath
+        select - if set, archives should only extract or provide the
+                 members for which this returns True. It takes the path of
+                 a member within the archive and the member's size, and
+                 must be called exactly once for each member that is a
+                 regular file, in the order they appear in the archive.
+        header - the first HEADER_SIZE bytes of the file (or all of it, if
+                 it is shorter), once read_header has been called
+        limits - if set, archives should not be extracted (or have their
+                 members provided) if they exceed these limits; instead an
+                 error should be added to the result
+        nesting - number of archives the file is inside
+        bytes_read - number of bytes checkers have read using the open and
+                     read_header methods
     """
     realpath: Path
     tmpdir: Path
     virtpath: Path
     thumb: bool = False
+    quick: bool = False
+    extract: bool = True
+    data: bytes = None
+    select: Callable[[str, int], bool] = None
+    header: bytes = None
+    limits: ArchiveLimits = None
+    nesting: int = 0
+    bytes_read: int = field(default=0, init=False, compare=False)
+    _view: Union[bytes, mmap.mmap] = field(default=None, init=False,
+                                           repr=False, compare=False)
+    _view_stat: Tuple[int, int] = field(default=None, init=False,
+                                        repr=False, compare=False)
+
+    def view(self) -> Union[bytes, mmap.mmap]:
+        """Returns the contents of the file as a read-only buffer.
+
+        For a file on disk, this is created the first time it is needed:
+        large files are memory-mapped, and others are read into memory.
+        It is recreated if the file's size or modification time changes.
+        """
+        if self.data is not None:
+            return self.data
+        stat = os.stat(self.realpath)
+        if self._view is not None \
+                and self._view_stat == (stat.st_size, stat.st_mtime_ns):
+            return self._view
+        self.close()
+        self.header = None
+        with open(self.realpath, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self._view = None
+            if stat.st_size >= _MMAP_MIN:
+                try:
+                    self._view = mmap.mmap(file.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+                except OSError:
+                    pass
+            if self._view is None:
+                self._view = file.read()
+        self._view_stat = (stat.st_size, stat.st_mtime_ns)
+        return self._view
+
+    def open(self, mode: str = 'rb', newline: str = None) -> IO:
+        """Opens the file for reading, like the builtin open function.
+
+        Only the modes 'r' and 'rb' are supported.
+        """
+        stream = BufferedReader(_ViewReader(self.view(), self._count))
+        if 'b' in mode:
+            return stream
+        return TextIOWrapper(stream, newline=newline)
+
+    def read_header(self) -> bytes:
+        """Returns the header attribute, reading it if necessary.
+
+        This only reads the start of the file, unless a view of the whole
+        file has already been created.
+        """
+        if self.header is None:
+            if self.data is not None or self._view is not None:
+                self.header = bytes(self.view()[:HEADER_SIZE])
+            else:
+                with open(self.realpath, 'rb') as file:
+                    self.header = file.read(HEADER_SIZE)
+            self._count(len(self.header))
+        return self.header
+
+    def size(self) -> int:
+        """Returns the size of the file in bytes, without reading it."""
+        if self.data is not None:
+            return len(self.data)
+        return os.stat(self.realpath).st_size
+
+    def _count(self, n: int):
+        self.bytes_read += n
+
+    def close(self):
+        """Releases the view of the file, if one was created."""
+        if isinstance(self._view, mmap.mmap):
+            try:
+                self._view.close()
+            except BufferError:
+                # A checker left a stream open; the map will be closed
+                # when it's garbage collected
+                pass
+        self._view = None
+
+
+@dataclass
+class ArchiveMember:
+    """A file read directly from an archive, without extracting it.
+
+    Attributes:
+        name - path of the file within the archive
+        size - size in bytes of the file
+        data - contents of the file, if held in memory
+        realpath - path to a temporary copy of the file, if not held
+                   in memory
+    """
+    name: str
+    size: int
+    data: bytes = None
+    realpath: Path = None
+
+
+@dataclass
+class ArchiveLimits:
+    """Limits on extracting archives, to guard against zip bombs.
+
+    Any of these may be None, for no limit.
+
+    Attributes:
+        max_nesting - maximum number of archives a file may be inside; an
+                      archive that is already nested this deeply is not
+                      extracted
+        max_size - maximum total size in bytes of an archive's members
+        max_members - maximum number of members an archive may have
+        max_ratio - maximum ratio of the total size of an archive's members
+                    to the size of the archive
+    """
+    max_nesting: int = 10
+    max_size: int = None
+    max_members: int = None
+    max_ratio: float = 1000
+
+    def exceeded(self, req: CheckRequest, count: int = 0,
+                 size: int = 0) -> Optional[str]:
+        """Returns an error message if the archive exceeds the limits.
+
+        count and size are the number and total size (as declared by the
+        archive) of the members; for archives read as a stream, they can be
+        the totals so far.
+        """
+        if self.max_nesting is not None and req.nesting >= self.max_nesting:
+            return (f'archive is inside too many other archives'
+                    f' (limit: {self.max_nesting})')
+        if self.max_members is not None and count > self.max_members:
+            return (f'archive has too many members'
+                    f' (limit: {self.max_members})')
+        if self.max_size is not None and size > self.max_size:
+            return (f'archive members are too big'
+                    f' ({size} bytes; limit: {self.max_size})')
+        if self.max_ratio is not None and size:
+            ratio = size / max(req.size(), 1)
+            if ratio > self.max_ratio:
+                return (f'archive is compressed too much'
+                        f' ({ratio:.0f}:1; limit: {self.max_ratio}:1)')
+        return None
+
+
+# Possible values of CheckerRunner.depth:
+#   quick - only check headers/magic bytes (see CheckRequest.quick)
+#   standard - fully validate files, without generating thumbnails
+#   full - fully validate files and generate thumbnails
+DEPTHS = ('quick', 'standard', 'full')
 
 
 @dataclass
@@ -45,16 +310,28 @@ class CheckResult:
         errors - any problems found with the file
         extracted - if the file was an archive, the path to the directory
                     containing its extracted contents. This should be a
-                    subdirectory of the tmpdir specified in the request
+                    subdirectory of the tmpdir specified in the request.
+                    CheckerRunner deletes the directory once its contents
+                    have been checked, so nothing else in the result may
+                    depend on it.
+        members - if the file was an archive and the request said not to
+                  extract it, an iterable of ArchiveMembers. This is
+                  typically a generator that reads the archive as it is
+                  iterated, and adds any errors it encounters to this
+                  result; each member only needs to remain valid until
+                  the next one is requested. After the members have been
+                  checked, CheckerRunner replaces this with an empty list.
         recognizer - a Checker will set this to itself if it's confident
                      that the file was valid or invalid; if the file type
                      is still unclear, this may be None
         skipped - if True, the Checker decided this file should not be
                   checked. recognizer should always be set when this is True.
-        thumb - a thumbnail of the file
+        thumb - a thumbnail of the file, as a PIL image or (if the runner
+                has a thumb_store) a thumbs.Thumbnail
     """
     errors: List[Union[str, Exception]] = field(default_factory=list)
     extracted: Path = None
+    members: Iterable[ArchiveMember] = None
     thumb: Image = None
     recognizer: Checker = None
     skipped: bool = False
@@ -70,6 +347,87 @@ class Checker:
         """
         raise NotImplementedError()
 
+    def skips(self, virtpath: Path) -> bool:
+        """Returns True if the file at the given path would be marked as
+        skipped by this checker, whatever its contents.
+
+        CheckerRunner uses this to leave such files out of deduplication.
+        """
+        return False
+
+    def skips_tree(self, virtpath: Path) -> bool:
+        """Returns True if every file in the given directory (including
+        its subdirectories) would be marked as skipped by this checker.
+
+        CheckerRunner uses this to avoid walking such directories at all.
+        """
+        return False
+
+
+@dataclass(frozen=True)
+class NamedChecker(Checker):
+    """Stands in for the Checker that recognized a file, in results that
+    were saved and loaded again, so that they don't depend on the Checker's
+    class or attributes. It can't check files.
+
+    Attributes:
+        name - str() of the Checker
+    """
+    name: str
+
+    def __str__(self):
+        return self.name
+
+
+@dataclass
+class CheckerStats:
+    """Measurements of running a checker on a file.
+
+    Attributes:
+        checker - name of the checker that recognized the file, or of the
+                  checker that was run if it did not recognize the file
+        wall - elapsed time in seconds
+        cpu - CPU time in seconds used by the process running the checker
+              (not including any subprocesses)
+        bytes_read - number of bytes of the file read through the
+                     CheckRequest (see CheckRequest.bytes_read)
+        max_rss - peak resident memory in bytes of the process running the
+                  checker, as of when the checker finished, or None if
+                  this can't be measured on the current platform. This is
+                  the high-water mark for the whole process, not just the
+                  checker.
+        start - time.time() value when the checker started, or None
+        pid - ID of the process that ran the checker, or None
+    """
+    checker: str
+    wall: float = 0
+    cpu: float = 0
+    bytes_read: int = 0
+    max_rss: Optional[int] = None
+    start: float = None
+    pid: int = None
+
+    def measure(self, fn: Callable, *args):
+        """Returns fn(*args), adding the time it takes to wall and cpu."""
+        if self.start is None:
+            self.start = time.time()
+            self.pid = os.getpid()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            return fn(*args)
+        finally:
+            self.wall += time.perf_counter() - wall
+            self.cpu += time.process_time() - cpu
+            self.max_rss = _max_rss()
+
+
+def _max_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, but bytes on macOS
+    return rss if platform.system() == 'Darwin' else rss * 1024
+
 
 @dataclass
 class FileSummary:
@@ -81,10 +439,115 @@ class FileSummary:
         size - size in bytes of the file
         virtpath - the logical path to the file (for files inside an archive,
                    this wil include the path to the archive)
+        duplicate_of - if the file was not checked because it has the same
+                       contents as another file, the virtpath of that file.
+                       The result is shared with that file's summary, and
+                       if the file is an archive, its contents are not
+                       listed again.
+        stats - measurements of each checker that was run on the file, in
+                order. For an archive whose members were read directly
+                from it, this includes the time spent reading the members
+                but not checking them. Empty if the file was not checked
+                in this run (e.g. its result was cached).
+        forced - if True, the runner was sampling, and the file was only
+                 checked because it was the first of its stratum, so it
+                 isn't part of the random sample (see sampling.Selection)
     """
     size: int
     virtpath: Path
     result: CheckResult = field(default_factory=CheckResult)
+    duplicate_of: Path = None
+    stats: List[CheckerStats] = field(default_factory=list)
+    forced: bool = False
+
+    @property
+    def wall(self) -> float:
+        """Total time in seconds spent checking the file."""
+        return sum(s.wall for s in self.stats)
+
+
+def _files(path: Path, virtpath: Path,
+           prune: Callable[[Path], bool] = None
+           ) -> Iterator[Tuple[Path, Path]]:
+    """Yields the real and logical paths of each file at the given path.
+
+    Directories for which prune returns True (given their logical path)
+    are not descended into. Symlinks to directories are not followed.
+    """
+    if not path.is_dir():
+        if path.is_file():
+            yield path, virtpath
+        return
+    # Depth-first, with each directory's files before its subdirectories
+    stack = [(str(path), virtpath)]
+    while stack:
+        dirpath, dirvirtpath = stack.pop()
+        if prune and prune(dirvirtpath):
+            continue
+        subdirs = []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append((entry.path,
+                                        dirvirtpath.joinpath(entry.name)))
+                    elif entry.is_file():
+                        yield (Path(entry.path),
+                               dirvirtpath.joinpath(entry.name))
+        except (FileNotFoundError, NotADirectoryError):
+            # removed while walking
+            continue
+        stack.extend(reversed(subdirs))
+
+
+def _disk_usage(path: Path) -> int:
+    """Returns the total size of the files in a directory tree."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _sample(files: Iterator[Tuple[Path, Path]], root: Path,
+            sampler: Sampler) -> Iterator[Tuple[Path, Path]]:
+    """Filters the output of _files to the sampled files, if sampling.
+
+    root is the logical path the files' names are taken relative to.
+    """
+    if not sampler:
+        return files
+    select = sampler.selection()
+    return ((fpath, fvirtpath) for fpath, fvirtpath in files
+            if select(fvirtpath.relative_to(root).as_posix(),
+                      fpath.stat().st_size))
+
+
+@dataclass
+class _Duplicate:
+    """Stands in for a future when a file that probably duplicates an
+    earlier one isn't sent to a worker."""
+    size: int
+    path: Path
+    virtpath: Path
+    nesting: int
+
+
+# The CheckerRunner used by the current process when it is a pool worker
+_WORKER_RUNNER = None
+
+
+def _init_worker(runner: CheckerRunner):
+    global _WORKER_RUNNER
+    _WORKER_RUNNER = runner
+
+
+def _check_file_in_worker(path: Path, virtpath: Path, tmpdir: Path,
+                          nesting: int) -> List[FileSummary]:
+    return _WORKER_RUNNER.check_file(path, virtpath, tmpdir, nesting)
 
 
 class CheckerRunner:
@@ -100,53 +563,573 @@ class CheckerRunner:
     Attributes:
         checkers - for each file, these will be applied in order until
                     one recognizes the file
+        depth - how thoroughly to check files; one of DEPTHS
+        jobs - number of processes to check files with. If greater than 1,
+               files (including files extracted from archives) are checked
+               in a process pool, so the checkers must be picklable. The
+               results are the same as when checking in a single process.
+        extract - if False, archive members are checked directly from the
+                  archive rather than extracted to a temporary directory
+                  (for checkers that support this)
+        cache - an optional cache.ResultCache. Files given to check_path
+                (or found in directories given to it) that are unchanged
+                since their results were cached are not checked again.
+        dedup - if True, files with the same contents and file extension as
+                a file already checked during the same call to check_path
+                are not checked again (see FileSummary.duplicate_of).
+                Which copy is checked is decided in the order check_path
+                returns the files, whether or not multiple jobs are used.
+                Files the first checker skips by name (see Checker.skips)
+                are not compared with other files, and neither are files
+                read directly from archives that were not extracted. A
+                copy inside an archive is only found if an earlier file
+                has the same size and extension (see
+                dedup.ContentIndex.add).
+        sampler - an optional sampling.Sampler. If set, only a sample of
+                  the files given to check_path (or found in directories
+                  given to it) and of the files in archives are checked;
+                  the others are left out of the results entirely.
+        limits - ArchiveLimits that archives must be within to be
+                 extracted, or None
+        max_temp - approximate maximum number of bytes of extracted files
+                   to keep in the temporary directory at once, or None.
+                   Extracted archives are deleted as soon as their contents
+                   have been checked; when using multiple jobs, if this
+                   is exceeded, no more files are started until enough
+                   have been deleted. (Archives that have already been
+                   started are still extracted, so this is not a hard
+                   limit.)
+        file_timeout - seconds to spend checking a single file (including
+                       the members of an archive that are read directly from
+                       it, but not extracted files) before giving up on it,
+                       or None
+        checker_timeout - seconds a single checker may spend on a file, or
+                          None
+        deadline - time.monotonic() value after which no more files are
+                   checked, or None. Files that are being checked at the
+                   deadline are given up on, and files that haven't been
+                   started are still included in the results, with an
+                   error saying they were not checked.
+        listeners - events.RunnerListeners to tell about the progress of
+                    check_path
+        thumb_store - an optional thumbs.ThumbnailStore. If set, each
+                      thumbnail is compressed as soon as the checker that
+                      made it returns, and the summaries check_path
+                      returns have thumbs.Thumbnails from the store, so
+                      that they use a bounded amount of memory. Each
+                      summary's thumbnail is added to the store separately
+                      (even if summaries share a result), so whatever uses
+                      a summary should discard its thumbnail once it's not
+                      needed (as CheckReport does).
+
+    If any of the time limits are set, files are checked in worker processes
+    (even if jobs is 1), which are killed when a limit is exceeded. The
+    summary for a file that was given up on has a workers.TaskTimeout
+    error, and the file's results are not cached. If an archive was given
+    up on, none of its members are included in the results.
     """
     @classmethod
-    def default(cls):
+    def default(cls, jobs: int = 1, extract: bool = True,
+                dedup: bool = False, depth: str = 'full'):
         """Returns an instance with hopefully-reasonable defaults.
 
         Default checkers, in order:
             1. FileNameChecker.default()
-            2. If on a Mac, QlChecker
+            2. MagicChecker.default()
+            3. If on a Mac, QlChecker
         """
         from spot_check_files.filenames import FileNameChecker
-        checkers = [FileNameChecker.default()]
+        from spot_check_files.magic import MagicChecker
+        checkers = [FileNameChecker.default(), MagicChecker.default()]
         if platform.mac_ver()[0]:
             from spot_check_files.quicklook import QLChecker
             checkers.append(QLChecker())
-        return cls(checkers)
+        return cls(checkers, jobs, extract, dedup, depth)
 
-    def __init__(self, checkers: List[Checker] = []):
+    def __init__(self, checkers: List[Checker] = [], jobs: int = 1,
+                 extract: bool = True, dedup: bool = False,
+                 depth: str = 'full'):
+        if depth not in DEPTHS:
+            raise ValueError(f'unknown depth: {depth}')
         self.checkers = list(checkers)
+        self.depth = depth
+        self.jobs = jobs
+        self.extract = extract
+        self.dedup = dedup
+        self.cache = None
+        self.sampler = None
+        self.limits = ArchiveLimits()
+        self.max_temp = None
+        self.file_timeout = None
+        self.checker_timeout = None
+        self.deadline = None
+        self.listeners = []
+        self.thumb_store = None
+        self._index = None
+        self._encode_thumbs = False
+        self._sampler = None
+        self._sample_root = None
+
+    def config(self) -> str:
+        """Returns a string identifying the settings that affect results.
+
+        While check_path is running, this reflects the fraction of files
+        being sampled, which may depend on the number of files found.
+        """
+        sampler = self._sampler or self.sampler
+        sampling = sampler and (sampler.count, sampler.fraction, sampler.seed)
+        return hashlib.sha256(
+            pickle.dumps((self.checkers, self.extract, self.depth,
+                          sampling, self.limits))).hexdigest()
 
     def check_path(self, path: Path, virtpath: Path = None,
                    tmpdir: Path = None) -> List[FileSummary]:
-        """Runs checks against the file or directory at the given path."""
+        """Runs checks against the file or directory at the given path.
+
+        Summaries are returned in the order the files were found, with the
+        contents of each archive immediately following the archive itself.
+        Directories in which the first checker would skip every file (see
+        Checker.skips_tree) are not walked, and are left out of the results.
+        """
+        return list(self.iter_check(path, virtpath, tmpdir))
+
+    def iter_check(self, path: Path, virtpath: Path = None,
+                   tmpdir: Path = None) -> Iterator[FileSummary]:
+        """Like check_path, but yields each summary as soon as it's ready.
+
+        Summaries are yielded in the same order check_path returns them.
+        The runner does not keep references to summaries once they have
+        been yielded (unless dedup is enabled), so the memory used depends
+        on the number of jobs and the number of files in the largest
+        archive rather than on the total number of files.
+        """
         if not tmpdir:
             with TemporaryDirectory() as tmpdir:
-                return self.check_path(path, virtpath, Path(tmpdir))
-        results = []
+                yield from self.iter_check(path, virtpath, Path(tmpdir))
+                return
+        start = time.perf_counter()
         virtpath = virtpath or path
-        if path.is_dir():
-            for fpath in path.glob('**/*'):
-                if fpath.is_file():
-                    fvirtpath = virtpath.joinpath(fpath.relative_to(path))
-                    results.extend(self.check_path(fpath, fvirtpath, tmpdir))
-            return results
-        elif path.is_file():
-            summary = FileSummary(
-                virtpath=virtpath,
-                size=path.stat().st_size)
-            results.append(summary)
+        self._sampler = self.sampler
+        # Files are sampled by their paths relative to this
+        self._sample_root = virtpath if path.is_dir() else virtpath.parent
+        files = size = None
+        totals = any(listener.totals for listener in self.listeners)
+        if self.sampler and self.sampler.fraction is None:
+            if totals:
+                files, size = self._totals(path, virtpath, sample=False)
+                population = files
+            else:
+                population = sum(1 for _ in _files(path, virtpath,
+                                                   self._prune))
+            self._sampler = self.sampler.resolve(population)
+            if totals:
+                # Estimated from the population, rather than walking the
+                # tree again
+                files = round(files * self._sampler.fraction)
+                size = round(size * self._sampler.fraction)
+        self._encode_thumbs = self.thumb_store is not None
+        # Thumbnails that later duplicates may share, which are kept in the
+        # store until the end of the run
+        held = []
+        try:
+            if totals and files is None:
+                files, size = self._totals(path, virtpath)
+            self._emit('walk_started', path, files, size)
+            # In worker processes, checker events can't be reported as
+            # they happen, so they're reported along with the results
+            replay = self.jobs > 1 or self._timed()
+            for summary in self._iter_check(path, virtpath, tmpdir):
+                if replay:
+                    for stats in summary.stats:
+                        self._emit('checker_started', summary.virtpath,
+                                   stats.checker)
+                        self._emit('checker_finished', summary.virtpath,
+                                   stats)
+                if self.thumb_store and summary.result.thumb:
+                    summary.result.thumb = self.thumb_store.add(
+                        summary.result.thumb)
+                    if self.dedup and not summary.duplicate_of:
+                        held.append(self.thumb_store.add(
+                            summary.result.thumb))
+                if self._sampler:
+                    summary.forced = not self._sampler.chosen(
+                        self._sample_path(summary.virtpath))
+                self._emit('file_done', summary)
+                yield summary
+        finally:
+            self._sampler = None
+            self._sample_root = None
+            self._encode_thumbs = False
+            for thumb in held:
+                self.thumb_store.discard(thumb)
+        self._emit('walk_finished', path, time.perf_counter() - start)
+
+    def _totals(self, path: Path, virtpath: Path,
+                sample: bool = True) -> Tuple[int, int]:
+        """Returns the number and total size of the files to check (or, if
+        sample is False, of all the files found, before sampling)."""
+        files = size = 0
+        walk = (self._walk(path, virtpath) if sample
+                else _files(path, virtpath, self._prune))
+        for fpath, _ in walk:
+            files += 1
+            try:
+                size += fpath.stat().st_size
+            except OSError:
+                pass
+        return files, size
+
+    def _emit(self, event: str, *args):
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
+
+    def _queued(self, path: Path, virtpath: Path, nesting: int):
+        if self.listeners:
+            try:
+                size = path.stat().st_size
+            except OSError:
+                size = 0
+            self._emit('file_queued', virtpath, size, nesting)
+
+    def _iter_check(self, path: Path, virtpath: Path,
+                    tmpdir: Path) -> Iterator[FileSummary]:
+        config = self.config() if self.cache else None
+        if self.jobs > 1 or self._timed():
+            yield from self._iter_check_parallel(
+                path, virtpath, tmpdir, config)
+        else:
+            self._index = ContentIndex() if self.dedup else None
+            try:
+                for fpath, fvirtpath in self._walk(path, virtpath):
+                    self._queued(fpath, fvirtpath, 0)
+                    summaries = self._cached(fpath, fvirtpath, config)
+                    if summaries is None:
+                        summaries = self._iter_tree(fpath, fvirtpath, tmpdir)
+                        if self.cache:
+                            summaries = list(summaries)
+                            self._store(fpath, fvirtpath, config, summaries)
+                    yield from summaries
+            finally:
+                self._index = None
+        if self.cache:
+            self.cache.flush()
+
+    def check_file(self, path: Path, virtpath: Path, tmpdir: Path,
+                   nesting: int = 0) -> List[FileSummary]:
+        """Runs the checkers against a single file.
+
+        The first summary is for the file itself. If the file is an archive
+        whose members were read directly from the archive, summaries for
+        the members follow it. Extracted contents are not checked. If the
+        runner is sampling, only some of the members are checked.
+
+        nesting is the number of archives the file was extracted from.
+        """
+        return self._check(path, None, path.stat().st_size, virtpath, tmpdir,
+                           nesting)
+
+    def _iter_tree(self, path: Path, virtpath: Path, tmpdir: Path,
+                   nesting: int = 0) -> Iterator[FileSummary]:
+        for summary in self.check_file(path, virtpath, tmpdir, nesting):
+            yield summary
+            extracted = summary.result.extracted
+            if extracted and not summary.duplicate_of:
+                self._emit('archive_extracted', summary)
+                try:
+                    for fpath, fvirtpath in _files(extracted,
+                                                   summary.virtpath,
+                                                   self._prune):
+                        self._queued(fpath, fvirtpath, nesting + 1)
+                        yield from self._iter_tree(fpath, fvirtpath, tmpdir,
+                                                   nesting + 1)
+                finally:
+                    shutil.rmtree(extracted, ignore_errors=True)
+
+    def _timed(self) -> bool:
+        return (self.file_timeout is not None
+                or self.checker_timeout is not None
+                or self.deadline is not None)
+
+    def _prune(self, virtpath: Path) -> bool:
+        return bool(self.checkers) and self.checkers[0].skips_tree(virtpath)
+
+    def _skips(self, virtpath: Path) -> bool:
+        return bool(self.checkers) and self.checkers[0].skips(virtpath)
+
+    def _original(self, index: ContentIndex, summary: FileSummary,
+                  path: Path, nesting: int) -> Optional[FileSummary]:
+        """Adds a file to the index, and returns the summary of an earlier
+        file with the same contents, if there is one.
+
+        Files the first checker skips by name aren't added, so that no copy
+        of one shares its skipped result.
+        """
+        if self._skips(summary.virtpath):
+            return None
+        # Extracted files are deleted after their archive is checked
+        return index.add((summary.size, summary.virtpath.suffix),
+                         partial(open, path, 'rb'), summary,
+                         reopenable=nesting == 0)
+
+    def _walk(self, path: Path,
+              virtpath: Path) -> Iterator[Tuple[Path, Path]]:
+        """Finds the files given to check_path, and samples them."""
+        return _sample(_files(path, virtpath, self._prune),
+                       self._sample_root, self._sampler)
+
+    def _sample_path(self, virtpath: Path) -> str:
+        """Returns the path the sampler identifies a file by."""
+        return virtpath.relative_to(self._sample_root).as_posix()
+
+    def _cached(self, path: Path, virtpath: Path,
+                config: str) -> List[FileSummary]:
+        summaries = None
+        if self.cache:
+            summaries = self.cache.get(path, virtpath, config)
+        if summaries is not None:
+            for summary in summaries:
+                # the file wasn't checked this time
+                summary.stats = []
+        return summaries
+
+    def _store(self, path: Path, virtpath: Path, config: str,
+               summaries: List[FileSummary]):
+        if self.cache and not any(isinstance(e, workers.TaskFailed)
+                                  for s in summaries for e in s.result.errors):
+            self.cache.put(path, virtpath, config, summaries)
+
+    def _check(self, path: Path, data: bytes, size: int, virtpath: Path,
+               tmpdir: Path, nesting: int,
+               is_member: bool = False) -> List[FileSummary]:
+        # Members read from an archive count towards the archive's time
+        # limit
+        workers.progress('member' if is_member else 'file', str(virtpath))
+        summary = FileSummary(virtpath=virtpath, size=size)
+        results = [summary]
+        if self._index is not None and not is_member:
+            original = self._original(self._index, summary, path, nesting)
+            if original:
+                summary.result = original.result
+                summary.duplicate_of = original.virtpath
+                return results
+        # The same request is given to each checker, so that the file's
+        # header is only read once
+        req = CheckRequest(
+            realpath=path, tmpdir=tmpdir, virtpath=virtpath,
+            thumb=self.depth == 'full', quick=self.depth == 'quick',
+            extract=self.extract, data=data, limits=self.limits,
+            nesting=nesting)
+        try:
             for checker in self.checkers:
-                req = CheckRequest(
-                    realpath=path, tmpdir=tmpdir, virtpath=virtpath,
-                    thumb=True)
-                res = checker.check(req)
+                req.select = self._sampler and self._sampler.selection(
+                    self._sample_path(virtpath))
+                req.bytes_read = 0
+                workers.progress('checker', str(checker))
+                self._emit('checker_started', virtpath, str(checker))
+                stats = CheckerStats(str(checker))
+                summary.stats.append(stats)
+                res = stats.measure(checker.check, req)
+                stats.bytes_read = req.bytes_read
                 if res.recognizer:
+                    stats.checker = str(res.recognizer)
+                    if res.thumb and self._encode_thumbs:
+                        # so the image can be freed right away (and is
+                        # smaller to send from a worker process)
+                        res.thumb = thumbs.Thumbnail.from_image(res.thumb)
                     summary.result = res
-                    if res.extracted:
-                        results.extend(
-                            self.check_path(res.extracted, virtpath, tmpdir))
+                self._emit('checker_finished', virtpath, stats)
+                if res.recognizer:
                     break
+            members = summary.result.members
+            if members is not None:
+                summary.result.members = []
+                # Reading members is part of the archive checker's work
+                members = iter(members)
+                while True:
+                    member = stats.measure(next, members, None)
+                    stats.bytes_read = req.bytes_read
+                    if member is None:
+                        break
+                    results.extend(self._check(
+                        member.realpath, member.data, member.size,
+                        virtpath.joinpath(member.name), tmpdir,
+                        nesting + 1, is_member=True))
+        finally:
+            req.close()
         return results
+
+    def _iter_check_parallel(self, path: Path, virtpath: Path,
+                             tmpdir: Path,
+                             config: str) -> Iterator[FileSummary]:
+        worker = copy.copy(self)
+        worker.cache = None
+        worker.listeners = []
+        worker.thumb_store = None
+        # Duplicates are decided as the summaries are yielded, so in the
+        # same order as in a single process. Files are also compared as
+        # they're found, but only to guess which files needn't be sent to
+        # a worker: files in an archive are found when it's extracted,
+        # which may be after later files were found
+        index = ContentIndex() if self.dedup else None
+        guesses = ContentIndex() if self.dedup else None
+        # Maximum number of files given to check_path (or found in a
+        # directory given to it) that are queued ahead of the one whose
+        # summaries are being yielded
+        window = self.jobs * 4
+        with workers.WorkerPool(self.jobs, _init_worker, (worker,),
+                                self.file_timeout, self.checker_timeout,
+                                self.deadline) as pool:
+            # Archives are checked as soon as they're extracted, so keep
+            # track of which futures came from which archive in order to
+            # put the summaries back in the same order check_path uses
+            children = {}
+            # Futures whose extracted archives (if any) haven't been
+            # submitted to the pool yet
+            unexpanded = set()
+
+            # Bytes used by each extracted archive that hasn't been deleted
+            # yet, by path
+            extracted = {}
+            # Paths of the file each future is for, and the number of
+            # archives it's inside
+            paths = {}
+
+            def results(future):
+                try:
+                    return future.result()
+                except workers.TaskFailed as e:
+                    # The worker was killed, so there are no summaries for
+                    # the file's members
+                    fpath, fvirtpath, _ = paths[future]
+                    try:
+                        size = fpath.stat().st_size
+                    except OSError:
+                        size = 0
+                    return [FileSummary(
+                        size=size, virtpath=fvirtpath,
+                        result=CheckResult(errors=[e]),
+                        stats=[CheckerStats(type(e).__name__,
+                                            wall=e.elapsed,
+                                            start=time.time() - e.elapsed)])]
+
+            def submit(fpath, fvirtpath, nesting=0):
+                self._queued(fpath, fvirtpath, nesting)
+                # Probable duplicates are represented by a _Duplicate
+                # instead of a future
+                if guesses is not None and not self._skips(fvirtpath):
+                    size = fpath.stat().st_size
+                    if guesses.add((size, fvirtpath.suffix),
+                                   partial(open, fpath, 'rb'), True,
+                                   reopenable=nesting == 0):
+                        return _Duplicate(size, fpath, fvirtpath, nesting)
+                return start(fpath, fvirtpath, nesting)
+
+            def start(fpath, fvirtpath, nesting):
+                future = pool.submit(_check_file_in_worker, fpath, fvirtpath,
+                                     tmpdir, nesting)
+                unexpanded.add(future)
+                paths[future] = (fpath, fvirtpath, nesting)
+                return future
+
+            def expand(future):
+                unexpanded.discard(future)
+                nesting = paths[future][2]
+                for summary in results(future):
+                    if summary.result.extracted:
+                        self._emit('archive_extracted', summary)
+                        extracted[summary.result.extracted] = \
+                            _disk_usage(summary.result.extracted)
+                        children[id(summary)] = [
+                            submit(fpath, fvirtpath, nesting + 1)
+                            for fpath, fvirtpath
+                            in _files(summary.result.extracted,
+                                      summary.virtpath, self._prune)]
+
+            def flatten(items, keep=True):
+                # If keep is False, the items are in an archive that turned
+                # out to be a duplicate, so they're only waited for and
+                # cleaned up
+                for item in items:
+                    summary = None
+                    if isinstance(item, _Duplicate):
+                        if not keep:
+                            continue
+                        summary = FileSummary(size=item.size,
+                                              virtpath=item.virtpath)
+                        original = self._original(index, summary, item.path,
+                                                  item.nesting)
+                        if original:
+                            summary.result = original.result
+                            summary.duplicate_of = original.virtpath
+                            yield summary
+                            continue
+                        # The guess was wrong, so it's checked after all
+                        item = start(item.path, item.virtpath, item.nesting)
+                    # Keep the pool busy with the contents of any other
+                    # archives that finish while waiting for this file
+                    while item in unexpanded:
+                        done, _ = wait(unexpanded,
+                                       return_when=FIRST_COMPLETED)
+                        for future in done:
+                            expand(future)
+                    summaries = results(item)
+                    fpath, _, nesting = paths.pop(item)
+                    keep_item = keep
+                    for i, checked in enumerate(summaries):
+                        nested = children.pop(id(checked), [])
+                        if i == 0 and keep and summary is not None:
+                            # (the _Duplicate's summary is in the index)
+                            summary.result = checked.result
+                            summary.stats = checked.stats
+                            checked = summary
+                        elif i == 0 and keep and index is not None:
+                            original = self._original(index, checked, fpath,
+                                                      nesting)
+                            if original:
+                                # It was found before the file it
+                                # duplicates
+                                keep_item = False
+                                yield FileSummary(
+                                    size=checked.size,
+                                    virtpath=checked.virtpath,
+                                    result=original.result,
+                                    duplicate_of=original.virtpath)
+                        if keep_item:
+                            yield checked
+                        yield from flatten(nested, keep_item)
+                        if checked.result.extracted in extracted:
+                            shutil.rmtree(checked.result.extracted,
+                                          ignore_errors=True)
+                            del extracted[checked.result.extracted]
+
+            def over_temp():
+                return (self.max_temp is not None
+                        and sum(extracted.values()) > self.max_temp)
+
+            # Files with cached results are represented by the list of
+            # summaries instead of a future
+            queue = deque()
+            files = self._walk(path, virtpath)
+            while True:
+                # While too much is extracted, no more files are started;
+                # yielding the oldest file's summaries deletes the archives
+                # it extracted
+                while len(queue) < window and not (queue and over_temp()):
+                    fpath, fvirtpath = next(files, (None, None))
+                    if fpath is None:
+                        break
+                    summaries = self._cached(fpath, fvirtpath, config)
+                    if summaries is None:
+                        summaries = submit(fpath, fvirtpath)
+                    else:
+                        self._queued(fpath, fvirtpath, 0)
+                    queue.append((fpath, fvirtpath, summaries))
+                if not queue:
+                    break
+                fpath, fvirtpath, summaries = queue.popleft()
+                if not isinstance(summaries, list):
+                    summaries = flatten([summaries])
+                    if self.cache:
+                        summaries = list(summaries)
+                        self._store(fpath, fvirtpath, config, summaries)
+                yield from summaries
@@ -1,10 +1,111 @@
 """Implements the spotcheck command-line tool."""
 import argparse
+import json
 from pathlib import Path
-from typing import List
-from spot_check_files.checker import CheckerRunner
+import sys
+from tempfile import TemporaryDirectory
+import time
+from typing import Iterable, List
+from spot_check_files.cache import ResultCache
+from spot_check_files.checker import DEPTHS, ArchiveLimits, CheckerRunner,\
+    FileSummary
+from spot_check_files.events import ChromeTracer, ProgressLine
 from spot_check_files.filenames import FileNameChecker
-from spot_check_files.report import CheckReport
+from spot_check_files.report import CheckReport, can_print_thumbs,\
+    file_record
+from spot_check_files.results import ResultsReader, ResultsWriter
+from spot_check_files.sampling import Sampler
+from spot_check_files.thumbs import ThumbnailStore
+
+
+def _sample(arg: str) -> Sampler:
+    try:
+        if arg.endswith('%'):
+            return Sampler(fraction=float(arg[:-1]) / 100)
+        return Sampler(count=int(arg))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid sample size: {arg}')
+
+
+def _add_output_args(parser: argparse.ArgumentParser):
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-H', '--html', action='store_true', default=False,
+                        help='output HTML')
+    output.add_argument('--html-dir',
+                        help='write an HTML report to this directory instead'
+                        ' of printing a report; thumbnails are saved as'
+                        ' separate files, and long lists are split into'
+                        ' pages, so this works for any number of files')
+    output.add_argument('--ndjson', action='store_true', default=False,
+                        help='output one line of JSON for each file as soon'
+                        ' as it has been checked, followed by a line with'
+                        ' the statistics for each group of files')
+    parser.add_argument('--max-thumbs', type=int, default=1000,
+                        help='maximum number of thumbnails to display; if'
+                        ' more files have thumbnails, a random sample is'
+                        ' displayed (default: 1000)')
+    parser.add_argument('-P', '--performance', action='store_true',
+                        default=False,
+                        help='show how long each group of files, each'
+                        ' checker and the slowest files took to check')
+    parser.add_argument('--thumb-memory', type=int, default=64,
+                        help='approximate maximum size in MB of thumbnails'
+                        ' to keep in memory; the rest are kept in a'
+                        ' temporary file until the report is displayed'
+                        ' (default: 64)')
+
+
+def _output(summaries: Iterable[FileSummary], args: argparse.Namespace,
+            sampled: bool, writer: ResultsWriter = None):
+    """Adds the summaries to a report, and displays it.
+
+    The summaries' thumbnails should be in a thumbs.ThumbnailStore, which
+    only keeps the ones the report will display.
+    """
+    report = CheckReport(max_thumbs=args.max_thumbs,
+                         sampled=sampled,
+                         performance=args.performance,
+                         keep_summaries=not args.ndjson)
+    for summary in summaries:
+        # (before the report discards the thumbnail)
+        if writer:
+            writer.add(summary)
+        report.add(summary)
+        if args.ndjson:
+            print(json.dumps(file_record(summary)), flush=True)
+    if args.ndjson:
+        print(json.dumps(report.summary_record()))
+    elif args.html_dir:
+        report.write_html(Path(args.html_dir))
+    elif args.html:
+        print(report.html())
+    else:
+        report.print()
+
+
+def _report_main(args: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog=f'{Path(sys.argv[0]).name} report',
+        description='Displays results saved by spotcheck --save.')
+    parser.add_argument('file', help='results file to display')
+    _add_output_args(parser)
+    args = parser.parse_args(args)
+    try:
+        reader = ResultsReader(Path(args.file))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    def stored(summaries, store):
+        for summary in summaries:
+            if summary.result.thumb:
+                summary.result.thumb = store.add(summary.result.thumb)
+            yield summary
+
+    with TemporaryDirectory() as tmpdir, \
+            ThumbnailStore(Path(tmpdir),
+                           args.thumb_memory * 1024 * 1024) as store:
+        _output(stored(reader, store), args, reader.sampled)
+    return 0
 
 
 def main(args: List[str] = None) -> int:
@@ -12,29 +113,169 @@ def main(args: List[str] = None) -> int:
 
     See docs/usage.txt for usage.
 
-    If args is omitted, the process's command-line args are used.
+    If args is omitted, the process's command-line args are used. If the
+    first arg is "report" (and there's no file or folder named "report" to
+    check), the rest are handled by the report subcommand, which displays
+    saved results.
 
     Returns 0 to indicate success.
     """
-    parser = argparse.ArgumentParser()
+    if args is None:
+        args = sys.argv[1:]
+    if args[:1] == ['report'] and not Path('report').exists():
+        return _report_main(args[1:])
+    parser = argparse.ArgumentParser(
+        epilog='To display results saved with --save, use'
+        ' "%(prog)s report FILE" (see "%(prog)s report -h").')
     parser.add_argument('path', nargs='+', help='file or folders to check')
-    parser.add_argument('-H', '--html', action='store_true', default=False,
-                        help='output HTML')
+    parser.add_argument('--checker-timeout', type=float,
+                        help='maximum number of seconds a single checker may'
+                        ' spend on a file before giving up on the file')
+    parser.add_argument('-c', '--cache',
+                        help='file in which to cache results between runs;'
+                        ' files that have not changed since they were'
+                        ' cached are not checked again')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='maximum size of the cache in MB'
+                        ' (default: 1024)')
+    parser.add_argument('--cache-hash', action='store_true', default=False,
+                        help='use a hash of the contents of files, rather'
+                        ' than modification times, to decide whether they'
+                        ' have changed')
+    parser.add_argument('-d', '--dedup', action='store_true', default=False,
+                        help='check files with identical contents only once')
+    parser.add_argument('-D', '--depth', choices=DEPTHS,
+                        help='how thoroughly to check files: "quick" only'
+                        ' checks headers, "standard" validates files, and'
+                        ' "full" also makes thumbnails (default: full if'
+                        ' thumbnails will be displayed or saved, otherwise'
+                        ' standard)')
+    _add_output_args(parser)
+    parser.add_argument('--file-timeout', type=float,
+                        help='maximum number of seconds to spend checking a'
+                        ' single file (including any archive members read'
+                        ' without extracting them) before giving up on it;'
+                        ' files that are given up on are reported as'
+                        ' errors')
+    parser.add_argument('--max-nesting', type=int,
+                        default=ArchiveLimits.max_nesting,
+                        help='maximum number of archives a file may be'
+                        ' inside; more deeply nested archives are not'
+                        ' extracted (default: 10)')
+    parser.add_argument('--max-archive-size', type=int,
+                        help='maximum total size in MB of the members of an'
+                        ' archive; bigger archives are not extracted')
+    parser.add_argument('--max-members', type=int,
+                        help='maximum number of members an archive may have;'
+                        ' archives with more are not extracted')
+    parser.add_argument('--max-ratio', type=float,
+                        default=ArchiveLimits.max_ratio,
+                        help='maximum ratio of the total size of the members'
+                        ' of an archive to the size of the archive; more'
+                        ' compressed archives are not extracted'
+                        ' (default: 1000)')
+    parser.add_argument('--max-temp', type=int,
+                        help='approximate maximum size in MB of extracted'
+                        ' files to keep at once; when using multiple jobs,'
+                        ' no more files are started while this is exceeded')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to use for checking files')
+    parser.add_argument('--no-extract', dest='extract',
+                        action='store_false', default=True,
+                        help='check zip and tar members directly from the'
+                        ' archive instead of extracting them to a temporary'
+                        ' directory')
+    parser.add_argument('--no-progress', dest='progress',
+                        action='store_false', default=sys.stderr.isatty(),
+                        help='do not display a progress line on stderr (it'
+                        ' is only displayed if stderr is a terminal)')
+    parser.add_argument('--eta', action='store_true', default=False,
+                        help='count the files before checking them, so the'
+                        ' progress line can show the estimated time'
+                        ' remaining (this walks the folders an extra time,'
+                        ' unless --sample is given a number of files)')
+    parser.add_argument('-S', '--sample', type=_sample,
+                        help='only check a random sample of files: either'
+                        ' a number of files (e.g. "1000"), or a percentage'
+                        ' (e.g. "5%%"). The sample is stratified by file'
+                        ' extension and size, and includes files inside'
+                        ' archives; the report estimates the error rate of'
+                        ' each group of files')
+    parser.add_argument('-o', '--save',
+                        help='also save the results to this file, so they can'
+                        ' be displayed again with the report subcommand')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for choosing the sample; the same seed'
+                        ' chooses the same files (default: 0)')
+    parser.add_argument('--trace',
+                        help='file to write a trace of when each checker ran'
+                        ' to, in Chrome trace event format (for'
+                        ' chrome://tracing or Perfetto)')
+    parser.add_argument('--time-limit', type=float,
+                        help='maximum number of seconds to spend checking'
+                        ' files; files that are not finished by then are'
+                        ' reported as errors')
     parser.add_argument('-s', '--skip', action='append', default=[],
                         help='patterns of paths to skip'
                         ' (see python fnmatch module for pattern format).'
                         ' These can be paths within archives, e.g.'
-                        ' "test.zip/foo.png"')
+                        ' "test.zip/foo.png". Directories matched by'
+                        ' patterns like "*/build/*" are not walked at all')
     args = parser.parse_args(args)
-    runner = CheckerRunner.default()
+    depth = args.depth
+    if not depth:
+        if args.save or (not args.ndjson
+                         and (args.html or args.html_dir
+                              or can_print_thumbs())):
+            depth = 'full'
+        else:
+            depth = 'standard'
+    runner = CheckerRunner.default(jobs=args.jobs,
+                                   extract=args.extract,
+                                   dedup=args.dedup,
+                                   depth=depth)
     next(c for c in runner.checkers if isinstance(c, FileNameChecker))\
         .blacklist.extend(args.skip)
-    summaries = []
-    for path in args.path:
-        summaries.extend(runner.check_path(Path(path)))
-    report = CheckReport(summaries)
-    if args.html:
-        print(report.html())
-    else:
-        report.print()
+    runner.limits = ArchiveLimits(
+        max_nesting=args.max_nesting,
+        max_size=args.max_archive_size and args.max_archive_size * 1024 * 1024,
+        max_members=args.max_members,
+        max_ratio=args.max_ratio)
+    if args.max_temp is not None:
+        runner.max_temp = args.max_temp * 1024 * 1024
+    runner.file_timeout = args.file_timeout
+    runner.checker_timeout = args.checker_timeout
+    if args.time_limit is not None:
+        runner.deadline = time.monotonic() + args.time_limit
+    if args.cache:
+        runner.cache = ResultCache(Path(args.cache),
+                                   max_size=args.cache_size * 1024 * 1024,
+                                   hash=args.cache_hash)
+    if args.sample:
+        args.sample.seed = args.seed
+        runner.sampler = args.sample
+    if args.progress:
+        runner.listeners.append(ProgressLine(totals=args.eta))
+    if args.trace:
+        runner.listeners.append(ChromeTracer(Path(args.trace)))
+    writer = args.save and ResultsWriter(Path(args.save),
+                                         sampled=bool(args.sample))
+    tmpdir = TemporaryDirectory()
+    runner.thumb_store = ThumbnailStore(Path(tmpdir.name),
+                                        args.thumb_memory * 1024 * 1024)
+    try:
+        _output((summary for path in args.path
+                 for summary in runner.iter_check(Path(path),
+                                                  tmpdir=Path(tmpdir.name))),
+                args, bool(args.sample), writer)
+    finally:
+        runner.thumb_store.close()
+        tmpdir.cleanup()
+        if writer:
+            writer.close()
+        if runner.cache:
+            runner.cache.close()
+        for listener in runner.listeners:
+            if isinstance(listener, ChromeTracer):
+                listener.close()
     return 0
@@ -0,0 +1,283 @@
+"""Validates CSV data in chunks, which can be checked in parallel.
+
+sniff determines the dialect of a file from a sample of its start, and
+split finds where a file can probably be divided into chunks without
+breaking a record. Each chunk can then be given to check_chunk on its own,
+which checks that every record parses and has the expected number of
+columns.
+
+split guesses whether a newline is inside a quoted field by counting the
+quotes before it, which is wrong if an unquoted field contains a quote
+(like 'tv 5" screen'). check_chunk parses the chunk the way csv.reader
+would parse the whole file, so if a chunk starts at the start of a record,
+its result says whether it really ended at the end of one; if not, check
+it again along with the next chunk.
+"""
+import csv
+from dataclasses import dataclass, field
+import io
+import mmap
+from typing import IO, Iterable, List, Optional, Tuple, Union
+
+
+# Delimiters sniff tries, in order of preference
+DELIMITERS = ',\t;|:'
+
+# Quote characters sniff looks for, in order of preference
+QUOTECHARS = '"\''
+
+# Minimum fraction of the rows in a sample split by a delimiter that must
+# have the same number of columns for sniff to accept it
+_CONSISTENCY = 0.9
+
+# Maximum number of invalid rows check_chunk describes
+MAX_ERRORS = 10
+
+
+@dataclass
+class Dialect:
+    """The format of a CSV file.
+
+    Unlike csv.Dialect subclasses made by csv.Sniffer, instances can be
+    pickled, so they can be sent to other processes.
+
+    Attributes:
+        delimiter - character that separates fields
+        quotechar - character that quotes fields containing special
+                    characters
+        skipinitialspace - whether whitespace after a delimiter is ignored
+    """
+    delimiter: str = ','
+    quotechar: str = '"'
+    skipinitialspace: bool = False
+
+    def reader(self, lines: Iterable[str], strict: bool = False):
+        """Returns a csv.reader for the lines, using this dialect."""
+        return csv.reader(lines, delimiter=self.delimiter,
+                          quotechar=self.quotechar,
+                          skipinitialspace=self.skipinitialspace,
+                          strict=strict)
+
+
+def sniff(sample: str, complete: bool = False) -> Dialect:
+    """Determines the dialect of CSV data from a sample of its start.
+
+    This is a faster alternative to csv.Sniffer().sniff: the quote
+    character is the first of QUOTECHARS in the sample, and the sample is
+    parsed with each of DELIMITERS, choosing the one that splits the
+    largest fraction of rows into the same number of columns (then the
+    most rows). Rows the delimiter doesn't
+    split at all (like notes, or lines of a broken record) are ignored, but
+    at least 90% of the rest must agree, and unless the sample is a single
+    row, at least two rows must be split.
+    Unless complete is True, the sample is assumed to end partway through
+    a record, so its last record is ignored.
+
+    Raises csv.Error if no delimiter splits the rows consistently.
+    """
+    end = sample.rfind('\n') + 1
+    body = sample if complete or not end else sample[:end]
+    quotechar = next((q for q in QUOTECHARS if q in body), QUOTECHARS[0])
+    best = None
+    best_score = None
+    for delimiter in DELIMITERS:
+        if delimiter not in body:
+            continue
+        dialect = Dialect(delimiter, quotechar,
+                          body.count(delimiter + ' ') == body.count(delimiter))
+        try:
+            rows = [row for row in
+                    dialect.reader(io.StringIO(body, newline='')) if row]
+        except csv.Error:
+            continue
+        if not complete and len(rows) > 1:
+            # The last record may continue after the sample
+            rows.pop()
+        counts = [len(row) for row in rows if len(row) > 1]
+        if not counts or (len(counts) < 2 and len(rows) > 1):
+            continue
+        columns = max(set(counts), key=counts.count)
+        consistent = counts.count(columns)
+        if consistent < _CONSISTENCY * len(counts):
+            continue
+        score = (consistent / len(counts), consistent)
+        if best_score is None or score > best_score:
+            best = dialect
+            best_score = score
+    if best is None:
+        raise csv.Error('Could not determine delimiter')
+    return best
+
+
+def _line_end(data: Union[bytes, mmap.mmap], pos: int) -> int:
+    return data.find(b'\n', pos) + 1 or len(data)
+
+
+def _record_end(data: Union[bytes, mmap.mmap], pos: int, quote: bytes,
+                odd: bool, limit: int) -> int:
+    """Returns the position after the first newline at or after pos that
+    seems not to be inside a quoted field, or len(data) if there isn't one.
+
+    odd says whether there are an odd number of quotes between the start
+    of the record and pos. If no quote closes the field before limit, this
+    gives up, and returns the position after the first newline at or after
+    limit.
+    """
+    newline = data.find(b'\n', pos)
+    if newline < 0:
+        return len(data)
+    # mmap has no count method
+    odd = odd != (data[pos:newline].count(quote) % 2 == 1)
+    pos = newline + 1
+    while odd:
+        # The next newline after the closing quote may end the record
+        closing = data.find(quote, pos)
+        if closing < 0 or closing >= limit:
+            return _line_end(data, limit)
+        newline = data.find(b'\n', closing + 1)
+        if newline < 0:
+            return len(data)
+        odd = data[closing + 1:newline].count(quote) % 2 == 1
+        pos = newline + 1
+    return pos
+
+
+def split(data: Union[bytes, mmap.mmap], chunk_size: int,
+          quote: bytes = b'"') -> List[Tuple[int, int]]:
+    """Divides CSV data into chunks of whole records.
+
+    Returns (start, end) tuples for chunks of about chunk_size bytes (at
+    most about twice that, unless there's a very long line), each ending
+    just after a newline that seems not to be inside a quoted field (or at
+    the end of data). The data must use an encoding in which the quote and
+    newline are single bytes that can't occur inside other characters.
+    """
+    ranges = []
+    start = 0
+    while start < len(data):
+        # Like read_chunk, end at the newline before this position if there
+        # is one
+        pos = min(start + chunk_size, len(data)) - 1
+        end = _record_end(data, pos, quote,
+                          data[start:pos].count(quote) % 2 == 1,
+                          pos + chunk_size)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def read_chunk(file: IO[bytes], chunk_size: int,
+               quote: bytes = b'"') -> bytes:
+    """Reads about chunk_size bytes of whole records from a binary file.
+
+    The result is empty at the end of the file. The chunk ends where split
+    would end it.
+    """
+    parts = [file.read(chunk_size)]
+    size = len(parts[0])
+    odd = parts[0].count(quote) % 2 == 1
+    # Where split gives up on finding the end of a quoted field
+    limit = 2 * chunk_size - 1
+    while parts[-1] and (not parts[-1].endswith(b'\n')
+                         or (odd and size <= limit)):
+        parts.append(file.readline())
+        size += len(parts[-1])
+        odd = (parts[-1].count(quote) % 2 == 1) != odd
+    return b''.join(parts)
+
+
+@dataclass
+class ChunkResult:
+    """What check_chunk found in a chunk of CSV data.
+
+    Row and line numbers start at 1 at the start of the chunk.
+
+    Attributes:
+        rows - number of records in the chunk (including blank lines)
+        lines - number of lines in the chunk
+        bad - number of invalid records
+        errors - (row, line, description) for each of the first MAX_ERRORS
+                 invalid records, where line is the line the record starts
+                 on
+        head - the first records, if check_chunk was asked to keep them
+        complete - False if the last record ran into the end of the chunk
+                   (or had some other quoting error), in which case the
+                   chunk may have ended inside a quoted field
+    """
+    rows: int = 0
+    lines: int = 0
+    bad: int = 0
+    errors: List[Tuple[int, int, str]] = field(default_factory=list)
+    head: List[List[str]] = field(default_factory=list)
+    complete: bool = True
+
+
+def _decode(data: bytes, encoding: str) -> Tuple[str, List[Tuple]]:
+    """Decodes data, replacing undecodable bytes with U+FFFD.
+
+    Returns the text, and a (line number, description) tuple for each
+    undecodable sequence.
+    """
+    view = memoryview(data)
+    parts = []
+    errors = []
+    pos = 0
+    lineno = 1
+    while True:
+        try:
+            parts.append(str(view[pos:], encoding))
+            return ''.join(parts), errors
+        except UnicodeDecodeError as e:
+            parts.append(str(view[pos:pos + e.start], encoding))
+            parts.append('\ufffd')
+            lineno += data.count(b'\n', pos, pos + e.start)
+            bad = data[pos + e.start:pos + e.end].hex()
+            errors.append((lineno, f"'{e.encoding}' codec can't decode"
+                           f' bytes 0x{bad}: {e.reason}'))
+            lineno += data.count(b'\n', pos + e.start, pos + e.end)
+            pos += e.end
+
+
+def check_chunk(data: bytes, dialect: Dialect, columns: Optional[int],
+                encoding: str, head: int = 0) -> ChunkResult:
+    """Checks each record in a chunk of CSV data.
+
+    A record is invalid if it contains bytes that can't be decoded, if it
+    isn't quoted properly, or if it doesn't have the given number of
+    columns (or, if columns is None, the same number as the first record in
+    the chunk). Blank lines are allowed. The first head records that parse
+    are kept in the result, e.g. for a thumbnail.
+    """
+    text, decode_errors = _decode(data, encoding)
+    decode_errors.reverse()
+    result = ChunkResult()
+    reader = dialect.reader(io.StringIO(text, newline=''), strict=True)
+    while True:
+        start = reader.line_num + 1
+        try:
+            row = next(reader)
+            error = None
+        except StopIteration:
+            break
+        except csv.Error as e:
+            row = None
+            error = str(e)
+        result.rows += 1
+        result.complete = row is not None
+        if row is not None and len(result.head) < head:
+            result.head.append(row)
+        # Decoding errors in this record
+        while decode_errors and decode_errors[-1][0] <= reader.line_num:
+            description = decode_errors.pop()[1]
+            error = error or description
+        if row:
+            if columns is None:
+                columns = len(row)
+            elif len(row) != columns and not error:
+                error = f'{len(row)} columns, expected {columns}'
+        if error:
+            result.bad += 1
+            if len(result.errors) < MAX_ERRORS:
+                result.errors.append((result.rows, start, error))
+    result.lines = reader.line_num
+    return result
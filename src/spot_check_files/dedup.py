@@ -0,0 +1,107 @@
+"""Finds files with identical contents, so each only needs checking once.
+
+The ContentIndex class groups files by size (and anything else the caller
+wants to distinguish them by), and only hashes them (first a single block,
+then the whole file) when a file's group matches that of an earlier one.
+Within a group, files are looked up by the hash of their first block, and
+then by the hash of their whole contents, which is only computed when the
+first blocks of two files match.
+Files that won't be available later (like the members of an archive) are
+hashed as they're added if their group already has other files in it; if
+not, they can't be compared with anything, but a later file in the group
+is hashed in turn, so any copies after that are found.
+"""
+import hashlib
+from typing import IO, Any, Callable, Dict, Hashable, Optional
+
+
+# Size in bytes of the block hashed before hashing a whole file
+_BLOCK_SIZE = 4096
+
+
+class _Entry:
+    def __init__(self, opener: Callable[[], IO], value: Any):
+        self.opener = opener
+        self.value = value
+        self._first = None
+        self._full = None
+
+    def first(self) -> bytes:
+        if self._first is None:
+            with self.opener() as file:
+                self._first = hashlib.sha256(file.read(_BLOCK_SIZE)).digest()
+        return self._first
+
+    def full(self) -> bytes:
+        if self._full is None:
+            sha = hashlib.sha256()
+            with self.opener() as file:
+                for block in iter(lambda: file.read(1024 * 1024), b''):
+                    sha.update(block)
+            self._full = sha.digest()
+        return self._full
+
+
+class _Block:
+    """The files in a group whose first blocks have the same hash."""
+    def __init__(self):
+        # A file whose full hash hasn't been needed yet
+        self.unhashed: Optional[_Entry] = None
+        # Values of the files whose full hashes are known, by full hash
+        self.values: Dict[bytes, Any] = {}
+
+
+class _Group:
+    def __init__(self):
+        # The first file added, if it was reopenable, until another file
+        # is added to the group
+        self.unhashed: Optional[_Entry] = None
+        self.blocks: Dict[bytes, _Block] = {}
+
+
+class ContentIndex:
+    """Remembers files by content, to find duplicates of them."""
+    def __init__(self):
+        self._groups: Dict[Hashable, _Group] = {}
+
+    def add(self, group: Hashable, opener: Callable[[], IO], value: Any,
+            reopenable: bool = True) -> Any:
+        """Adds a file to the index, unless it duplicates an earlier one.
+
+        If an earlier file in the same group had the same contents, its
+        value is returned and this file is not added. Otherwise, None is
+        returned. The group must include the file's size.
+
+        opener must return a binary stream of the file's contents. If the
+        file will not be available later (reopenable is False) and the
+        group already has files in it, the file is hashed now, since more
+        files in the group may be added afterwards. If the group is new, it
+        isn't read at all, so a later file with the same contents is not
+        found to be a duplicate of it (but is hashed, so later copies are).
+        """
+        entry = _Entry(opener, value)
+        files = self._groups.get(group)
+        if files is None:
+            files = self._groups[group] = _Group()
+            if reopenable:
+                files.unhashed = entry
+            return None
+        if files.unhashed is not None:
+            first = files.unhashed
+            files.unhashed = None
+            files.blocks.setdefault(first.first(), _Block()).unhashed = first
+        block = files.blocks.get(entry.first())
+        if block is None:
+            block = files.blocks[entry.first()] = _Block()
+            if reopenable:
+                block.unhashed = entry
+                return None
+        elif block.unhashed is not None:
+            other = block.unhashed
+            block.unhashed = None
+            block.values[other.full()] = other.value
+        full = entry.full()
+        if full in block.values:
+            return block.values[full]
+        block.values[full] = entry.value
+        return None
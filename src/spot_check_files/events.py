@@ -0,0 +1,239 @@
+"""Lets callers follow the progress of a CheckerRunner as it works.
+
+The RunnerListener class defines the events a CheckerRunner reports to each
+of its listeners. ProgressLine uses them to display a live progress line
+in the terminal, and ChromeTracer writes them to a file in the Chrome trace
+event format, which can be loaded in chrome://tracing or Perfetto to see
+when each checker ran in each process.
+"""
+import json
+import os
+from pathlib import Path
+import shutil
+import sys
+import time
+from typing import IO, Optional
+from spot_check_files.checker import CheckerStats, FileSummary
+
+
+class RunnerListener:
+    """Receives events from a CheckerRunner (see CheckerRunner.listeners).
+
+    All methods do nothing by default. They are called in the process that
+    called CheckerRunner.check_path. When using multiple jobs (or time
+    limits), files are checked in other processes, so checker_started and
+    checker_finished are only called for a file when its results are
+    ready, just before file_done; the CheckerStats record when the checker
+    actually ran.
+
+    Attributes:
+        totals - if True, the runner counts the files to be checked before
+                 checking them, so that walk_started can be given totals.
+                 This walks the whole tree before any files are checked,
+                 unless the runner is sampling a number of files, in
+                 which case the totals are estimated from the walk that
+                 counts the files to sample from.
+    """
+    totals = False
+
+    def walk_started(self, path: Path, files: Optional[int],
+                     size: Optional[int]):
+        """Called when the runner starts checking a path.
+
+        files and size are the number and total size in bytes of the files
+        that will be checked (not counting the contents of archives), or
+        None if no listener's totals attribute is True.
+        """
+
+    def file_queued(self, virtpath: Path, size: int, nesting: int):
+        """Called when a file is found that will be checked.
+
+        This includes files given to check_path (or found in directories
+        given to it), for which nesting is 0, and files extracted from
+        archives. Members read directly from archives are checked along
+        with the archive, so they are not queued separately.
+        """
+
+    def checker_started(self, virtpath: Path, checker: str):
+        """Called before running a checker on a file."""
+
+    def checker_finished(self, virtpath: Path, stats: CheckerStats):
+        """Called after running a checker on a file."""
+
+    def archive_extracted(self, summary: FileSummary):
+        """Called when a file is an archive that was extracted.
+
+        summary.result.extracted is the directory it was extracted to.
+        """
+
+    def file_done(self, summary: FileSummary):
+        """Called as each summary is yielded by CheckerRunner.iter_check."""
+
+    def walk_finished(self, path: Path, elapsed: float):
+        """Called when the runner has finished checking a path."""
+
+
+def _duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
+
+
+class ProgressLine(RunnerListener):
+    """Displays a line showing the progress of a CheckerRunner.
+
+    The line is redrawn in place (so the stream should be a terminal) at
+    most every interval seconds, and erased when the runner finishes a
+    path. If totals is True, the estimated time remaining is shown, based
+    on the total size of the files given to check_path, since the sizes
+    of archives' contents aren't known ahead of time.
+
+    Attributes:
+        stream - where to write the line
+        interval - minimum number of seconds between redraws
+        totals - whether to have the runner count the files before
+                 checking them (see RunnerListener.totals), to show the
+                 estimated time remaining
+    """
+    def __init__(self, stream: IO = None, interval: float = 0.1,
+                 totals: bool = False):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.totals = totals
+        self._size = None
+        self._start = None
+        self._drawn = 0
+        self._count = 0
+        self._bytes = 0
+        self._done_bytes = 0
+        self._current = None
+        # Sizes of queued files given to check_path, by virtpath
+        self._queued = {}
+
+    def walk_started(self, path: Path, files: Optional[int],
+                     size: Optional[int]):
+        self._size = size
+        self._start = time.monotonic()
+        self._count = self._bytes = self._done_bytes = 0
+        self._queued.clear()
+
+    def file_queued(self, virtpath: Path, size: int, nesting: int):
+        if nesting == 0:
+            self._queued[virtpath] = size
+
+    def checker_started(self, virtpath: Path, checker: str):
+        self._current = virtpath
+        self._redraw()
+
+    def file_done(self, summary: FileSummary):
+        self._count += 1
+        self._bytes += summary.size
+        self._done_bytes += self._queued.pop(summary.virtpath, 0)
+        self._current = summary.virtpath
+        self._redraw()
+
+    def walk_finished(self, path: Path, elapsed: float):
+        self._write('')
+
+    def line(self) -> str:
+        """Returns the text of the progress line."""
+        elapsed = time.monotonic() - self._start
+        parts = [f'{self._count} files']
+        if elapsed:
+            parts.append(f'{self._count / elapsed:.1f} files/s')
+            parts.append(f'{self._bytes / elapsed / 1024 / 1024:.1f} MB/s')
+        if self._size and self._done_bytes:
+            remaining = (self._size - self._done_bytes) \
+                * elapsed / self._done_bytes
+            parts.append(f'ETA {_duration(remaining)}')
+        if self._current:
+            parts.append(str(self._current))
+        return ', '.join(parts)
+
+    def _redraw(self):
+        now = time.monotonic()
+        if now - self._drawn < self.interval:
+            return
+        self._drawn = now
+        self._write(self.line())
+
+    def _write(self, text: str):
+        width = shutil.get_terminal_size().columns - 1
+        text = text[:width]
+        self.stream.write('\r' + text.ljust(width) + '\r')
+        self.stream.flush()
+
+
+class ChromeTracer(RunnerListener):
+    """Writes events to a file in the Chrome trace event format.
+
+    Each checker run on a file is a complete ("X") event in the track of
+    the process that ran it, with the file's path, the bytes read and the
+    CPU time as arguments. Files being queued, archives being extracted
+    and files being done are instant events in the track of the process
+    running check_path, and each path given to check_path is a complete
+    event in a track of its own.
+
+    The file uses the JSON array format, and is written as events arrive,
+    so the tracer's memory use doesn't grow with the number of files.
+    Call close when done.
+    """
+    def __init__(self, path: Path):
+        self._file = open(path, 'w')
+        self._file.write('[\n')
+        self._pid = os.getpid()
+        self._walk_start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Finishes writing the file."""
+        if not self._file.closed:
+            self._event({'name': 'process_name', 'ph': 'M',
+                         'pid': self._pid,
+                         'args': {'name': 'spotcheck'}}, last=True)
+            self._file.close()
+
+    def _event(self, event: dict, last: bool = False):
+        self._file.write(json.dumps(event))
+        self._file.write('\n]\n' if last else ',\n')
+
+    def _instant(self, name: str, virtpath: Path, **args):
+        self._event({'name': name, 'cat': 'runner', 'ph': 'i', 's': 't',
+                     'ts': time.time() * 1e6, 'pid': self._pid,
+                     'tid': self._pid,
+                     'args': dict(file=str(virtpath), **args)})
+
+    def walk_started(self, path: Path, files: Optional[int],
+                     size: Optional[int]):
+        self._walk_start = time.time()
+
+    def file_queued(self, virtpath: Path, size: int, nesting: int):
+        self._instant('queued', virtpath, size=size, nesting=nesting)
+
+    def checker_finished(self, virtpath: Path, stats: CheckerStats):
+        if stats.start is None:
+            return
+        pid = stats.pid or 0
+        self._event({'name': stats.checker, 'cat': 'checker', 'ph': 'X',
+                     'ts': stats.start * 1e6, 'dur': stats.wall * 1e6,
+                     'pid': pid, 'tid': pid,
+                     'args': {'file': str(virtpath), 'cpu': stats.cpu,
+                              'bytes_read': stats.bytes_read}})
+
+    def archive_extracted(self, summary: FileSummary):
+        self._instant('extracted', summary.virtpath)
+
+    def file_done(self, summary: FileSummary):
+        self._instant('done', summary.virtpath, size=summary.size,
+                      errors=len(summary.result.errors))
+
+    def walk_finished(self, path: Path, elapsed: float):
+        self._event({'name': f'check {path}', 'cat': 'runner', 'ph': 'X',
+                     'ts': self._walk_start * 1e6, 'dur': elapsed * 1e6,
+                     'pid': self._pid, 'tid': 0,
+                     'args': {'path': str(path)}})
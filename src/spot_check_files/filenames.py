@@ -1,11 +1,68 @@
 """Logic for selecting a Checker based on filenames (e.g. file extension)."""
 from __future__ import annotations
 import fnmatch
-from typing import List, Tuple
+import os
+from pathlib import Path
+import re
+from typing import List, Optional, Tuple
 from spot_check_files.archives import TarChecker, ZipChecker
 from spot_check_files.basics import CSVChecker, ImageChecker,\
-    JSONChecker, PlaintextChecker, XMLChecker
+    JSONChecker, NDJSONChecker, PlaintextChecker, XMLChecker
 from spot_check_files.checker import Checker, CheckResult, CheckRequest
+from spot_check_files.magic import MagicChecker
+
+
+# Matches patterns like "*.txt" or "*.tar.gz", which can be looked up by
+# suffix instead of being matched one by one
+_SUFFIX_PATTERN = re.compile(r'\*(\.[^*?\[]+)')
+
+
+class _PatternIndex:
+    """Finds the first of a list of fnmatch patterns that matches a name.
+
+    Patterns of the form "*.ext" are kept in a dict keyed by suffix, and
+    the rest are combined into a single regular expression.
+    """
+    def __init__(self, patterns: List[str]):
+        self._suffixes = {}
+        # Index of the first pattern in the regex
+        self._first_other = None
+        others = []
+        for i, pattern in enumerate(patterns):
+            pattern = os.path.normcase(pattern)
+            match = _SUFFIX_PATTERN.fullmatch(pattern)
+            if match:
+                self._suffixes.setdefault(match.group(1), i)
+            else:
+                if self._first_other is None:
+                    self._first_other = i
+                others.append(f'(?P<p{i}>{fnmatch.translate(pattern)})')
+        # Number of dots in the longest suffix, i.e. how many of a name's
+        # suffixes need looking up
+        self._dots = max((s.count('.') for s in self._suffixes), default=0)
+        self._regex = re.compile('|'.join(others)) if others else None
+
+    def first(self, name: str) -> Optional[int]:
+        """Returns the index of the first matching pattern, or None."""
+        name = os.path.normcase(name)
+        best = None
+        end = len(name)
+        for _ in range(self._dots):
+            end = name.rfind('.', 0, end)
+            if end < 0:
+                break
+            i = self._suffixes.get(name[end:])
+            if i is not None and (best is None or i < best):
+                best = i
+        if self._regex and (best is None or self._first_other < best):
+            # Alternatives are tried in order, so this is the first match
+            # among the patterns in the regex
+            match = self._regex.match(name)
+            if match:
+                i = int(match.lastgroup[1:])
+                if best is None or i < best:
+                    best = i
+        return best
 
 
 class FileNameChecker(Checker):
@@ -18,19 +75,31 @@ class FileNameChecker(Checker):
 
     Attributes:
         blacklist - list of filename patterns (as specified in fnmatch
-                    module) to mark as skipped
+                    module) to mark as skipped. A directory is not walked
+                    at all if a pattern ending in * matches its path
+                    followed by a separator, e.g. "*/node_modules/*".
         checkers - list of tuples mapping filename pattern
                    (as specified in fnmatch module) to Checker
+        magic - optional MagicChecker. If the Checker matching the filename
+                does not recognize the file, this is used to add an error
+                saying what kind of file the contents look like, if it's
+                one that a different Checker handles.
+
+    The patterns are compiled into an index for fast matching, which is
+    rebuilt if either list is changed.
     """
 
     @classmethod
     def default(cls) -> FileNameChecker:
         """Returns an instance configured for some standard file types."""
         ctar = TarChecker()
+        cndjson = NDJSONChecker()
         checkers = [
             ('*.csv', CSVChecker()),
             ('*.json', JSONChecker()),
+            ('*.jsonl', cndjson),
             ('*.md', PlaintextChecker()),
+            ('*.ndjson', cndjson),
             ('*.tar', ctar),
             ('*.tar.bz2', ctar),
             ('*.tar.gz', ctar),
@@ -59,7 +128,7 @@ class FileNameChecker(Checker):
         cimg = ImageChecker()
         checkers.extend((f'*.{ext}', cimg) for ext in img_exts)
 
-        return cls(checkers)
+        return cls(checkers, magic=MagicChecker.default())
 
     def __str__(self):
         # TODO it's bad that this doesn't include any details about
@@ -70,23 +139,63 @@ class FileNameChecker(Checker):
         return 'FileNameChecker'
 
     def __init__(self, checkers: List[Tuple[str, Checker]] = [],
-                 blacklist=[]):
+                 blacklist=[], magic: MagicChecker = None):
         self.blacklist = list(blacklist)
         self.checkers = list(checkers)
+        self.magic = magic
+        self._compiled = None
+        self._index()
+
+    def __getstate__(self):
+        # The index can be rebuilt, and leaving it out keeps pickles (which
+        # CheckerRunner.config uses) the same whether or not it's built
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+
+    def _index(self) -> Tuple[_PatternIndex, _PatternIndex]:
+        key = (tuple(self.blacklist), tuple(self.checkers))
+        if self._compiled is None or self._compiled[0] != key:
+            self._compiled = (
+                key,
+                _PatternIndex(self.blacklist),
+                _PatternIndex([pattern for pattern, _ in self.checkers]))
+        return self._compiled[1:]
 
     def check(self, req: CheckRequest) -> CheckResult:
-        vpstr = str(req.virtpath)
-        for pattern in self.blacklist:
-            if fnmatch.fnmatch(vpstr, pattern):
-                return CheckResult(recognizer=self,
-                                   skipped=True)
-        for (pattern, checker) in self.checkers:
-            if fnmatch.fnmatch(vpstr, pattern):
-                result = checker.check(req)
-                if result.recognizer is None:
-                    result.recognizer = self
-                    result.errors.append(
-                        f'expected to be recognized by {checker} because '
-                        f'filename matched: {pattern}')
-                return result
+        if self.skips(req.virtpath):
+            return CheckResult(recognizer=self,
+                               skipped=True)
+        i = self._index()[1].first(str(req.virtpath))
+        if i is not None:
+            pattern, checker = self.checkers[i]
+            result = checker.check(req)
+            if result.recognizer is None:
+                result.recognizer = self
+                result.errors.append(
+                    f'expected to be recognized by {checker} because '
+                    f'filename matched: {pattern}')
+                self._add_hint(req, checker, result)
+            return result
         return CheckResult()
+
+    def _add_hint(self, req: CheckRequest, checker: Checker,
+                  result: CheckResult):
+        if not self.magic:
+            return
+        try:
+            match = self.magic.identify(req)
+        except OSError:
+            return
+        if match and type(match[1]) is not type(checker):
+            result.errors.append(f'contents look like {match[0]}')
+
+    def skips(self, virtpath: Path) -> bool:
+        return self._index()[0].first(str(virtpath)) is not None
+
+    def skips_tree(self, virtpath: Path) -> bool:
+        # If a pattern ending in * matches the directory's path with a
+        # trailing separator, the * can absorb the rest of any path in it
+        dirstr = os.path.join(str(virtpath), '')
+        return any(pattern.endswith('*') and fnmatch.fnmatch(dirstr, pattern)
+                   for pattern in self.blacklist)
@@ -0,0 +1,327 @@
+"""Validates JSON incrementally, without loading the whole document.
+
+validate reads a text stream in chunks and checks that it holds exactly one
+well-formed JSON value (accepting the same documents as json.load), using
+memory that doesn't depend on the size of the document. It can also write
+a pretty-printed preview of the start of the document, formatted like
+json.dumps(value, indent=2), to a preview.TextPreview.
+
+Tokenizing in Python is slow, so values that fit in the buffer are parsed
+by json's C scanner, runs of scalars in containers are matched with a
+single regular expression, and only the rest (like the brackets of the
+top-level array of a large export) is handled token by token.
+"""
+import json
+import re
+from typing import IO, List
+from spot_check_files.preview import TextPreview
+
+
+_CHUNK_SIZE = 256 * 1024
+
+# Amount of a string token too long to keep in memory that is kept for a
+# preview
+_PREVIEW_TOKEN = 1000
+
+_SCAN = json.JSONDecoder().scan_once
+
+_WS = r'[ \t\n\r]*'
+
+_WHITESPACE = re.compile(_WS)
+
+# Written so that there's only one way to match a given string, which
+# avoids backtracking
+_STRING_BODY = (r'[^"\\\x00-\x1f]*'
+                r'(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*')
+
+_STRING = rf'"{_STRING_BODY}"'
+
+_NUMBER = r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?'
+
+_LITERAL = r'true|false|null|NaN|Infinity|-Infinity'
+
+_SCALAR = rf'(?:{_STRING}|{_NUMBER}|{_LITERAL})'
+
+_TOKEN = re.compile(
+    rf'(?P<string>{_STRING})'
+    rf'|(?P<number>{_NUMBER})'
+    rf'|(?P<literal>{_LITERAL})'
+    r'|(?P<punct>[{}\[\]:,])')
+
+# Matches the rest of a buffer if it might be the start of a token that
+# continues in the next chunk. The number alternative comes last because it
+# can match an empty string.
+_PARTIAL = re.compile(
+    rf'"{_STRING_BODY}(?:\\(?:u[0-9a-fA-F]{{0,3}})?)?'
+    r'|-?I(?:n(?:f(?:i(?:n(?:i(?:t(?:y)?)?)?)?)?)?)?'
+    r'|t(?:r(?:u(?:e)?)?)?|f(?:a(?:l(?:s(?:e)?)?)?)?|n(?:u(?:l(?:l)?)?)?'
+    r'|N(?:a(?:N)?)?'
+    r'|-?[0-9]*(?:\.[0-9]*)?(?:[eE][-+]?[0-9]*)?')
+
+_STRING_PREFIX = re.compile(f'"{_STRING_BODY}')
+
+# Match some of the rest of a container's scalar items, after the first
+# one. Each item must be followed by a delimiter, so that one at the end of
+# the buffer isn't mistaken for a complete token. The number of items is
+# limited because the regex engine uses memory for each repetition.
+_ITEMS = {
+    '[': re.compile(
+        rf'(?:{_WS},{_WS}{_SCALAR}(?=[ \t\n\r,\]])){{1,1000}}'),
+    '{': re.compile(
+        rf'(?:{_WS},{_WS}{_STRING}{_WS}:{_WS}{_SCALAR}(?=[ \t\n\r,}}]))'
+        r'{1,1000}'),
+}
+
+# Parser states, named after what is expected next
+_VALUE = 'value'
+_FIRST_VALUE = 'first value'  # or ], just after [
+_KEY = 'key'
+_FIRST_KEY = 'first key'  # or }, just after {
+_COLON = 'colon'
+_NEXT = 'next'  # , or the end of the container
+_END = 'end'
+
+_EXPECTING = {
+    _VALUE: 'Expecting value',
+    _FIRST_VALUE: 'Expecting value',
+    _KEY: 'Expecting property name enclosed in double quotes',
+    _FIRST_KEY: 'Expecting property name enclosed in double quotes',
+    _COLON: "Expecting ':' delimiter",
+    _NEXT: "Expecting ',' delimiter",
+    _END: 'Extra data',
+}
+
+
+class JSONStreamError(json.JSONDecodeError):
+    """Describes where a document stopped being valid JSON.
+
+    This has the same attributes (apart from doc, which is None) and
+    message format as json.JSONDecodeError.
+    """
+    def __init__(self, msg: str, pos: int, lineno: int, colno: int):
+        ValueError.__init__(
+            self, f'{msg}: line {lineno} column {colno} (char {pos})')
+        self.msg = msg
+        self.doc = None
+        self.pos = pos
+        self.lineno = lineno
+        self.colno = colno
+
+    def __reduce__(self):
+        return (type(self), (self.msg, self.pos, self.lineno, self.colno))
+
+
+class _Preview:
+    """Pretty-prints tokens to a TextPreview."""
+    def __init__(self, out: TextPreview):
+        self.out = out
+        self.depth = 0
+        # True just after a container is opened, before its first item
+        self.opened = False
+        # True just after a key, so the value goes on the same line
+        self.after_key = False
+
+    @property
+    def full(self) -> bool:
+        return self.out.full
+
+    def item(self):
+        # Called before the first token of each item of a container
+        if self.depth and not self.after_key:
+            self._write('\n' + '  ' * self.depth)
+        self.opened = False
+        self.after_key = False
+
+    def open(self, token: str):
+        self.item()
+        self._write(token)
+        self.depth += 1
+        self.opened = True
+
+    def close(self, token: str):
+        self.depth -= 1
+        if not self.opened:
+            self._write('\n' + '  ' * self.depth)
+        self._write(token)
+        self.opened = False
+
+    def scalar(self, token: str, key: bool = False, partial: bool = False):
+        self.item()
+        if partial or len(token) > self.out.max_columns:
+            # Only the start will be visible
+            self._write(token)
+        else:
+            # Normalize the token the way json.dumps would write it
+            self._write(json.dumps(json.loads(token)))
+        if key:
+            self._write(': ')
+            self.after_key = True
+
+    def comma(self):
+        self._write(',')
+
+    def _write(self, text: str):
+        self.out.write(text)
+
+
+def validate(file: IO[str], preview: TextPreview = None):
+    """Checks that file contains a single valid JSON value.
+
+    Raises JSONStreamError if it doesn't. If preview is given, the start of
+    the value is written to it, formatted like json.dumps(value, indent=2);
+    once it's full, the rest of the value is only validated.
+    """
+    preview = _Preview(preview) if preview else None
+    stack: List[str] = []
+    state = _VALUE
+    buf = ''
+    pos = 0
+    eof = False
+    # Position in the document of the start of buf, and line number and
+    # position of the start of the line containing it
+    base = 0
+    lineno = 1
+    line_start = 0
+    # Position in the document of the last value _SCAN failed to parse
+    scan_failed = None
+    # If a value was nested too deeply for _SCAN (which recurses), the
+    # depth it was at; _SCAN isn't used for the values inside it
+    too_deep = None
+    # For a string token too long to keep in memory, its position in the
+    # document and its start; the middle is discarded once validated
+    long_string = None
+
+    def error(msg: str, at: int):
+        where = base + at
+        lines = buf.count('\n', 0, at)
+        start = line_start
+        if lines:
+            start = base + buf.rfind('\n', 0, at) + 1
+        if long_string and at == 0:
+            where = long_string[0]
+        raise JSONStreamError(msg, where, lineno + lines, where - start + 1)
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        show = preview and not preview.full
+        if too_deep is not None and len(stack) < too_deep:
+            too_deep = None
+        if state in (_VALUE, _FIRST_VALUE) and not show \
+                and base + pos != scan_failed \
+                and (too_deep is None or len(stack) == too_deep):
+            try:
+                end = _SCAN(buf, pos)[1]
+            except (StopIteration, ValueError):
+                end = None
+            except RecursionError:
+                end = None
+                too_deep = len(stack)
+            # A value near the end of the buffer may continue in the next
+            # chunk; e.g. "1.5" would be scanned as 1 if the buffer ended
+            # with "1." or "1"
+            if end is not None and (end < len(buf) - 2 or eof):
+                state = _NEXT if stack else _END
+                pos = end
+                long_string = None
+                continue
+            scan_failed = base + pos
+        elif state == _NEXT and not show:
+            match = _ITEMS[stack[-1]].match(buf, pos)
+            if match:
+                pos = match.end()
+                continue
+        match = _TOKEN.match(buf, pos)
+        if not eof and (not match or match.end() == len(buf)
+                        or match.lastgroup == 'number'):
+            if pos == len(buf) or _PARTIAL.match(buf, pos).end() == len(buf):
+                # The token may continue in the next chunk
+                if pos > _CHUNK_SIZE or len(buf) - pos > _CHUNK_SIZE:
+                    lines = buf.count('\n', 0, pos)
+                    if lines:
+                        lineno += lines
+                        line_start = base + buf.rfind('\n', 0, pos) + 1
+                    base += pos
+                    buf = buf[pos:]
+                    pos = 0
+                if pos == 0 and len(buf) > _CHUNK_SIZE and buf[0] == '"':
+                    # Discard the validated middle of a long string (which
+                    # can't contain newlines)
+                    if long_string is None:
+                        long_string = (base, buf[:_PREVIEW_TOKEN])
+                    end = _STRING_PREFIX.match(buf).end()
+                    base += end - 1
+                    buf = '"' + buf[end:]
+                chunk = file.read(_CHUNK_SIZE)
+                eof = not chunk
+                buf += chunk
+                continue
+        if not match:
+            if pos == len(buf):
+                if state == _END:
+                    return
+            elif buf[pos] == '"' and state not in (_COLON, _NEXT, _END):
+                end = _STRING_PREFIX.match(buf, pos).end()
+                # Like json, report a \u escape cut off by the end of the
+                # file as invalid, rather than the string as unterminated
+                if buf[end:end + 2] == '\\u':
+                    error('Invalid \\uXXXX escape', end + 1)
+                if _PARTIAL.match(buf, pos).end() == len(buf):
+                    error('Unterminated string starting at', pos)
+                if buf[end] == '\\':
+                    error('Invalid \\escape', end)
+                error('Invalid control character at', end)
+            error(_EXPECTING[state], pos)
+        token = match.group()
+        kind = match.lastgroup
+        partial = bool(long_string)
+        if partial:
+            token = long_string[1]
+        if state in (_VALUE, _FIRST_VALUE):
+            if token == '{' or token == '[':
+                stack.append(token)
+                state = _FIRST_KEY if token == '{' else _FIRST_VALUE
+                if show:
+                    preview.open(token)
+            elif token == ']' and state == _FIRST_VALUE:
+                stack.pop()
+                state = _NEXT if stack else _END
+                if show:
+                    preview.close(token)
+            elif kind == 'punct':
+                error('Expecting value', pos)
+            else:
+                state = _NEXT if stack else _END
+                if show:
+                    preview.scalar(token, partial=partial)
+        elif state in (_KEY, _FIRST_KEY):
+            if kind == 'string':
+                state = _COLON
+                if show:
+                    preview.scalar(token, key=True, partial=partial)
+            elif token == '}' and state == _FIRST_KEY:
+                stack.pop()
+                state = _NEXT if stack else _END
+                if show:
+                    preview.close(token)
+            else:
+                error(_EXPECTING[state], pos)
+        elif state == _COLON:
+            if token != ':':
+                error(_EXPECTING[state], pos)
+            state = _VALUE
+        elif state == _NEXT:
+            if token == ',':
+                state = _KEY if stack[-1] == '{' else _VALUE
+                if show:
+                    preview.comma()
+            elif token == ('}' if stack[-1] == '{' else ']'):
+                stack.pop()
+                state = _NEXT if stack else _END
+                if show:
+                    preview.close(token)
+            else:
+                error(_EXPECTING[state], pos)
+        else:
+            error(_EXPECTING[state], pos)
+        pos = match.end()
+        long_string = None
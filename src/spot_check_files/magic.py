@@ -0,0 +1,73 @@
+"""Logic for selecting a Checker based on a file's contents."""
+from __future__ import annotations
+import re
+from typing import List, Optional, Tuple
+from spot_check_files.archives import TarChecker, ZipChecker
+from spot_check_files.basics import ImageChecker, JSONChecker, XMLChecker
+from spot_check_files.checker import Checker, CheckResult, CheckRequest
+
+
+class MagicChecker(Checker):
+    """Selects and runs a Checker based on the first bytes of a file.
+
+    The file's header (see CheckRequest.read_header) is compared with a
+    list of signatures, and the Checker for the first one that matches is
+    run. Since a signature only suggests what the file might be, if that
+    Checker does not recognize the file, neither does this one, and its
+    errors are discarded.
+
+    Attributes:
+        checkers - list of tuples of a name for the kind of file, a regular
+                   expression (as bytes) that its header starts with, and
+                   the Checker to use for it
+    """
+
+    @classmethod
+    def default(cls) -> MagicChecker:
+        """Returns an instance configured for some standard file types."""
+        ctar = TarChecker()
+        cimg = ImageChecker()
+        checkers = [
+            ('zip', rb'PK(\x03\x04|\x05\x06|\x07\x08)', ZipChecker()),
+            # The tar checker also handles compressed files that turn out
+            # not to be tars, by not recognizing them
+            ('gzip', rb'\x1f\x8b', ctar),
+            ('xz', rb'\xfd7zXZ\x00', ctar),
+            ('bz2', rb'BZh[1-9]', ctar),
+            ('tar', rb'.{257}ustar', ctar),
+            ('png', rb'\x89PNG\r\n\x1a\n', cimg),
+            ('jpeg', rb'\xff\xd8\xff', cimg),
+            ('gif', rb'GIF8[79]a', cimg),
+            ('webp', rb'RIFF.{4}WEBP', cimg),
+            ('xml', rb'(\xef\xbb\xbf)?\s*<\?xml[\s?]', XMLChecker()),
+            ('json', rb'(\xef\xbb\xbf)?\s*[{\[]', JSONChecker()),
+        ]
+        return cls(checkers)
+
+    def __str__(self):
+        return 'MagicChecker'
+
+    def __init__(self, checkers: List[Tuple[str, bytes, Checker]] = []):
+        self.checkers = list(checkers)
+
+    def identify(self, req: CheckRequest) -> Optional[Tuple[str, Checker]]:
+        """Returns the kind of file and Checker whose signature matches
+        the file's header, or None."""
+        header = req.read_header()
+        for kind, signature, checker in self.checkers:
+            if re.match(signature, header, re.DOTALL):
+                return kind, checker
+        return None
+
+    def check(self, req: CheckRequest) -> CheckResult:
+        try:
+            match = self.identify(req)
+        except OSError:
+            # Whatever can't read the file will report the problem
+            return CheckResult()
+        if match is None:
+            return CheckResult()
+        result = match[1].check(req)
+        if result.recognizer is None:
+            return CheckResult()
+        return result
@@ -0,0 +1,53 @@
+"""Collects the text of a preview, for a thumbnail of a text-based file.
+
+Checkers that pretty-print a document for its thumbnail write the text to a
+TextPreview as they go, and stop once it is full, so the cost of the
+preview depends on the size of the thumbnail rather than of the document.
+"""
+from typing import List
+
+
+class TextPreview:
+    """Keeps the part of the text written to it that fits in a thumbnail.
+
+    Lines longer than max_columns are truncated, and once max_lines lines
+    have been completed, the preview is full and further text is ignored.
+
+    Attributes:
+        max_lines - maximum number of lines to keep
+        max_columns - maximum number of characters to keep from each line
+    """
+    def __init__(self, max_lines: int = 100, max_columns: int = 100):
+        self.max_lines = max_lines
+        self.max_columns = max_columns
+        self._lines = ['']
+
+    @property
+    def full(self) -> bool:
+        """True once the preview has all the lines it can hold."""
+        return len(self._lines) > self.max_lines
+
+    def write(self, text: str):
+        """Appends text to the preview.
+
+        Only the parts of the text that will be kept are copied, so this
+        is cheap even for long text.
+        """
+        pos = 0
+        while not self.full:
+            end = text.find('\n', pos)
+            room = self.max_columns - len(self._lines[-1])
+            if room > 0:
+                stop = pos + room if end < 0 else min(end, pos + room)
+                self._lines[-1] += text[pos:stop]
+            if end < 0:
+                return
+            self._lines.append('')
+            pos = end + 1
+
+    def lines(self) -> List[str]:
+        """Returns the lines of the preview, like str.splitlines would."""
+        lines = self._lines[:self.max_lines]
+        if not self.full and not lines[-1]:
+            lines.pop()
+        return lines
@@ -19,14 +19,25 @@ class QLChecker(Checker):
 
     A file is assumed to be "valid" if QuickLook generates a thumbnail for it.
     If it doesn't, the checker will not mark the result as recognized.
+    Since that is too slow for a quick check, files are never recognized
+    when a quick check is requested.
     """
     def check(self, req: CheckRequest) -> CheckResult:
         result = CheckResult()
+        if req.quick:
+            return result
 
         outdir = tempfile.mkdtemp(dir=req.tmpdir)
+        path = req.realpath
+        if path is None:
+            # qlmanage needs a real file, and uses the name to determine
+            # the file type
+            path = Path(outdir).joinpath('in', Path(req.virtpath).name)
+            path.parent.mkdir()
+            path.write_bytes(req.data)
         subprocess.check_output(
             ['qlmanage', '-t', '-s', '300',
-             str(req.realpath), '-o', outdir])
+             str(path), '-o', outdir])
 
         paths = list(Path(outdir).glob('*.png'))
         if paths:
@@ -1,13 +1,23 @@
 """Handles summarizing and formatting results. Main class is CheckReport."""
 import base64
-from io import BytesIO
+import heapq
+import itertools
+import math
 import os
+from pathlib import Path
 from PIL import Image
+import random
 from terminaltables import AsciiTable
-from typing import List
+from typing import Iterable, List, Optional
+import warnings
+from spot_check_files import thumbs
 from spot_check_files.checker import FileSummary
 
 
+# Number of files listed in the performance section
+_SLOWEST = 20
+
+
 def _print_thumbs(summaries):
     try:
         from imgcat import imgcat
@@ -16,7 +26,7 @@ def _print_thumbs(summaries):
 
     while summaries:
         # Combine images to show three per line in the output
-        group = [s.result.thumb for s in summaries[0:3]]
+        group = [thumbs.to_image(s.result.thumb) for s in summaries[0:3]]
         boxes = [i.getbbox() for i in group]
         if any(boxes):
             width = sum(b[2] - b[0] + 1 for b in boxes if b)
@@ -32,74 +42,353 @@ def _print_thumbs(summaries):
         summaries = summaries[3:]
 
 
+def can_print_thumbs() -> bool:
+    """Returns True if CheckReport.print will display thumbnails."""
+    return os.environ.get('TERM_PROGRAM', None) == 'iTerm.app'
+
+
+def _print_table(rows):
+    table = AsciiTable(rows)
+    for i in range(1, len(rows[0])):
+        table.justify_columns[i] = 'right'
+    print(table.table)
+
+
+def _str(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def file_record(summary: FileSummary) -> dict:
+    """Returns a JSON-serializable version of a summary.
+
+    Thumbnails, and the contents of archives, are left out.
+    """
+    return {
+        'type': 'file',
+        'virtpath': str(summary.virtpath),
+        'size': summary.size,
+        'recognizer': _str(summary.result.recognizer),
+        'skipped': summary.result.skipped,
+        'errors': [str(e) for e in summary.result.errors],
+        'duplicate_of': _str(summary.duplicate_of),
+        'forced': summary.forced,
+        'wall': summary.wall,
+        'stats': [{'checker': s.checker, 'wall': s.wall, 'cpu': s.cpu,
+                   'bytes_read': s.bytes_read, 'max_rss': s.max_rss}
+                  for s in summary.stats],
+    }
+
+
+def _environment():
+    from jinja2 import Environment, PackageLoader, select_autoescape
+    return Environment(
+        loader=PackageLoader('spot_check_files', '_templates'),
+        autoescape=select_autoescape(['html']),
+        trim_blocks=True)
+
+
+def _stream(template, path: Path, **context):
+    # Writes the template to the file as it's rendered, rather than
+    # building the whole page in memory
+    with path.open('w', encoding='utf-8') as file:
+        for chunk in template.generate(**context):
+            file.write(chunk)
+
+
+def _pages(items: list, page_size: int) -> List[list]:
+    return [items[i:i + page_size] for i in range(0, len(items), page_size)]
+
+
+def _is_archive(summary: FileSummary) -> bool:
+    return (summary.result.extracted is not None
+            or summary.result.members is not None)
+
+
+def _wilson(successes: int, trials: int, z: float = 1.96):
+    """Returns the Wilson score interval for a binomial proportion.
+
+    The default z gives a 95% confidence interval.
+    """
+    p = successes / trials
+    denom = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denom
+    half = z * math.sqrt(p * (1 - p) / trials
+                         + z * z / (4 * trials * trials)) / denom
+    return max(center - half, 0), min(center + half, 1)
+
+
 class _GroupStats:
-    def __init__(self, name: str, summaries: List[FileSummary],
-                 comparison: List[FileSummary] = None):
+    def __init__(self, name: str, comparison: '_GroupStats' = None,
+                 estimate: bool = True):
+        self.name = name
+        self.count = 0
+        self.size = 0
+        self.errors = 0
+        self.wall = 0
+        self.comparison = comparison
+        # Whether the group's error rate means anything (it doesn't for a
+        # group defined by whether its files have errors)
+        self.estimate = estimate
+        # The files that are part of the random sample, if sampling
+        self.sample_count = 0
+        self.sample_errors = 0
+
+    def add(self, summary: FileSummary):
+        self.count += 1
+        self.size += summary.size
+        self.wall += summary.wall
+        if summary.result.errors:
+            self.errors += 1
+        if not summary.forced:
+            self.sample_count += 1
+            if summary.result.errors:
+                self.sample_errors += 1
+
+    @property
+    def count_pct(self) -> str:
+        if not self.comparison or not self.comparison.count:
+            return ''
+        return '{:.0%}'.format(self.count / self.comparison.count)
+
+    @property
+    def size_pct(self) -> str:
+        if not self.comparison or not self.comparison.size:
+            return ''
+        return '{:.0%}'.format(self.size / self.comparison.size)
+
+    @property
+    def error_rate(self) -> str:
+        """Estimated fraction of such files with errors, if the files in
+        the group are a random sample, with a 95% confidence interval.
+
+        Files that were only checked because they were the first of their
+        stratum (see FileSummary.forced) are left out.
+        """
+        if not self.estimate or not self.sample_count:
+            return ''
+        low, high = _wilson(self.sample_errors, self.sample_count)
+        return '{:.1%} ({:.1%}-{:.1%})'.format(
+            self.sample_errors / self.sample_count, low, high)
+
+
+class _CheckerPerf:
+    def __init__(self, name: str):
         self.name = name
-        self.count = len(summaries)
-        self.size = sum(s.size for s in summaries)
-        self.count_pct = ''
-        self.size_pct = ''
-        if comparison:
-            self.count_pct = '{:.0%}'.format(self.count / len(comparison))
-            self.size_pct = '{:.0%}'.format(
-                self.size / sum(s.size for s in comparison))
+        self.count = 0
+        self.size = 0
+        self.bytes_read = 0
+        self.wall = 0
+        self.cpu = 0
+        self.max_rss = None
+
+    def add(self, summary: FileSummary, stats):
+        self.count += 1
+        self.size += summary.size
+        self.bytes_read += stats.bytes_read
+        self.wall += stats.wall
+        self.cpu += stats.cpu
+        if stats.max_rss is not None:
+            self.max_rss = max(self.max_rss or 0, stats.max_rss)
+
+    @property
+    def throughput(self) -> str:
+        """Size of the files checked, in MB per second."""
+        if not self.wall:
+            return ''
+        return '{:.1f}'.format(self.size / self.wall / 1024 / 1024)
+
+    @property
+    def peak_memory(self) -> str:
+        if self.max_rss is None:
+            return ''
+        return '{:.0f} MB'.format(self.max_rss / 1024 / 1024)
 
 
 class CheckReport:
-    """Formats and displays results from a CheckerRunner."""
-    def __init__(self, summaries: List[FileSummary]):
-        self.summaries = summaries
-        arch_summaries = [s for s in summaries
-                          if s.result.extracted
-                          and not s.result.errors]
-        leaf_summaries = [s for s in summaries
-                          if s.result.errors or not s.result.extracted]
-        skip_summaries = [s for s in leaf_summaries if s.result.skipped]
-        # If we ever get something that was extracted then marked as skipped,
-        # a Checker is misusing the Checker API.
-        # TODO: enforce this better, somewhere else
-        assert not [s for s in arch_summaries if s.result.skipped]
-        self.err_summaries = [s for s in leaf_summaries if s.result.errors]
-        self.thumb_summaries = [s for s in leaf_summaries if s.result.thumb]
-        self.groups = [
-            _GroupStats('Archives (without errors)', arch_summaries),
-            _GroupStats('Files (excludes errorless archives)',
-                        leaf_summaries),
-            _GroupStats('Skipped files', skip_summaries, leaf_summaries),
-            _GroupStats('Files with thumbnails', self.thumb_summaries,
-                        leaf_summaries),
-            _GroupStats('Files with ERRORS', self.err_summaries,
-                        leaf_summaries),
-        ]
-
-        by_rec = {}
-        unrec_by_ext = {}
-        for summary in leaf_summaries:
-            if summary.result.recognizer is None:
-                ext = summary.virtpath.suffix
-                if ext not in unrec_by_ext:
-                    unrec_by_ext[ext] = []
-                unrec_by_ext[ext].append(summary)
+    """Formats and displays results from a CheckerRunner.
+
+    Summaries can be given to the constructor, or added one at a time with
+    the add method (e.g. as they are yielded by CheckerRunner.iter_check).
+    The report only keeps statistics, the summaries of files with errors,
+    and the summaries of files whose thumbnails will be displayed. Other
+    thumbnails are discarded (see thumbs.discard) as soon as the report
+    knows it won't display them, so they must not be used after they're
+    added to the report.
+
+    Attributes:
+        groups - statistics about groups of files
+        err_summaries - summaries of files with errors
+        thumb_summaries - summaries of files with thumbnails. If max_thumbs
+                          is set, this is a random sample of at most that
+                          many of them, in the order they were added.
+        max_thumbs - maximum number of thumbnails to keep, or None
+        sampled - if True, the summaries are from a random sample of the
+                  files (see CheckerRunner.sampler), so the estimated
+                  error rate of each group is displayed (except for groups
+                  defined by whether the files have errors)
+        performance - if True, a section showing where time was spent
+                      checking files is displayed (see FileSummary.stats)
+        checker_perf - statistics about each checker, in the order they
+                       were first seen
+        slowest_summaries - summaries of the files that took longest to
+                            check, slowest first
+        keep_summaries - if False, only statistics are kept, so
+                         err_summaries, thumb_summaries and
+                         slowest_summaries are empty
+        summaries - deprecated: the summaries given to the constructor, if
+                    they were given as a list (summaries passed to add
+                    aren't kept)
+    """
+    def __init__(self, summaries: Iterable[FileSummary] = (),
+                 max_thumbs: int = None, sampled: bool = False,
+                 performance: bool = False, keep_summaries: bool = True):
+        self.max_thumbs = max_thumbs
+        self.sampled = sampled
+        self.performance = performance
+        self.keep_summaries = keep_summaries
+        self.err_summaries = []
+        # Only a reference to the caller's list, for the summaries property
+        self._summaries = summaries if isinstance(summaries, list) else None
+        self._thumbs = []
+        self._all = _GroupStats('All files')
+        self._arch = _GroupStats('Archives (without errors)',
+                                 estimate=False)
+        self._leaf = _GroupStats('Files (excludes errorless archives)')
+        self._skip = _GroupStats('Skipped files', self._leaf)
+        self._thumb = _GroupStats('Files with thumbnails', self._leaf)
+        self._err = _GroupStats('Files with ERRORS', self._leaf,
+                                estimate=False)
+        self._dup = _GroupStats('Duplicates (checked once)', self._all)
+        self._by_rec = {}
+        self._unrec_by_ext = {}
+        self._perf = {}
+        # Heap of the slowest summaries; the counter breaks ties
+        self._slowest = []
+        self._counter = itertools.count()
+        # Used for sampling thumbnails; seeded so reports are repeatable
+        self._random = random.Random(0)
+        for summary in summaries:
+            self.add(summary)
+
+    def add(self, summary: FileSummary):
+        """Adds a summary to the report."""
+        self._all.add(summary)
+        self._add_perf(summary)
+        if summary.duplicate_of:
+            self._dup.add(summary)
+        if _is_archive(summary) and not summary.result.errors:
+            # If we ever get something that was extracted then marked as
+            # skipped, a Checker is misusing the Checker API.
+            # TODO: enforce this better, somewhere else
+            assert not summary.result.skipped
+            self._arch.add(summary)
+            return
+
+        self._leaf.add(summary)
+        if summary.result.skipped:
+            self._skip.add(summary)
+        if summary.result.thumb:
+            self._thumb.add(summary)
+            if self.keep_summaries:
+                self._add_thumb(summary)
+            else:
+                thumbs.discard(summary.result.thumb)
+        if summary.result.errors:
+            self._err.add(summary)
+            if self.keep_summaries:
+                self.err_summaries.append(summary)
+
+        if summary.result.recognizer is None:
+            ext = summary.virtpath.suffix
+            if ext not in self._unrec_by_ext:
+                name = (f'Unrecognized with extension {ext}' if ext
+                        else 'Other unrecognized')
+                self._unrec_by_ext[ext] = _GroupStats(name, self._leaf)
+            self._unrec_by_ext[ext].add(summary)
+        else:
+            rec = str(summary.result.recognizer)
+            if rec not in self._by_rec:
+                self._by_rec[rec] = _GroupStats(f'Recognized by {rec}',
+                                                self._leaf)
+            self._by_rec[rec].add(summary)
+
+    def _add_perf(self, summary: FileSummary):
+        for stats in summary.stats:
+            if stats.checker not in self._perf:
+                self._perf[stats.checker] = _CheckerPerf(stats.checker)
+            self._perf[stats.checker].add(summary, stats)
+        if summary.stats and self.keep_summaries:
+            entry = (summary.wall, -next(self._counter), summary)
+            if len(self._slowest) < _SLOWEST:
+                heapq.heappush(self._slowest, entry)
             else:
-                rec = str(summary.result.recognizer)
-                if rec not in by_rec:
-                    by_rec[rec] = []
-                by_rec[rec].append(summary)
-
-        for rec in sorted(by_rec.keys()):
-            self.groups.append(_GroupStats(f'Recognized by {rec}',
-                                           by_rec[rec], leaf_summaries))
-
-        for ext in sorted(unrec_by_ext.keys()):
-            if not ext:
-                continue
-            self.groups.append(_GroupStats(
-                f'Unrecognized with extension {ext}',
-                unrec_by_ext[ext], leaf_summaries))
-        if '' in unrec_by_ext:
-            self.groups.append(_GroupStats(
-                'Other unrecognized', unrec_by_ext[''], leaf_summaries))
+                heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def summaries(self) -> List[FileSummary]:
+        warnings.warn('CheckReport.summaries is deprecated; the report only'
+                      ' keeps the summaries it displays', DeprecationWarning,
+                      stacklevel=2)
+        if self._summaries is None:
+            raise AttributeError('summaries is only available if the'
+                                 ' report was given a list of summaries')
+        return self._summaries
+
+    @property
+    def checker_perf(self) -> List[_CheckerPerf]:
+        return list(self._perf.values())
+
+    @property
+    def slowest_summaries(self) -> List[FileSummary]:
+        return [s for _, _, s in sorted(self._slowest, reverse=True)]
+
+    def _add_thumb(self, summary: FileSummary):
+        # Reservoir sampling; each entry records the summary's position so
+        # the sample can be kept in the order the summaries were added.
+        # Thumbnails that won't be displayed are discarded, so a
+        # thumbs.ThumbnailStore only has to hold the ones that will be.
+        index = self._thumb.count - 1
+        if self.max_thumbs is None or index < self.max_thumbs:
+            self._thumbs.append((index, summary))
+            return
+        slot = self._random.randrange(index + 1)
+        if slot < self.max_thumbs:
+            thumbs.discard(self._thumbs[slot][1].result.thumb)
+            self._thumbs[slot] = (index, summary)
+        else:
+            thumbs.discard(summary.result.thumb)
+
+    @property
+    def thumb_summaries(self) -> List[FileSummary]:
+        return [s for _, s in sorted(self._thumbs, key=lambda t: t[0])]
+
+    @property
+    def groups(self) -> List[_GroupStats]:
+        """Statistics about groups of files, in the order to display them."""
+        groups = [self._arch, self._leaf, self._skip, self._thumb, self._err]
+        if self._dup.count:
+            groups.append(self._dup)
+        groups.extend(self._by_rec[rec] for rec in sorted(self._by_rec))
+        groups.extend(self._unrec_by_ext[ext]
+                      for ext in sorted(self._unrec_by_ext) if ext)
+        if '' in self._unrec_by_ext:
+            groups.append(self._unrec_by_ext[''])
+        return groups
+
+    def summary_record(self) -> dict:
+        """Returns the statistics about each group of files and checker,
+        in a JSON-serializable form."""
+        return {
+            'type': 'summary',
+            'groups': [{'name': g.name, 'count': g.count, 'size': g.size,
+                        'errors': g.errors, 'wall': g.wall}
+                       for g in [self._all] + self.groups],
+            'checkers': [{'checker': p.name, 'count': p.count,
+                          'size': p.size, 'bytes_read': p.bytes_read,
+                          'wall': p.wall, 'cpu': p.cpu,
+                          'max_rss': p.max_rss}
+                         for p in self.checker_perf],
+        }
 
     def print(self):
         """Prints the report to the terminal.
@@ -107,7 +396,7 @@ class CheckReport:
         If using iTerm2, thumbnails are displayed; otherwise, they are
         not used.
         """
-        if os.environ.get('TERM_PROGRAM', None) == 'iTerm.app':
+        if can_print_thumbs():
             _print_thumbs(self.thumb_summaries)
 
         for summary in self.err_summaries:
@@ -122,25 +411,96 @@ class CheckReport:
                       g.size,
                       g.count_pct,
                       g.size_pct) for g in self.groups)
-        table = AsciiTable(stats)
-        for i in range(1, 5):
-            table.justify_columns[i] = 'right'
-        print(table.table)
+        if self.sampled:
+            stats[0] += ('Est. error rate (95% CI)',)
+            for i, group in enumerate(self.groups, 1):
+                stats[i] += (group.error_rate,)
+        _print_table(stats)
+        if self.performance:
+            self._print_performance()
+
+    def _print_performance(self):
+        print()
+        print('Performance')
+        _print_table([('Group', 'Files', 'Time (s)')] + [
+            (g.name, g.count, '{:.2f}'.format(g.wall))
+            for g in self.groups])
+        _print_table([('Checker', 'Files', 'Size', 'Bytes read', 'Time (s)',
+                       'CPU (s)', 'MB/s', 'Peak memory')] + [
+            (p.name, p.count, p.size, p.bytes_read, '{:.2f}'.format(p.wall),
+             '{:.2f}'.format(p.cpu), p.throughput, p.peak_memory)
+            for p in self.checker_perf])
+        _print_table([('Slowest files', 'Size', 'Time (s)', 'Checker')] + [
+            (str(s.virtpath), s.size, '{:.2f}'.format(s.wall),
+             s.stats[-1].checker)
+            for s in self.slowest_summaries])
+
+    def _context(self) -> dict:
+        return dict(groups=self.groups,
+                    sampled=self.sampled,
+                    performance=self.performance,
+                    checker_perf=self.checker_perf,
+                    slowest_summaries=self.slowest_summaries)
 
     def html(self) -> str:
-        """Returns an HTML version of the report, as a string."""
-        from jinja2 import Environment, PackageLoader, select_autoescape
+        """Returns an HTML version of the report, as a string.
 
+        Thumbnails are embedded in the page, so for large numbers of them,
+        write_html is more suitable.
+        """
         def thumburl(summary):
-            data = BytesIO()
-            summary.result.thumb.save(data, 'png')
-            encdata = base64.b64encode(data.getvalue()).decode('utf-8')
-            return f'data:image/png;base64,{encdata}'
-
-        env = Environment(
-            loader=PackageLoader('spot_check_files', '_templates'),
-            autoescape=select_autoescape(['html']),
-            trim_blocks=True)
+            data = thumbs.encode(summary.result.thumb)
+            encdata = base64.b64encode(data).decode('utf-8')
+            return f'data:{thumbs.media_type(data)};base64,{encdata}'
+
+        env = _environment()
         env.globals['thumburl'] = thumburl
         template = env.get_template('report.html')
-        return template.render(vars(self))
+        return template.render(err_summaries=self.err_summaries,
+                               thumb_summaries=self.thumb_summaries,
+                               **self._context())
+
+    def write_html(self, directory: Path, page_size: int = 500):
+        """Writes an HTML version of the report to a directory.
+
+        The directory is created if necessary. Open index.html in it to
+        view the report. Thumbnails are saved as separate files (see
+        thumbs.save_for_web) that the pages load as they are scrolled to,
+        and the lists of errors and thumbnails are split into pages of at
+        most page_size files each.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        thumbdir = directory.joinpath('thumbs')
+        thumbdir.mkdir(exist_ok=True)
+        env = _environment()
+        directory.joinpath('style.css').write_text(
+            env.get_template('style.css').render(), encoding='utf-8')
+
+        err_pages = _pages(self.err_summaries, page_size)
+        template = env.get_template('dir_errors.html')
+        for page, summaries in enumerate(err_pages, 1):
+            _stream(template, directory.joinpath(f'errors-{page}.html'),
+                    page=page, pages=len(err_pages),
+                    err_summaries=summaries)
+
+        thumb_pages = _pages(self.thumb_summaries, page_size)
+        template = env.get_template('dir_thumbs.html')
+        index = 0
+        for page, summaries in enumerate(thumb_pages, 1):
+            srcs = []
+            for summary in summaries:
+                path = thumbs.save_for_web(summary.result.thumb,
+                                           thumbdir.joinpath(str(index)))
+                srcs.append(f'thumbs/{path.name}')
+                index += 1
+            _stream(template, directory.joinpath(f'thumbs-{page}.html'),
+                    page=page, pages=len(thumb_pages),
+                    thumbs=list(zip(summaries, srcs)))
+
+        _stream(env.get_template('dir_index.html'),
+                directory.joinpath('index.html'),
+                err_count=len(self.err_summaries),
+                error_pages=len(err_pages),
+                thumb_count=len(self._thumbs),
+                thumb_pages=len(thumb_pages),
+                **self._context())
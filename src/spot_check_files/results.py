@@ -0,0 +1,127 @@
+"""Saves the results of a run, so reports can be made from them later.
+
+ResultsWriter writes summaries to a compressed file as they are produced,
+with each thumbnail compressed by thumbs.encode. ResultsReader reads them
+back one at a time, with each thumbnail as a thumbs.Thumbnail, which is
+only decoded when it is used, so making a report that doesn't display them
+is quick.
+The Checker that recognized each file is only stored by name (see
+result_record), so files stay readable when Checkers change. Results files
+use pickle, so only read files you trust.
+"""
+from dataclasses import replace
+import gzip
+from pathlib import Path
+import pickle
+from typing import Iterator
+from spot_check_files import thumbs
+from spot_check_files.checker import CheckResult, FileSummary, NamedChecker
+
+
+# Identifies the format of the file, in the first record
+_FORMAT = 'spot_check_files results 1'
+
+
+def result_record(result: CheckResult) -> tuple:
+    """Returns the parts of a result to save, except its thumbnail.
+
+    The recognizer is replaced by its name.
+    """
+    return (result.errors,
+            None if result.recognizer is None else str(result.recognizer),
+            result.skipped, result.extracted, result.members is not None)
+
+
+def load_result(record: tuple) -> CheckResult:
+    """Makes a result from the output of result_record.
+
+    The recognizer is a NamedChecker, and if the file's members were read
+    directly from it, members is an empty list.
+    """
+    errors, recognizer, skipped, extracted, members = record
+    return CheckResult(
+        errors=errors, extracted=extracted, members=[] if members else None,
+        recognizer=recognizer and NamedChecker(recognizer), skipped=skipped)
+
+
+class ResultsWriter:
+    """Writes summaries to a results file.
+
+    Call close when done.
+
+    Attributes:
+        path - location of the file
+        sampled - whether the summaries are from a random sample of the
+                  files (see CheckReport.sampled)
+    """
+    def __init__(self, path: Path, sampled: bool = False):
+        self.path = path
+        self.sampled = sampled
+        self._file = gzip.open(path, 'wb')
+        pickle.dump({'format': _FORMAT, 'sampled': sampled}, self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, summary: FileSummary):
+        """Appends a summary to the file."""
+        result = summary.result
+        record = (summary.virtpath, summary.size, result_record(result),
+                  summary.duplicate_of, summary.stats,
+                  result.thumb and thumbs.encode(result.thumb),
+                  summary.forced)
+        try:
+            data = pickle.dumps(record)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # A checker recorded an unusual exception as an error
+            result = replace(result, errors=[str(e) for e in result.errors])
+            data = pickle.dumps(
+                record[:2] + (result_record(result),) + record[3:])
+        self._file.write(data)
+
+    def close(self):
+        """Finishes writing the file."""
+        self._file.close()
+
+
+class ResultsReader:
+    """Reads summaries from a file written by ResultsWriter.
+
+    Iterating over the reader yields the summaries in the order they were
+    added.
+
+    Attributes:
+        path - location of the file
+        sampled - whether the summaries are from a random sample of the
+                  files
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        with gzip.open(path, 'rb') as file:
+            try:
+                header = pickle.load(file)
+            except Exception:
+                header = None
+        if not isinstance(header, dict) or header.get('format') != _FORMAT:
+            raise ValueError(f'not a results file: {path}')
+        self.sampled = header['sampled']
+
+    def __iter__(self) -> Iterator[FileSummary]:
+        with gzip.open(self.path, 'rb') as file:
+            pickle.load(file)
+            while True:
+                try:
+                    record = pickle.load(file)
+                except EOFError:
+                    return
+                virtpath, size, result, duplicate_of, stats, thumb, \
+                    forced = record
+                result = load_result(result)
+                if thumb:
+                    result.thumb = thumbs.Thumbnail(thumb)
+                yield FileSummary(size=size, virtpath=virtpath,
+                                  result=result, duplicate_of=duplicate_of,
+                                  stats=stats, forced=forced)
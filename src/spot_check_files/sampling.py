@@ -0,0 +1,118 @@
+"""Selects a repeatable, stratified sample of files to check.
+
+The Sampler class decides which files to check when only a fraction of a
+tree should be checked. Files are grouped into strata by extension and
+order of magnitude of size; every stratum is sampled at the same rate,
+and the first file of each stratum is always included so that rare kinds
+of files are represented. Whether any other file is included depends only
+on its path (including the path of any archive it's in) and the seed, so
+runs with the same seed check the same files, and the members of each
+archive are sampled independently of the members of other archives.
+
+The files included only because they were the first of their stratum are
+not a random sample, so estimates should leave them out; Sampler.chosen
+says whether a file is part of the random sample.
+"""
+from __future__ import annotations
+import hashlib
+from pathlib import PurePosixPath
+from typing import Set, Tuple
+
+
+def _stratum(name: str, size: int) -> Tuple[str, int]:
+    return (PurePosixPath(name).suffix.lower(), len(str(size)))
+
+
+class Selection:
+    """Decides which of a sequence of files (e.g. an archive's members)
+    to check.
+
+    Instances are stateful: call the instance once per file, in order.
+
+    Attributes:
+        sampler - the Sampler that made this selection
+        parent - path of the archive containing the files, or '' if they
+                 are the files given to CheckerRunner.check_path
+    """
+    def __init__(self, sampler: Sampler, parent: str = ''):
+        self.sampler = sampler
+        self.parent = parent
+        self._seen: Set[Tuple[str, int]] = set()
+
+    def __call__(self, name: str, size: int) -> bool:
+        """Returns True if the file should be checked.
+
+        name should be the file's path relative to the directory or
+        archive containing it.
+        """
+        stratum = _stratum(name, size)
+        if stratum not in self._seen:
+            self._seen.add(stratum)
+            return True
+        return self.sampler.chosen(f'{self.parent}/{name}' if self.parent
+                                   else name)
+
+
+class Sampler:
+    """Configures sampling of files.
+
+    Exactly one of count or fraction should be given.
+
+    Attributes:
+        count - approximate number of files to check, out of the files
+                found in the path given to CheckerRunner.check_path
+                (before extracting any archives). The corresponding
+                fraction is also used for the contents of archives.
+        fraction - fraction of files (including files inside archives)
+                   to check, between 0 and 1
+        seed - changing this selects a different sample
+    """
+    def __init__(self, count: int = None, fraction: float = None,
+                 seed: int = 0):
+        if (count is None) == (fraction is None):
+            raise ValueError('exactly one of count or fraction is required')
+        if count is not None and count < 1:
+            raise ValueError(f'invalid sample count: {count}')
+        if fraction is not None and not 0 < fraction <= 1:
+            raise ValueError(f'invalid sample fraction: {fraction}')
+        self.count = count
+        self.fraction = fraction
+        self.seed = seed
+
+    def score(self, name: str) -> float:
+        """Returns a pseudo-random number in [0, 1) for the given name."""
+        digest = hashlib.blake2b(f'{self.seed}/{name}'.encode('utf-8'),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'big') / 2 ** 64
+
+    def chosen(self, path: str) -> bool:
+        """Returns True if the file is part of the random sample.
+
+        path is the file's path relative to the path given to
+        CheckerRunner.check_path (or, if that was a file, its parent), with
+        '/' separators. Files for which this is False are only checked if
+        they are the first of their stratum.
+        """
+        return self.score(path) < self.fraction
+
+    def resolve(self, population: int) -> Sampler:
+        """Returns a sampler with a fraction instead of a count.
+
+        population is the number of files the count was meant to be taken
+        from.
+        """
+        if self.fraction is not None:
+            return self
+        fraction = min(self.count / population, 1) if population else 1
+        return Sampler(fraction=fraction, seed=self.seed)
+
+    def selection(self, parent: str = '') -> Selection:
+        """Starts selecting from a sequence of files.
+
+        parent is the path (as for the chosen method) of the archive
+        containing the files, if any. This sampler must have a fraction
+        (see the resolve method).
+        """
+        if self.fraction is None:
+            raise ValueError('sampler has no fraction')
+        return Selection(self, parent)
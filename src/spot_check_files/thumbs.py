@@ -0,0 +1,256 @@
+"""Converts thumbnails to and from compact bytes for storage.
+
+CheckResult.thumb may be a PIL image or a Thumbnail, which holds the image
+as compressed data (see encode); use to_image and encode to get either form
+from both. The
+ThumbnailStore class keeps the data for many thumbnails in bounded memory,
+spilling the rest to a file; use discard to free the ones that turn out not
+to be needed.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from PIL import Image, features
+import tempfile
+from typing import BinaryIO, Union
+
+
+# Quality thumbnails are saved with in lossy formats
+_QUALITY = 80
+
+
+class Thumbnail:
+    """A thumbnail held as compressed data, which is decoded when it's used.
+
+    Attributes:
+        data - the data from encode
+    """
+    def __init__(self, data: bytes):
+        self._data = data
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> Thumbnail:
+        return cls(encode(image))
+
+    @property
+    def data(self) -> bytes:
+        return self._data
+
+    def image(self) -> Image.Image:
+        """Returns the thumbnail as a PIL image."""
+        return decode(self.data)
+
+    def __reduce__(self):
+        return (Thumbnail, (self.data,))
+
+
+def _transparent(image: Image.Image) -> bool:
+    if 'transparency' in image.info:
+        return True
+    if 'A' not in image.getbands():
+        return False
+    return image.getchannel('A').getextrema()[0] < 255
+
+
+def _save_webp(thumb: Image.Image, file: BinaryIO):
+    if thumb.mode not in ('RGB', 'RGBA'):
+        thumb = thumb.convert('RGBA' if _transparent(thumb) else 'RGB')
+    thumb.save(file, 'webp', quality=_QUALITY)
+
+
+def _save_jpeg(thumb: Image.Image, file: BinaryIO):
+    if thumb.mode != 'RGB':
+        # JPEG has no transparency, so put the image on a white background
+        rgba = thumb.convert('RGBA')
+        thumb = Image.new('RGB', rgba.size, 'white')
+        thumb.paste(rgba, mask=rgba)
+    thumb.save(file, 'jpeg', quality=_QUALITY)
+
+
+def encode(thumb: Union[Image.Image, Thumbnail]) -> bytes:
+    """Returns the thumbnail as compressed image data.
+
+    Like save_for_web, this uses WebP if Pillow supports it, otherwise
+    JPEG, at a fixed quality; but images with transparency are saved as
+    PNG instead of JPEG.
+    """
+    if isinstance(thumb, Thumbnail):
+        return thumb.data
+    data = BytesIO()
+    if features.check('webp'):
+        _save_webp(thumb, data)
+    elif _transparent(thumb):
+        if thumb.mode not in ('LA', 'P', 'RGBA'):
+            thumb = thumb.convert('RGBA')
+        thumb.save(data, 'png')
+    else:
+        _save_jpeg(thumb, data)
+    return data.getvalue()
+
+
+def media_type(data: bytes) -> str:
+    """Returns the MIME type of data from encode."""
+    return Image.MIME[decode(data).format]
+
+
+def decode(data: bytes) -> Image.Image:
+    """Returns an image for data from encode.
+
+    The pixels are not decoded until the image is used.
+    """
+    return Image.open(BytesIO(data))
+
+
+def to_image(thumb: Union[Image.Image, Thumbnail]) -> Image.Image:
+    """Returns the thumbnail as a PIL image."""
+    if isinstance(thumb, Thumbnail):
+        return thumb.image()
+    return thumb
+
+
+def save_for_web(thumb: Union[Image.Image, Thumbnail], path: Path) -> Path:
+    """Saves the thumbnail in a compact format that browsers can display.
+
+    WebP is used if Pillow supports it, otherwise JPEG. The path should
+    not have an extension; the path of the file written is returned.
+    """
+    thumb = to_image(thumb)
+    if features.check('webp'):
+        path = path.with_suffix('.webp')
+        with path.open('wb') as file:
+            _save_webp(thumb, file)
+        return path
+    path = path.with_suffix('.jpg')
+    with path.open('wb') as file:
+        _save_jpeg(thumb, file)
+    return path
+
+
+def discard(thumb: Union[Image.Image, Thumbnail]):
+    """Says that a thumbnail is no longer needed by whatever was using it.
+
+    If the thumbnail is in a ThumbnailStore, see ThumbnailStore.discard;
+    otherwise this does nothing.
+    """
+    if isinstance(thumb, _StoredThumbnail):
+        thumb._store.discard(thumb)
+
+
+class _StoredThumbnail(Thumbnail):
+    def __init__(self, store: ThumbnailStore, key: int):
+        self._store = store
+        self._key = key
+
+    @property
+    def data(self) -> bytes:
+        return self._store._get(self._key)
+
+
+class ThumbnailStore:
+    """Holds the data for thumbnails, using a bounded amount of memory.
+
+    The most recently used thumbnails are kept in memory; once their total
+    size exceeds max_memory, the least recently used are written to a file
+    in the given directory, and read back from it when needed. Call close
+    when the thumbnails are no longer needed, to delete the file.
+
+    Each call to add for a thumbnail should be matched by a call to discard
+    once the thumbnail isn't needed (e.g. because a report won't display
+    it); the thumbnail's data is then dropped. (Space in the file is not
+    reused, though.)
+
+    Attributes:
+        directory - where to create the file
+        max_memory - approximate maximum number of bytes of thumbnail data
+                     to keep in memory
+    """
+    def __init__(self, directory: Path, max_memory: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory = max_memory
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # (offset, length) of the thumbnails in the file, by key
+        self._spilled = {}
+        # Number of adds not yet matched by a discard, by key
+        self._refs = {}
+        self._file = None
+        self._next_key = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, thumb: Union[Image.Image, Thumbnail]) -> Thumbnail:
+        """Stores a thumbnail, and returns a Thumbnail that reads it back
+        from the store.
+
+        If the thumbnail is already in this store, it is returned as is,
+        and another call to discard is needed before its data is dropped.
+        """
+        if isinstance(thumb, _StoredThumbnail) and thumb._store is self:
+            self._refs[thumb._key] += 1
+            return thumb
+        key = self._next_key
+        self._next_key += 1
+        self._refs[key] = 1
+        self._remember(key, encode(thumb))
+        return _StoredThumbnail(self, key)
+
+    def discard(self, thumb: Thumbnail):
+        """Undoes a call to add that returned the thumbnail.
+
+        Once every add has been undone, the thumbnail's data is dropped,
+        and it can no longer be used.
+        """
+        key = thumb._key
+        self._refs[key] -= 1
+        if self._refs[key]:
+            return
+        del self._refs[key]
+        data = self._memory.pop(key, None)
+        if data is not None:
+            self._memory_size -= len(data)
+        self._spilled.pop(key, None)
+
+    def close(self):
+        """Discards the thumbnails and deletes the file."""
+        self._memory.clear()
+        self._memory_size = 0
+        self._spilled.clear()
+        self._refs.clear()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _get(self, key: int) -> bytes:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if key not in self._spilled:
+            raise KeyError(f'thumbnail {key} is not in the store')
+        offset, length = self._spilled[key]
+        self._file.seek(offset)
+        data = self._file.read(length)
+        self._remember(key, data)
+        return data
+
+    def _remember(self, key: int, data: bytes):
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.max_memory and len(self._memory) > 1:
+            old_key, old_data = self._memory.popitem(last=False)
+            self._memory_size -= len(old_data)
+            self._spill(old_key, old_data)
+
+    def _spill(self, key: int, data: bytes):
+        if key in self._spilled:
+            # it was read back from the file, which still has it
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self.directory)
+        self._file.seek(0, 2)
+        self._spilled[key] = (self._file.tell(), len(data))
+        self._file.write(data)
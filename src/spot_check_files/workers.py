@@ -0,0 +1,309 @@
+"""Runs tasks in worker processes that can be killed if they take too long.
+
+The WorkerPool class is similar to concurrent.futures.ProcessPoolExecutor,
+but can enforce time limits by killing the process running a task (and
+starting a new one in its place). Tasks call progress to say which file
+and checker they are working on, which restarts the corresponding timer
+and is used to describe what was running when a limit was exceeded. Files
+inside the task's file (like an archive's members) are reported as
+members, which don't restart the file timer, so the time limit per file
+covers them too.
+"""
+from collections import deque
+from concurrent.futures import Future
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import signal
+import threading
+import time
+from typing import Callable, Optional
+
+
+# The connection to the pool, in a worker process
+_CONN = None
+
+
+def _context():
+    # Workers are replaced from the pool's thread, and forking a process
+    # with other threads running can leave locks held in the child, so
+    # start them from a fresh process instead
+    methods = multiprocessing.get_all_start_methods()
+    method = 'forkserver' if 'forkserver' in methods else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+class TaskFailed(Exception):
+    """Set as the exception of a task's future when the task's worker was
+    killed or died before the task finished.
+
+    Attributes:
+        elapsed - seconds the task had been running for
+    """
+    def __init__(self, message: str, elapsed: float = 0):
+        super().__init__(message)
+        self.elapsed = elapsed
+
+    def __reduce__(self):
+        return (type(self), (str(self), self.elapsed))
+
+
+class TaskTimeout(TaskFailed):
+    """A task's worker was killed because it exceeded a time limit."""
+
+
+def progress(kind: str, label: str):
+    """Tells the pool what the current task is working on.
+
+    kind is 'file', 'member' (for a file read from inside the current
+    file, which is described as the current file but doesn't restart its
+    timer), or 'checker'. This does nothing when not called from a worker
+    process.
+    """
+    if _CONN is not None:
+        _CONN.send(('progress', kind, label))
+
+
+def _worker_main(conn, initializer: Callable, initargs: tuple):
+    global _CONN
+    if hasattr(os, 'setpgrp'):
+        # So that any subprocesses are killed along with the worker
+        os.setpgrp()
+    _CONN = conn
+    if initializer:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, args = task
+        try:
+            message = ('done', fn(*args))
+        except BaseException as e:
+            message = ('error', e)
+        try:
+            conn.send(message)
+        except Exception as e:
+            conn.send(('error', RuntimeError(f'could not send result: {e}')))
+
+
+class _Task:
+    def __init__(self, fn: Callable, args: tuple, future: Future):
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.started = None
+        self.file = None
+        self.file_started = None
+        self.checker = None
+        self.checker_started = None
+
+    def start(self, now: float):
+        self.started = self.file_started = now
+
+    def describe(self) -> str:
+        if self.file is None:
+            return 'task'
+        if self.checker is None:
+            return f'checking {self.file}'
+        return f'checking {self.file} with {self.checker}'
+
+
+class _Worker:
+    def __init__(self, context, initializer: Callable, initargs: tuple):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child, initializer, initargs),
+            daemon=True)
+        self.process.start()
+        child.close()
+        self.task = None
+
+    def kill(self):
+        if hasattr(os, 'killpg'):
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                # the worker hasn't made its own process group yet, or
+                # has already exited
+                pass
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """A pool of worker processes whose tasks can be given time limits.
+
+    Any of the limits may be None, for no limit. Workers are started with
+    the forkserver (or spawn) method, so tasks, their results, and the
+    initializer and its arguments must be picklable.
+
+    Attributes:
+        file_timeout - seconds a task may spend on one file (see progress)
+        checker_timeout - seconds a task may spend in one checker
+        deadline - time.monotonic() value after which no more tasks are
+                   started, and running tasks are stopped
+    """
+    def __init__(self, processes: int, initializer: Callable = None,
+                 initargs: tuple = (), file_timeout: float = None,
+                 checker_timeout: float = None, deadline: float = None):
+        self.file_timeout = file_timeout
+        self.checker_timeout = checker_timeout
+        self.deadline = deadline
+        self._context = _context()
+        self._initializer = initializer
+        self._initargs = initargs
+        self._workers = [self._start_worker() for _ in range(processes)]
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._closing = False
+        self._wake_recv, self._wake_send = self._context.Pipe(duplex=False)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Schedules fn(*args) to be run in a worker process."""
+        future = Future()
+        with self._lock:
+            self._pending.append(_Task(fn, args, future))
+        self._wake()
+        return future
+
+    def shutdown(self):
+        """Waits for submitted tasks to finish, and stops the workers."""
+        with self._lock:
+            self._closing = True
+        self._wake()
+        self._thread.join()
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.kill()
+            else:
+                worker.conn.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+
+    def _start_worker(self) -> _Worker:
+        return _Worker(self._context, self._initializer, self._initargs)
+
+    def _wake(self):
+        try:
+            self._wake_send.send(None)
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                self._assign(now)
+                busy = [w for w in self._workers if w.task]
+                if self._closing and not busy and not self._pending:
+                    return
+            ready = wait([w.conn for w in busy] + [self._wake_recv],
+                         self._next_limit(busy, now))
+            for conn in ready:
+                if conn is self._wake_recv:
+                    while self._wake_recv.poll():
+                        self._wake_recv.recv()
+                    continue
+                worker = next(w for w in busy if w.conn is conn)
+                self._receive(worker)
+            self._enforce_limits(time.monotonic())
+
+    def _assign(self, now: float):
+        for worker in self._workers:
+            while not worker.task and self._pending:
+                task = self._pending.popleft()
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+                if self.deadline is not None and now >= self.deadline:
+                    task.future.set_exception(TaskTimeout(
+                        'not checked: the time limit for the run was'
+                        ' exceeded'))
+                    continue
+                task.start(now)
+                worker.task = task
+                worker.conn.send((task.fn, task.args))
+
+    def _receive(self, worker: _Worker):
+        task = worker.task
+        try:
+            while worker.conn.poll():
+                message = worker.conn.recv()
+                if message[0] == 'progress':
+                    now = time.monotonic()
+                    if message[1] in ('file', 'member'):
+                        task.file = message[2]
+                        if message[1] == 'file':
+                            task.file_started = now
+                        task.checker = None
+                        task.checker_started = None
+                    else:
+                        task.checker = message[2]
+                        task.checker_started = now
+                    continue
+                worker.task = None
+                if message[0] == 'done':
+                    task.future.set_result(message[1])
+                else:
+                    task.future.set_exception(message[1])
+                return
+        except (EOFError, OSError):
+            elapsed = time.monotonic() - task.started
+            self._replace(worker)
+            task.future.set_exception(TaskFailed(
+                f'worker process died {task.describe()}'
+                f' after {elapsed:.1f}s', elapsed))
+
+    def _limits(self, task: _Task):
+        # Yields (time the limit expires, description of the limit) pairs
+        if self.deadline is not None:
+            yield self.deadline, 'the time limit for the run was exceeded'
+        if self.file_timeout is not None:
+            yield (task.file_started + self.file_timeout,
+                   f'time limit per file is {self.file_timeout}s')
+        if self.checker_timeout is not None and task.checker_started:
+            yield (task.checker_started + self.checker_timeout,
+                   f'time limit per checker is {self.checker_timeout}s')
+
+    def _next_limit(self, busy, now: float) -> Optional[float]:
+        expiries = [expiry for worker in busy
+                    for expiry, _ in self._limits(worker.task)]
+        if not expiries:
+            return None
+        return max(min(expiries) - now, 0)
+
+    def _enforce_limits(self, now: float):
+        for worker in self._workers:
+            task = worker.task
+            if not task:
+                continue
+            for expiry, reason in self._limits(task):
+                if now >= expiry:
+                    elapsed = now - task.started
+                    self._replace(worker)
+                    task.future.set_exception(TaskTimeout(
+                        f'gave up {task.describe()} after {elapsed:.1f}s'
+                        f' ({reason})', elapsed))
+                    break
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        self._workers[self._workers.index(worker)] = self._start_worker()
@@ -1,9 +1,13 @@
+from io import BytesIO
+import os
 from pathlib import Path
 import tarfile
 from tempfile import TemporaryDirectory
+import zipfile
 from zipfile import ZipFile
+from spot_check_files import archives
 from spot_check_files.archives import TarChecker, ZipChecker
-from spot_check_files.checker import CheckRequest
+from spot_check_files.checker import ArchiveLimits, CheckRequest
 
 
 def test_not_zip():
@@ -78,6 +82,108 @@ def test_valid_zipfile():
         assert res.errors == []
 
 
+def test_zip_members():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        req = CheckRequest(
+            realpath=tmpdir.joinpath('test.zip'),
+            tmpdir=tmpdir,
+            virtpath='irrelevant',
+            extract=False)
+        with ZipFile(req.realpath, 'w') as zf:
+            zf.writestr('alpha/', '')
+            zf.writestr('alpha/good.txt', 'nice to meet you!')
+            zf.writestr('bad.txt', 'this works fine')
+        res = ZipChecker().check(req)
+        assert res.recognizer
+        assert res.extracted is None
+        members = [(m.name, m.size, m.data) for m in res.members]
+        assert members == [('alpha/good.txt', 17, b'nice to meet you!'),
+                           ('bad.txt', 15, b'this works fine')]
+        assert res.errors == []
+        assert list(tmpdir.iterdir()) == [req.realpath]
+
+        old = req.realpath.read_bytes()
+        corrupt = old.replace(bytes('work', 'utf-8'), bytes('fail', 'utf-8'))
+        req.realpath.write_bytes(corrupt)
+        res = ZipChecker().check(req)
+        assert [m.name for m in res.members] == ['alpha/good.txt']
+        assert ([str(e) for e in res.errors]
+                == ["Bad CRC-32 for file 'bad.txt'"])
+
+        # members that aren't selected aren't read, so their errors
+        # aren't found
+        req.select = lambda name, size: name == 'alpha/good.txt'
+        res = ZipChecker().check(req)
+        assert [m.name for m in res.members] == ['alpha/good.txt']
+        assert res.errors == []
+
+
+def test_zip_select():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        req = CheckRequest(
+            realpath=tmpdir.joinpath('test.zip'),
+            tmpdir=tmpdir,
+            virtpath='irrelevant',
+            select=lambda name, size: size > 3)
+        with ZipFile(req.realpath, 'w') as zf:
+            zf.writestr('alpha/', '')
+            zf.writestr('alpha/one.txt', 'one')
+            zf.writestr('alpha/three.txt', 'three')
+            zf.writestr('four.txt', 'four')
+        res = ZipChecker().check(req)
+        assert res.errors == []
+        extracted = sorted(str(p.relative_to(res.extracted))
+                           for p in res.extracted.glob('**/*'))
+        assert extracted == ['alpha', 'alpha/three.txt', 'four.txt']
+
+
+def test_zip_members_large():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        req = CheckRequest(
+            realpath=tmpdir.joinpath('test.zip'),
+            tmpdir=tmpdir,
+            virtpath='irrelevant',
+            extract=False)
+        with ZipFile(req.realpath, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('big.txt', 'x' * (archives._SPOOL_MAX + 1))
+        res = ZipChecker().check(req)
+        for member in res.members:
+            assert member.data is None
+            assert member.size == archives._SPOOL_MAX + 1
+            assert member.realpath.stat().st_size == member.size
+            realpath = member.realpath
+        assert not realpath.exists()
+        assert res.errors == []
+
+
+def test_quick():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        req = CheckRequest(
+            realpath=tmpdir.joinpath('test'),
+            tmpdir=tmpdir,
+            virtpath='irrelevant',
+            quick=True)
+        with ZipFile(req.realpath, 'w') as zf:
+            zf.writestr('good.txt', 'nice to meet you!')
+        res = ZipChecker().check(req)
+        assert res.recognizer
+        assert res.extracted is None
+        assert res.members is None
+        assert res.errors == []
+
+        with tarfile.open(req.realpath, 'w:gz') as tf:
+            tf.add(Path('tests').joinpath('testimage.jpg'), 'image.jpg')
+        res = TarChecker().check(req)
+        assert res.recognizer
+        assert res.extracted is None
+        assert res.members is None
+        assert res.errors == []
+
+
 def test_not_tarfile():
     with TemporaryDirectory() as tmpdir:
         tmpdir = Path(tmpdir)
@@ -159,3 +265,140 @@ def test_valid_tarfile():
         test_compression('gz')
         test_compression('bz2')
         test_compression('xz')
+
+
+def test_tarfile_stream():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        req = CheckRequest(
+            realpath=tmpdir.joinpath('test.tar'),
+            tmpdir=tmpdir,
+            virtpath='irrelevant',
+            extract=False)
+
+        dir1 = tmpdir.joinpath('alpha')
+        dir1.mkdir()
+        dir1.joinpath('file1').write_text('hello' * 10)
+        dir1.joinpath('file2').write_text('goodbye' * 10)
+
+        for compression in ['', 'gz', 'bz2', 'xz']:
+            with tarfile.open(req.realpath, f'w:{compression}') as tf:
+                tf.add(dir1, 'alpha')
+            res = TarChecker().check(req)
+            assert res.recognizer
+            assert res.extracted is None
+            members = sorted((m.name, m.data) for m in res.members)
+            assert members == [('alpha/file1', b'hello' * 10),
+                               ('alpha/file2', b'goodbye' * 10)]
+            assert res.errors == []
+
+        req.select = lambda name, size: name == 'alpha/file2'
+        res = TarChecker().check(req)
+        assert [m.name for m in res.members] == ['alpha/file2']
+        req.extract = True
+        res = TarChecker().check(req)
+        assert ([p.relative_to(res.extracted).as_posix()
+                 for p in res.extracted.glob('**/*') if p.is_file()]
+                == ['alpha/file2'])
+        req.select = None
+        req.extract = False
+
+        dir1.joinpath('file3').write_bytes(os.urandom(100000))
+        with tarfile.open(req.realpath, 'w:gz') as tf:
+            tf.add(dir1, 'alpha')
+        data = req.realpath.read_bytes()
+        req.realpath.write_bytes(data[:len(data) // 2])
+        res = TarChecker().check(req)
+        assert res.recognizer
+        list(res.members)
+        assert len(res.errors) == 1
+
+        req.realpath.write_text('garbage')
+        res = TarChecker().check(req)
+        assert res.recognizer is None
+        assert res.members is None
+        assert res.errors == ['not a tarfile']
+
+
+def test_limits():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        zpath = tmpdir.joinpath('test.zip')
+        with ZipFile(zpath, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('a.txt', 'a' * 100000)
+            zf.writestr('b.txt', 'b')
+        tpath = tmpdir.joinpath('test.tar.gz')
+        with tarfile.open(tpath, 'w:gz') as tf:
+            tf.add(zpath, 'a.zip')
+            tf.add(zpath, 'b.zip')
+
+        def check(checker, path, extract, **limits):
+            req = CheckRequest(realpath=path, tmpdir=tmpdir,
+                               virtpath=path, extract=extract,
+                               limits=ArchiveLimits(**limits))
+            res = checker.check(req)
+            members = list(res.members or [])
+            assert res.recognizer
+            return res, members
+
+        zsize = zpath.stat().st_size
+        for checker, path in [(ZipChecker(), zpath),
+                              (TarChecker(), tpath)]:
+            for extract in [True, False]:
+                res, members = check(checker, path, extract)
+                assert res.errors == []
+                assert len(members) == (0 if extract else 2)
+                res, members = check(checker, path, extract, max_members=1)
+                assert res.errors == [
+                    'archive has too many members (limit: 1)']
+                assert res.extracted is None
+                # streamed tars are only found to exceed the limit once
+                # they get to the second member
+                streamed = not extract and isinstance(checker, TarChecker)
+                assert len(members) == (1 if streamed else 0)
+                res, members = check(checker, path, extract, max_nesting=0)
+                assert res.errors == [
+                    'archive is inside too many other archives (limit: 0)']
+                assert res.extracted is None
+
+        res, _ = check(ZipChecker(), zpath, True, max_size=100000)
+        assert res.errors == [
+            'archive members are too big (100001 bytes; limit: 100000)']
+        assert res.extracted is None
+        res, _ = check(ZipChecker(), zpath, True, max_ratio=10)
+        assert len(res.errors) == 1
+        assert res.errors[0].startswith('archive is compressed too much')
+        res, _ = check(TarChecker(), tpath, True, max_size=2 * zsize - 1)
+        assert len(res.errors) == 1
+        assert res.errors[0].startswith('archive members are too big')
+
+
+def test_tar_limits_headers(monkeypatch):
+    # When extracting, a tar is only read up to the header that exceeds a
+    # limit
+    reads = []
+    next_header = tarfile.TarFile.next
+
+    def counting_next(self):
+        info = next_header(self)
+        reads.append(info and info.name)
+        return info
+
+    monkeypatch.setattr(tarfile.TarFile, 'next', counting_next)
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        tpath = tmpdir.joinpath('test.tar')
+        with tarfile.open(tpath, 'w') as tf:
+            for i in range(10):
+                data = str(i).encode()
+                info = tarfile.TarInfo(f'{i}.txt')
+                info.size = len(data)
+                tf.addfile(info, BytesIO(data))
+        reads.clear()
+        req = CheckRequest(realpath=tpath, tmpdir=tmpdir, virtpath=tpath,
+                           limits=ArchiveLimits(max_members=2))
+        res = TarChecker().check(req)
+        assert res.errors == ['archive has too many members (limit: 2)']
+        assert res.extracted is None
+        # (tarfile.open reads the first header too)
+        assert set(reads) == {'0.txt', '1.txt', '2.txt'}
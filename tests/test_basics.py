@@ -1,9 +1,11 @@
 import json
+import os
 from pathlib import Path
 from PIL import Image, UnidentifiedImageError
 from tempfile import TemporaryDirectory
+from spot_check_files import basics
 from spot_check_files.basics import CSVChecker, ImageChecker,\
-    JSONChecker, PlaintextChecker, XMLChecker
+    JSONChecker, NDJSONChecker, PlaintextChecker, XMLChecker
 from spot_check_files.checker import CheckRequest
 
 
@@ -71,6 +73,37 @@ def test_csv_missing_cols():
         assert str(res.errors[0]) == 'Could not determine delimiter'
 
 
+def test_csv_invalid_rows():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(
+            realpath=td.joinpath('test.csv'),
+            tmpdir=td,
+            virtpath=Path('irrelevant'))
+        rows = [f'{i},"text\nwith ""quotes""",{i * 2}\n' for i in range(2000)]
+        rows[10] = '10,ragged\n'
+        rows[1500] = '1500,"bad"quote,3000\n'
+        req.realpath.write_bytes(('a,b,c\n' + ''.join(rows)).encode()
+                                 + b'2000,\xff,4000\n')
+        for checker in [CSVChecker(jobs=1), CSVChecker(),
+                        CSVChecker(jobs=2, chunk_size=1000)]:
+            res = checker.check(req)
+            assert isinstance(res.recognizer, CSVChecker)
+            assert res.errors == [
+                'row 12 (line 22): 2 columns, expected 3',
+                'row 1502 (line 3001): \',\' expected after \'"\'',
+                "row 2002 (line 4000): 'utf-8' codec can't decode"
+                " bytes 0xff: invalid start byte"]
+
+        req.realpath.write_text('a,b\n1,2\n' + '1\n' * 20)
+        req.header = None
+        res = CSVChecker(chunk_size=10).check(req)
+        assert isinstance(res.recognizer, CSVChecker)
+        assert len(res.errors) == 11
+        assert res.errors[0] == 'row 3 (line 3): 1 columns, expected 2'
+        assert res.errors[-1] == '10 more invalid rows'
+
+
 def test_tsv():
     with TemporaryDirectory() as td:
         td = Path(td)
@@ -88,6 +121,52 @@ def test_tsv():
             assert res.thumb.tobytes() == img.tobytes()
 
 
+def test_quick():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(
+            realpath=td.joinpath('test'),
+            tmpdir=td,
+            virtpath=Path('irrelevant'),
+            quick=True,
+            thumb=True)
+
+        # only the start of the file is considered
+        req.realpath.write_text(_TEST_CSV + '"unterminated\n' * 2000)
+        req.header = None
+        res = CSVChecker().check(req)
+        assert isinstance(res.recognizer, CSVChecker)
+        assert res.thumb is None
+        req.realpath.write_text('[1, 2, 3' + ' ' * 10000 + 'garbage')
+        req.header = None
+        res = JSONChecker().check(req)
+        assert isinstance(res.recognizer, JSONChecker)
+        assert res.errors == []
+        req.realpath.write_text('<root>' + ' ' * 10000 + '</wrong>')
+        req.header = None
+        res = XMLChecker().check(req)
+        assert isinstance(res.recognizer, XMLChecker)
+        assert res.errors == []
+        res = PlaintextChecker().check(req)
+        assert isinstance(res.recognizer, PlaintextChecker)
+        assert res.thumb is None
+
+        req.realpath.write_text('garbage')
+        req.header = None
+        res = JSONChecker().check(req)
+        assert res.recognizer is None
+        assert res.errors == ['does not start with a JSON value']
+        res = XMLChecker().check(req)
+        assert res.recognizer is None
+        assert 'syntax error' in str(res.errors[0])
+
+        req.realpath = Path('tests').joinpath('testimage.jpg')
+        req.header = None
+        res = ImageChecker().check(req)
+        assert isinstance(res.recognizer, ImageChecker)
+        assert res.thumb is None
+
+
 def test_image_valid():
     with TemporaryDirectory() as td:
         td = Path(td)
@@ -144,6 +223,19 @@ def test_json_valid():
             assert res.thumb.tobytes() == img.tobytes()
 
 
+def test_json_in_memory():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(
+            realpath=None,
+            tmpdir=td,
+            virtpath=Path('irrelevant'),
+            data=_TEST_JSON.encode('utf-8'))
+        res = JSONChecker().check(req)
+        assert isinstance(res.recognizer, JSONChecker)
+        assert res.errors == []
+
+
 def test_json_invalid():
     with TemporaryDirectory() as td:
         td = Path(td)
@@ -156,6 +248,92 @@ def test_json_invalid():
         assert res.recognizer is None
         assert len(res.errors) == 1
         assert isinstance(res.errors[0], json.JSONDecodeError)
+        assert str(res.errors[0]) \
+            == 'Expecting \',\' delimiter: line 1 column 17 (char 16)'
+
+
+def test_ndjson():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(
+            realpath=td.joinpath('test.ndjson'),
+            tmpdir=td,
+            virtpath=Path('irrelevant'))
+        lines = [json.dumps({'n': i, 'text': 'x' * (i % 50)})
+                 for i in range(2000)]
+        lines[10] = '{"n": 10'
+        lines[1500] = 'oops'
+        lines[1501] = ''
+        req.realpath.write_text('\n'.join(lines) + '\n')
+        for checker in [NDJSONChecker(jobs=1), NDJSONChecker(),
+                        NDJSONChecker(jobs=2, chunk_size=1000)]:
+            res = checker.check(req)
+            assert isinstance(res.recognizer, NDJSONChecker)
+            assert res.errors == [
+                "line 11 column 9: Expecting ',' delimiter",
+                'line 1501 column 1: Expecting value']
+
+        req.realpath.write_text('[1]\n' + 'x\n' * 20)
+        res = NDJSONChecker(chunk_size=10).check(req)
+        assert isinstance(res.recognizer, NDJSONChecker)
+        assert len(res.errors) == 11
+        assert res.errors[0] == 'line 2 column 1: Expecting value'
+        assert res.errors[-1] == '10 more invalid lines'
+
+        req.realpath.write_text('nope\n')
+        res = NDJSONChecker().check(req)
+        assert res.recognizer is None
+
+        # blank lines don't count as valid JSON lines
+        for data, errors in [
+                (b'\n\n\n', ['no JSON lines found']),
+                (b'hello\n\nworld\n', ['line 1 column 1: Expecting value',
+                                       'line 3 column 1: Expecting value']),
+                (b'garbage\n\n', ['line 1 column 1: Expecting value'])]:
+            req.realpath.write_bytes(data)
+            res = NDJSONChecker().check(req)
+            assert res.recognizer is None
+            assert res.errors == errors
+
+        # lines nested too deeply for json are still checked
+        deep = '[' * 100000 + ']' * 100000
+        req.realpath.write_text(f'{deep}\n{deep[:-1]}\n')
+        res = NDJSONChecker().check(req)
+        assert isinstance(res.recognizer, NDJSONChecker)
+        assert res.errors == ["line 2 column 200000: Expecting ',' delimiter"]
+
+        req.quick = True
+        req.header = None
+        req.realpath.write_text('{"a": 1}\n' * 2000)
+        res = NDJSONChecker().check(req)
+        assert isinstance(res.recognizer, NDJSONChecker)
+        assert res.errors == []
+
+
+def test_csv_no_pool(monkeypatch):
+    # By default, a large file doesn't get a process pool of its own
+    monkeypatch.setattr(basics, 'ProcessPoolExecutor', None)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(realpath=td.joinpath('test.csv'), tmpdir=td,
+                           virtpath=Path('irrelevant'))
+        req.realpath.write_text(_TEST_CSV * 100)
+        res = CSVChecker(chunk_size=100).check(req)
+        assert isinstance(res.recognizer, CSVChecker)
+
+
+def test_ndjson_no_pool(monkeypatch):
+    # By default, a large file doesn't get a process pool of its own
+    monkeypatch.setattr(basics, 'ProcessPoolExecutor', None)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(realpath=td.joinpath('test.ndjson'), tmpdir=td,
+                           virtpath=Path('irrelevant'))
+        req.realpath.write_text('[1]\n' * 1000)
+        res = NDJSONChecker(chunk_size=100).check(req)
+        assert isinstance(res.recognizer, NDJSONChecker)
 
 
 def test_plaintext_valid():
@@ -231,3 +409,27 @@ def test_xml_invalid():
         assert res.recognizer is None
         assert len(res.errors) == 1
         assert 'no element found' in str(res.errors[0])
+
+        req.realpath.write_text('<a>\n  <b>\n</a>' + ' ' * 2000000)
+        res = XMLChecker().check(req)
+        assert res.recognizer is None
+        assert str(res.errors[0]) == 'mismatched tag: line 3, column 2'
+
+
+def test_xml_large():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(
+            realpath=td.joinpath('test.xml'),
+            tmpdir=td,
+            virtpath=Path('irrelevant'),
+            thumb=True)
+        with open(req.realpath, 'w') as file:
+            file.write('<rows>')
+            for i in range(100000):
+                file.write(f'<row id="{i}"><name>row {i}</name></row>')
+            file.write('</rows>')
+        res = XMLChecker().check(req)
+        assert isinstance(res.recognizer, XMLChecker)
+        assert res.errors == []
+        assert res.thumb is not None
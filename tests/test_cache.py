@@ -0,0 +1,118 @@
+import os
+import time
+from pathlib import Path
+from PIL import Image
+from tempfile import TemporaryDirectory
+from zipfile import ZipFile
+from spot_check_files import thumbs
+from spot_check_files.basics import PlaintextChecker
+from spot_check_files.cache import ResultCache, _pack
+from spot_check_files.checker import Checker, CheckerRunner, CheckResult,\
+    FileSummary, NamedChecker
+
+
+# Kept outside the checker, since changing the checker's attributes would
+# change the runner's config
+_CHECKED = []
+
+
+class _CountingChecker(Checker):
+    def __str__(self):
+        return 'CountingChecker'
+
+    def check(self, req):
+        _CHECKED.append(req.virtpath)
+        return CheckResult()
+
+
+def test_get_put():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        fpath = td.joinpath('a.txt')
+        fpath.write_text('hello')
+        cache = ResultCache(td.joinpath('cache.db'))
+        assert cache.get(fpath, Path('x/a.txt'), 'conf') is None
+        thumb = Image.new('L', (10, 10), color=5)
+        cache.put(fpath, Path('x/a.txt'), 'conf', [
+            FileSummary(size=5, virtpath=Path('x/a.txt'),
+                        result=CheckResult(recognizer=PlaintextChecker(),
+                                           errors=['bad', ValueError('v')],
+                                           thumb=thumb))])
+        cache.close()
+
+        cache = ResultCache(td.joinpath('cache.db'))
+        assert cache.get(fpath, Path('x/a.txt'), 'other') is None
+        [s] = cache.get(fpath, Path('y/a.txt'), 'conf')
+        assert s.size == 5
+        assert s.virtpath == Path('y/a.txt')
+        # the recognizer is only stored by name
+        assert s.result.recognizer == NamedChecker('PlaintextChecker')
+        assert [str(e) for e in s.result.errors] == ['bad', 'v']
+        assert s.result.thumb.tobytes() \
+            == thumbs.decode(thumbs.encode(thumb)).tobytes()
+
+        stat = fpath.stat()
+        os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert cache.get(fpath, Path('x/a.txt'), 'conf') is None
+        cache.hash = True
+        assert cache.get(fpath, Path('x/a.txt'), 'conf') is None
+        cache.put(fpath, Path('x/a.txt'), 'conf', [])
+        os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2000))
+        assert cache.get(fpath, Path('x/a.txt'), 'conf') == []
+        fpath.write_text('jello')
+        assert cache.get(fpath, Path('x/a.txt'), 'conf') is None
+        cache.close()
+
+
+def test_eviction():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        cache = ResultCache(td.joinpath('cache.db'))
+        paths = []
+        for i in range(3):
+            path = td.joinpath(f'{i}.txt')
+            path.write_text('hello')
+            paths.append(path)
+            cache.put(path, path, 'conf', [])
+        # make paths[1] the least recently used
+        time.sleep(0.01)
+        cache.get(paths[0], paths[0], 'conf')
+        # leave room for two entries
+        cache.max_size = len(_pack([], td)) * 2
+        cache.flush()
+        assert cache.get(paths[1], paths[1], 'conf') is None
+        assert cache.get(paths[2], paths[2], 'conf') == []
+        assert cache.get(paths[0], paths[0], 'conf') == []
+        cache.close()
+
+
+def test_runner():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        data = td.joinpath('data')
+        data.mkdir()
+        data.joinpath('a.foo').write_text('hello')
+        with ZipFile(data.joinpath('b.zip'), 'w') as zf:
+            zf.writestr('c.txt', 'hi')
+        counter = _CountingChecker()
+        runner = CheckerRunner.default()
+        runner.checkers.insert(0, counter)
+        runner.cache = ResultCache(td.joinpath('cache.db'))
+        first = runner.check_path(data)
+        assert len(first) == 3
+        assert len(_CHECKED) == 3
+        second = runner.check_path(data)
+        assert len(_CHECKED) == 3
+        assert ([(s.virtpath, s.size, str(s.result.recognizer))
+                 for s in first]
+                == [(s.virtpath, s.size, str(s.result.recognizer))
+                    for s in second])
+        runner.checkers.append(PlaintextChecker())
+        assert len(runner.check_path(data)) == 3
+        assert len(_CHECKED) == 6
+
+        runner.jobs = 2
+        third = runner.check_path(data)
+        assert len(_CHECKED) == 6
+        assert ([s.virtpath for s in third] == [s.virtpath for s in first])
+        runner.cache.close()
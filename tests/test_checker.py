@@ -1,9 +1,41 @@
+from io import BytesIO
+import mmap
 from pathlib import Path
+import tarfile
+import time
 from tempfile import TemporaryDirectory
 from zipfile import ZipFile
 from spot_check_files.archives import ZipChecker
 from spot_check_files.basics import CSVChecker, PlaintextChecker
-from spot_check_files.checker import CheckerRunner
+from spot_check_files.checker import Checker, CheckerRunner,\
+    CheckRequest, CheckResult
+from spot_check_files.events import RunnerListener
+from spot_check_files.sampling import Sampler
+from spot_check_files import thumbs
+from spot_check_files.thumbs import Thumbnail, ThumbnailStore
+from spot_check_files.workers import TaskTimeout
+
+
+class SlowChecker(Checker):
+    """Takes a long time to check files named slow.txt."""
+    def __str__(self):
+        return 'SlowChecker'
+
+    def check(self, req: CheckRequest) -> CheckResult:
+        if req.virtpath.name == 'slow.txt':
+            time.sleep(30)
+        return CheckResult()
+
+
+class SlowMembers(Checker):
+    """Takes a while to check each member of an archive."""
+    def __str__(self):
+        return 'SlowMembers'
+
+    def check(self, req: CheckRequest) -> CheckResult:
+        if req.nesting:
+            time.sleep(0.2)
+        return CheckResult()
 
 
 def test_check_path_single_file():
@@ -51,3 +83,524 @@ def test_check_path_dir():
         assert s[1].virtpath == vpath4
         assert isinstance(s[1].result.recognizer, PlaintextChecker)
         assert s[1].result.errors == []
+
+
+def test_check_path_depth():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('test.csv').write_text('a,b,c\n1,2,3')
+        with ZipFile(td.joinpath('test.zip'), 'w') as zf:
+            zf.writestr('file1.txt', 'hello')
+        s = CheckerRunner.default(depth='full').check_path(td)
+        assert len(s) == 3
+        assert all(x.result.thumb for x in s if x.virtpath.suffix != '.zip')
+        s = CheckerRunner.default(depth='standard').check_path(td)
+        assert len(s) == 3
+        assert not any(x.result.thumb for x in s)
+        s = CheckerRunner.default(depth='quick').check_path(td)
+        assert len(s) == 2
+        assert all(x.result.recognizer for x in s)
+
+
+def test_check_path_parallel():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('test.csv').write_text('a,b,c\n1,2,3')
+        td.joinpath('bad.json').write_text('{')
+        inner = td.joinpath('inner.zip')
+        with ZipFile(inner, 'w') as zf:
+            zf.writestr('gamma/file3.txt', 'hi')
+        with ZipFile(td.joinpath('test.zip'), 'w') as zf:
+            zf.writestr('alpha/file1.txt', 'hello')
+            zf.write(inner, 'beta/inner.zip')
+        inner.unlink()
+
+        def simplify(summaries):
+            return [(s.virtpath, s.size, str(s.result.recognizer),
+                     [str(e) for e in s.result.errors],
+                     bool(s.result.extracted)) for s in summaries]
+
+        serial = CheckerRunner.default().check_path(td)
+        parallel = CheckerRunner.default(jobs=3).check_path(td)
+        assert len(serial) == 6
+        assert simplify(parallel) == simplify(serial)
+        # archive contents immediately follow the archive
+        vpaths = [s.virtpath for s in parallel]
+        zpath = td.joinpath('test.zip')
+        after = vpaths[vpaths.index(zpath) + 1:vpaths.index(zpath) + 4]
+        assert all(zpath in p.parents for p in after)
+
+
+def test_check_path_no_extract():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('test.csv').write_text('a,b,c\n1,2,3')
+        inner = td.joinpath('inner.tar.gz')
+        td.joinpath('file3.json').write_text('{')
+        with tarfile.open(inner, 'w:gz') as tf:
+            tf.add(td.joinpath('file3.json'), 'gamma/file3.json')
+        td.joinpath('file3.json').unlink()
+        with ZipFile(td.joinpath('test.zip'), 'w') as zf:
+            zf.writestr('alpha/file1.txt', 'hello')
+            zf.write(inner, 'beta/inner.tar.gz')
+        inner.unlink()
+
+        def simplify(summaries):
+            return sorted((str(s.virtpath), s.size, str(s.result.recognizer),
+                           [str(e) for e in s.result.errors])
+                          for s in summaries)
+
+        extracted = CheckerRunner.default().check_path(td)
+        unextracted = CheckerRunner.default(extract=False).check_path(td)
+        assert len(extracted) == 5
+        assert simplify(unextracted) == simplify(extracted)
+        assert all(s.result.extracted is None for s in unextracted)
+        zs = next(s for s in unextracted if s.virtpath.name == 'test.zip')
+        assert zs.result.members == []
+
+
+def test_check_path_dedup():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('a.json').write_text('{')
+        td.joinpath('b.txt').write_text('{')
+        td.joinpath('c.json').write_text('[')
+        # (in a subdirectory, so a.json is checked before e.json, which
+        # is only hashed because a.json has the same size)
+        td.joinpath('zips').mkdir()
+        with ZipFile(td.joinpath('zips', 'd.zip'), 'w') as zf:
+            zf.writestr('e.json', '{')
+            zf.writestr('f.json', '{}')
+        td.joinpath('zips', 'g.zip').write_bytes(
+            td.joinpath('zips', 'd.zip').read_bytes())
+
+        for kwargs in [{}, {'extract': False}, {'jobs': 2}]:
+            s = CheckerRunner.default(dedup=True, **kwargs).check_path(td)
+            # the contents of only one of the zips are listed
+            assert len(s) == 7
+            by_name = {x.virtpath.name: x for x in s}
+            # b.txt would be checked differently due to its extension
+            assert by_name['b.txt'].duplicate_of is None
+            assert by_name['c.json'].duplicate_of is None
+            assert by_name['f.json'].duplicate_of is None
+            groups = [['d.zip', 'g.zip']]
+            if kwargs.get('extract', True):
+                groups.append(['a.json', 'e.json'])
+            else:
+                # files read directly from archives aren't compared
+                assert by_name['e.json'].duplicate_of is None
+            for group in groups:
+                group = [by_name[name] for name in group]
+                [original] = [x for x in group if not x.duplicate_of]
+                for dup in group:
+                    if dup is not original:
+                        assert dup.duplicate_of == original.virtpath
+                        assert dup.result.errors == original.result.errors
+                        assert (str(dup.result.recognizer)
+                                == str(original.result.recognizer))
+
+
+def test_check_path_dedup_skipped():
+    # a copy of a skipped file is still checked
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('skip.json').write_text('{')
+        td.joinpath('sub').mkdir()
+        td.joinpath('sub', 'b.json').write_text('{')
+        for jobs in [1, 2]:
+            cr = CheckerRunner.default(jobs=jobs, dedup=True)
+            cr.checkers[0].blacklist.append('*skip.json')
+            by_name = {x.virtpath.name: x for x in cr.check_path(td)}
+            assert by_name['skip.json'].result.skipped
+            assert by_name['b.json'].duplicate_of is None
+            assert not by_name['b.json'].result.skipped
+            assert by_name['b.json'].result.errors
+
+
+def test_check_path_dedup_order():
+    # duplicates are decided in the order the files are returned, whether
+    # or not multiple jobs are used
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        with ZipFile(td.joinpath('arch.zip'), 'w') as zf:
+            zf.writestr('x.txt', 'x')
+        inner = BytesIO()
+        with ZipFile(inner, 'w') as zf:
+            zf.writestr('y.txt', 'y')
+        with ZipFile(td.joinpath('a.zip'), 'w') as zf:
+            zf.writestr('inner.zip', inner.getvalue())
+        td.joinpath('sub').mkdir()
+        td.joinpath('sub', 'inner.zip').write_bytes(inner.getvalue())
+        with tarfile.open(td.joinpath('sub', 'nested.tar'), 'w') as tf:
+            tf.add(td.joinpath('arch.zip'), 'arch.zip')
+
+        def listing(s):
+            return [(str(x.virtpath.relative_to(td)),
+                     x.duplicate_of and str(x.duplicate_of.relative_to(td)))
+                    for x in s]
+        for extract in [True, False]:
+            expected = listing(CheckerRunner.default(
+                dedup=True, extract=extract).check_path(td))
+            assert ('a.zip/inner.zip', None) in expected
+            if extract:
+                assert ('sub/inner.zip', 'a.zip/inner.zip') in expected
+                assert ('sub/nested.tar/arch.zip', 'arch.zip') in expected
+            else:
+                # (files read directly from the tar aren't compared)
+                assert ('sub/nested.tar/arch.zip/x.txt', None) in expected
+            assert listing(CheckerRunner.default(
+                jobs=2, dedup=True, extract=extract).check_path(td)) \
+                == expected
+
+
+def test_iter_check():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        for i in range(20):
+            td.joinpath(f'{i}.txt').write_text(str(i))
+        with ZipFile(td.joinpath('test.zip'), 'w') as zf:
+            zf.writestr('a.txt', 'a')
+        for jobs in [1, 2]:
+            cr = CheckerRunner.default(jobs=jobs)
+            it = cr.iter_check(td)
+            first = next(it)
+            assert first.virtpath.parent == td
+            rest = list(it)
+            assert ([s.virtpath for s in [first] + rest]
+                    == [s.virtpath for s in cr.check_path(td)])
+            assert len(rest) == 21
+
+
+def test_check_path_sample():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        for i in range(100):
+            td.joinpath(f'{i}.txt').write_text(str(i))
+        with ZipFile(td.joinpath('test.zip'), 'w') as zf:
+            for i in range(100):
+                zf.writestr(f'{i}.txt', str(i))
+        expected = None
+        for jobs, extract in [(1, True), (1, False), (2, True), (2, False)]:
+            cr = CheckerRunner.default(jobs=jobs, extract=extract)
+            cr.sampler = Sampler(count=20)
+            s = sorted(str(s.virtpath.relative_to(td))
+                       for s in cr.check_path(td))
+            if expected is None:
+                expected = s
+            assert s == expected
+        # the archive is in a stratum of its own, so it's always checked
+        assert 'test.zip' in expected
+        top = [p for p in expected if '/' not in p]
+        inner = [p for p in expected if p.startswith('test.zip/')]
+        assert 10 < len(top) < 35
+        assert 10 < len(inner) < 35
+        cr.sampler = Sampler(count=20, seed=1)
+        assert sorted(str(s.virtpath.relative_to(td))
+                      for s in cr.check_path(td)) != expected
+
+
+def test_check_path_sample_archives():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        # (different types, so both archives are the first of their
+        # stratum)
+        with ZipFile(td.joinpath('a.zip'), 'w') as zf:
+            for i in range(100):
+                zf.writestr(f'{i}.txt', str(i))
+        with tarfile.open(td.joinpath('b.tar'), 'w') as tf:
+            for i in range(100):
+                info = tarfile.TarInfo(f'{i}.txt')
+                info.size = len(str(i))
+                tf.addfile(info, BytesIO(str(i).encode()))
+        for extract in [True, False]:
+            cr = CheckerRunner.default(extract=extract)
+            cr.sampler = Sampler(fraction=0.25)
+            summaries = cr.check_path(td)
+            inner = {name: {s.virtpath.name for s in summaries
+                            if s.virtpath.parent.name == name}
+                     for name in ['a.zip', 'b.tar']}
+            # members with the same names aren't sampled together
+            assert inner['a.zip'] != inner['b.tar']
+            # the first member of each archive is always checked, but
+            # isn't part of the random sample unless it was chosen
+            forced = [s for s in summaries
+                      if s.forced and s.virtpath.parent != td]
+            assert all(s.virtpath.name == '0.txt' for s in forced)
+            sampler = Sampler(fraction=0.25)
+            assert sorted(s.virtpath.parent.name for s in forced) == [
+                name for name in ['a.zip', 'b.tar']
+                if not sampler.chosen(f'{name}/0.txt')]
+
+
+def test_check_path_prune():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('keep').mkdir()
+        td.joinpath('keep', 'a.txt').write_text('a')
+        td.joinpath('keep', 'skip').mkdir()
+        td.joinpath('keep', 'skip', 'b.txt').write_text('b')
+        td.joinpath('skip').mkdir()
+        td.joinpath('skip', 'c.txt').write_text('c')
+        with ZipFile(td.joinpath('test.zip'), 'w') as zf:
+            zf.writestr('skip/d.txt', 'd')
+            zf.writestr('e.txt', 'e')
+        cr = CheckerRunner.default()
+        cr.checkers[0].blacklist.extend(['*/skip/*', '*/e.txt'])
+        s = cr.check_path(td)
+        assert (sorted(str(s.virtpath.relative_to(td)) for s in s)
+                == ['keep/a.txt', 'test.zip', 'test.zip/e.txt'])
+        assert [s.result.skipped for s in s
+                if s.virtpath.name == 'e.txt'] == [True]
+
+
+def test_request_view():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        small = td.joinpath('small.txt')
+        small.write_text('hello\r\nworld')
+        big = td.joinpath('big.txt')
+        big.write_bytes(b'x' * (2 * 1024 * 1024))
+        empty = td.joinpath('empty.txt')
+        empty.write_bytes(b'')
+
+        req = CheckRequest(realpath=small, tmpdir=td, virtpath=small)
+        view = req.view()
+        assert view == b'hello\r\nworld'
+        assert req.view() is view
+        with req.open() as f1, req.open() as f2:
+            assert f1.read(5) == b'hello'
+            assert f2.read() == b'hello\r\nworld'
+            f1.seek(-5, 2)
+            assert f1.read() == b'world'
+        with req.open('r') as file:
+            assert file.read() == 'hello\nworld'
+        with req.open('r', newline='') as file:
+            assert file.read() == 'hello\r\nworld'
+        assert req.read_header() == b'hello\r\nworld'
+        # a changed file is read again
+        small.write_text('bye')
+        with req.open() as file:
+            assert file.read() == b'bye'
+        req.close()
+
+        req = CheckRequest(realpath=big, tmpdir=td, virtpath=big)
+        assert isinstance(req.view(), mmap.mmap)
+        with req.open() as file:
+            assert len(file.read()) == 2 * 1024 * 1024
+        assert req.read_header() == b'x' * 4096
+        req.close()
+
+        # the header and size don't need a view of the whole file
+        req = CheckRequest(realpath=big, tmpdir=td, virtpath=big)
+        assert req.read_header() == b'x' * 4096
+        assert req.size() == 2 * 1024 * 1024
+        assert req._view is None
+        assert req.bytes_read == 4096
+
+        req = CheckRequest(realpath=empty, tmpdir=td, virtpath=empty)
+        assert req.read_header() == b''
+        with req.open() as file:
+            assert file.read() == b''
+
+        req = CheckRequest(realpath=None, tmpdir=td, virtpath=small,
+                           data=b'abc')
+        assert req.read_header() == b'abc'
+        assert req.size() == 3
+        assert req.view() == b'abc'
+        with req.open('r') as file:
+            assert file.read() == 'abc'
+
+
+def test_check_path_nesting():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        inner = td.joinpath('inner.zip')
+        with ZipFile(inner, 'w') as zf:
+            zf.writestr('a.txt', 'a')
+        with ZipFile(td.joinpath('outer.zip'), 'w') as zf:
+            zf.write(inner, 'inner.zip')
+        inner.unlink()
+        for jobs, extract in [(1, True), (1, False), (2, True)]:
+            cr = CheckerRunner.default(jobs=jobs, extract=extract)
+            cr.limits.max_nesting = 1
+            s = cr.check_path(td)
+            assert ([str(s.virtpath.relative_to(td)) for s in s]
+                    == ['outer.zip', 'outer.zip/inner.zip'])
+            assert s[0].result.errors == []
+            assert s[1].result.errors == [
+                'archive is inside too many other archives (limit: 1)']
+            cr.limits.max_nesting = 2
+            assert len(cr.check_path(td)) == 3
+
+
+def test_check_path_reclaims_temp():
+    with TemporaryDirectory() as td, TemporaryDirectory() as tmpdir:
+        td = Path(td)
+        tmpdir = Path(tmpdir)
+        inner = td.joinpath('inner.zip')
+        with ZipFile(inner, 'w') as zf:
+            zf.writestr('a.csv', 'a,b,c\n1,2,3')
+        for i in range(3):
+            with ZipFile(td.joinpath(f'outer{i}.zip'), 'w') as zf:
+                zf.write(inner, 'inner.zip')
+                zf.writestr('b.txt', str(i))
+        inner.unlink()
+        expected = None
+        for jobs, max_temp in [(1, None), (2, None), (2, 1)]:
+            cr = CheckerRunner.default(jobs=jobs)
+            cr.max_temp = max_temp
+            s = cr.check_path(td, tmpdir=tmpdir)
+            assert list(tmpdir.iterdir()) == []
+            assert len(s) == 12
+            thumbs = [x for x in s if x.virtpath.suffix == '.csv']
+            assert len(thumbs) == 3
+            # the thumbnail doesn't depend on the deleted file
+            thumbs[0].result.thumb.tobytes()
+            paths = sorted(str(x.virtpath.relative_to(td)) for x in s)
+            if expected is None:
+                expected = paths
+            assert paths == expected
+
+            # extracted files are hashed before they're deleted if they
+            # collide with an earlier file, in case they're duplicated by
+            # later files (the first copy of inner.zip wasn't hashed, so
+            # only the third copy is found to be a duplicate)
+            cr.dedup = True
+            s = cr.check_path(td, tmpdir=tmpdir)
+            assert list(tmpdir.iterdir()) == []
+            assert len(s) == 11
+            assert [x.virtpath.name for x in s if x.duplicate_of] \
+                == ['inner.zip']
+
+
+def test_check_path_max_temp():
+    class Listener(RunnerListener):
+        def __init__(self):
+            self.extracted = []
+            self.violations = 0
+
+        def archive_extracted(self, summary):
+            self.extracted.append(summary.result.extracted)
+
+        def file_queued(self, virtpath, size, nesting):
+            # no new file is started while an extracted archive is kept
+            if nesting == 0 and any(x.exists() for x in self.extracted):
+                self.violations += 1
+
+    with TemporaryDirectory() as td, TemporaryDirectory() as tmpdir:
+        td = Path(td)
+        for i in range(20):
+            with ZipFile(td.joinpath(f'{i}.zip'), 'w') as zf:
+                zf.writestr('a.txt', 'a' * 100)
+        cr = CheckerRunner.default(jobs=2)
+        cr.max_temp = 0
+        listener = Listener()
+        cr.listeners.append(listener)
+        assert len(cr.check_path(td, tmpdir=Path(tmpdir))) == 40
+        assert len(listener.extracted) == 20
+        assert listener.violations == 0
+
+
+def test_check_path_timeout_members():
+    # The time limit per file covers the members read from an archive
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        with ZipFile(td.joinpath('z.zip'), 'w') as zf:
+            for i in range(20):
+                zf.writestr(f'{i}.txt', str(i))
+        cr = CheckerRunner([ZipChecker(), SlowMembers()], extract=False)
+        cr.file_timeout = 1
+        start = time.monotonic()
+        s = cr.check_path(td)
+        assert time.monotonic() - start < 3
+        assert len(s) == 1
+        assert isinstance(s[0].result.errors[0], TaskTimeout)
+        assert str(s[0].result.errors[0]).startswith(
+            f'gave up checking {td}/z.zip/')
+
+
+def test_check_path_timeout():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('a.txt').write_text('a')
+        td.joinpath('slow.txt').write_text('slow')
+        with ZipFile(td.joinpath('z.zip'), 'w') as zf:
+            zf.writestr('slow.txt', 'slow')
+            zf.writestr('b.txt', 'b')
+        for jobs in [1, 2]:
+            cr = CheckerRunner.default(jobs=jobs)
+            cr.checkers.insert(0, SlowChecker())
+            cr.checker_timeout = 0.5
+            start = time.monotonic()
+            s = cr.check_path(td)
+            assert time.monotonic() - start < 10
+            assert (sorted(str(x.virtpath.relative_to(td)) for x in s)
+                    == ['a.txt', 'slow.txt', 'z.zip', 'z.zip/b.txt',
+                        'z.zip/slow.txt'])
+            errors = {str(x.virtpath.relative_to(td)): x.result.errors
+                      for x in s}
+            assert errors['a.txt'] == []
+            assert errors['z.zip/b.txt'] == []
+            assert len(errors['slow.txt']) == 1
+            assert isinstance(errors['slow.txt'][0], TaskTimeout)
+            assert str(errors['z.zip/slow.txt'][0]).startswith(
+                f'gave up checking {td}/z.zip/slow.txt with SlowChecker')
+
+            cr.checker_timeout = None
+            cr.deadline = time.monotonic() - 1
+            s = cr.check_path(td)
+            assert all('not checked' in str(x.result.errors[0]) for x in s)
+
+
+def test_check_path_stats():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('a.csv').write_text('a,b,c\n1,2,3')
+        with ZipFile(td.joinpath('z.zip'), 'w') as zf:
+            zf.writestr('b.txt', 'b' * 10000)
+        for extract in [True, False]:
+            cr = CheckerRunner([ZipChecker(), CSVChecker(),
+                                PlaintextChecker()], extract=extract)
+            s = {x.virtpath.relative_to(td).name: x
+                 for x in cr.check_path(td)}
+            assert ([st.checker for st in s['a.csv'].stats]
+                    == ['ZipChecker', 'CSVChecker'])
+            # the header, then the whole file
+            assert s['a.csv'].stats[1].bytes_read == 22
+            assert s['a.csv'].wall == sum(st.wall for st in s['a.csv'].stats)
+            assert all(st.wall >= 0 and st.cpu >= 0
+                       for x in s.values() for st in x.stats)
+            assert [st.checker for st in s['z.zip'].stats] == ['ZipChecker']
+            assert s['z.zip'].stats[0].bytes_read > 0
+            assert s['b.txt'].stats[-1].checker \
+                == str(s['b.txt'].result.recognizer)
+            assert s['b.txt'].stats[-1].bytes_read >= 10000
+
+
+def test_check_path_thumb_store():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        td.joinpath('a.csv').write_text('a,b,c\n1,2,3')
+        td.joinpath('b.txt').write_text('hello')
+        for jobs in [1, 2]:
+            cr = CheckerRunner([CSVChecker(), PlaintextChecker()], jobs=jobs)
+            with TemporaryDirectory() as sd, \
+                    ThumbnailStore(Path(sd), max_memory=10) as store:
+                cr.thumb_store = store
+                s = {x.virtpath.name: x for x in cr.check_path(td)}
+                assert set(s) == {'a.csv', 'b.txt'}
+                for x in s.values():
+                    assert isinstance(x.result.thumb, Thumbnail)
+                    assert x.result.thumb.image().size[0] > 0
+
+        # a thumbnail discarded as soon as it's received is still there for
+        # a later duplicate
+        td.joinpath('c.csv').write_text('a,b,c\n1,2,3')
+        cr = CheckerRunner([CSVChecker(), PlaintextChecker()], dedup=True)
+        with TemporaryDirectory() as sd, \
+                ThumbnailStore(Path(sd)) as store:
+            cr.thumb_store = store
+            for x in cr.iter_check(td):
+                assert x.result.thumb.image().size[0] > 0
+                thumbs.discard(x.result.thumb)
+            assert not store._memory
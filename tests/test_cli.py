@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 import pytest
@@ -31,7 +32,11 @@ def test_help(capsys):
     with pytest.raises(SystemExit):
         cli.main(['-h'])
     cap = capsys.readouterr()
-    out = re.sub(r'\S*pytest\S*', 'spotcheck', cap.out)
+    out = cap.out
+    with pytest.raises(SystemExit):
+        cli.main(['report', '-h'])
+    cap = capsys.readouterr()
+    out = re.sub(r'\S*pytest\S*', 'spotcheck', out + '\n' + cap.out)
     Path('doc').joinpath('usage.txt').write_text(out)
 
 
@@ -74,3 +79,58 @@ def test_skip(capsys):
         cap = capsys.readouterr()
         assert re.search(r'^.*Skipped files.*\b67%.*\b80%.*$',
                          cap.out, re.MULTILINE)
+
+
+def test_ndjson(capsys):
+    with TemporaryDirectory() as td:
+        zp = Path(td).joinpath('test.zip')
+        with ZipFile(zp, 'w') as zf:
+            zf.writestr('sample.csv', _SAMPLE_CSV)
+            zf.writestr('bad.json', '{')
+        assert cli.main(['--ndjson', td]) == 0
+        cap = capsys.readouterr()
+        records = [json.loads(line) for line in cap.out.splitlines()]
+        assert [r['type'] for r in records] == ['file'] * 3 + ['summary']
+        assert records[0]['virtpath'] == str(zp)
+        files = {r['virtpath']: r for r in records[1:3]}
+        csv = files[str(zp.joinpath('sample.csv'))]
+        assert csv['recognizer'] == 'CSVChecker'
+        assert csv['errors'] == []
+        bad = files[str(zp.joinpath('bad.json'))]
+        assert bad['errors'][0].startswith('Expecting property name')
+        assert bad['stats'][0]['checker'] == 'FileNameChecker'
+        groups = {g['name']: g for g in records[3]['groups']}
+        assert groups['All files']['count'] == 3
+        assert groups['Files with ERRORS']['count'] == 1
+
+
+def test_save_and_report(capsys):
+    with TemporaryDirectory() as td:
+        zp = Path(td).joinpath('test.zip')
+        with ZipFile(zp, 'w') as zf:
+            zf.writestr('sample.csv', _SAMPLE_CSV)
+            zf.writestr('bad.json', '{')
+        results = Path(td).joinpath('results.gz')
+        assert cli.main(['--save', str(results), str(zp)]) == 0
+        text = capsys.readouterr().out
+        assert cli.main(['report', str(results)]) == 0
+        assert capsys.readouterr().out == text
+        assert cli.main(['report', '-H', str(results)]) == 0
+        html = capsys.readouterr().out
+        assert 'data:image/webp;base64' in html \
+            or 'data:image/jpeg;base64' in html
+        assert 'Expecting property name' in html
+        for path in [zp, Path(td).joinpath('missing.gz')]:
+            with pytest.raises(SystemExit):
+                cli.main(['report', str(path)])
+            assert str(path) in capsys.readouterr().err
+
+
+def test_report_folder(capsys, monkeypatch):
+    # a folder named report is checked, not taken as the subcommand
+    with TemporaryDirectory() as td:
+        monkeypatch.chdir(td)
+        Path('report').mkdir()
+        Path('report', 'bad.json').write_text('{')
+        assert cli.main(['report']) == 0
+        assert 'Expecting property name' in capsys.readouterr().out
@@ -0,0 +1,143 @@
+import csv
+from io import BytesIO
+from pathlib import Path
+import pickle
+import pytest
+from tempfile import TemporaryDirectory
+from spot_check_files import csvcheck
+from spot_check_files.basics import CSVChecker
+from spot_check_files.checker import CheckRequest
+from spot_check_files.csvcheck import Dialect
+
+
+_TEST_CSV = """name,note,"quoted, with comma"
+a,"multiple
+lines",1
+b,"doubled ""quotes""\",2
+c,plain,3
+"""
+
+
+def test_sniff():
+    assert csvcheck.sniff(_TEST_CSV) == Dialect(',', '"', False)
+    assert csvcheck.sniff(_TEST_CSV.replace(',', '\t')).delimiter == '\t'
+    assert csvcheck.sniff('a; b; c\n1; 2; 3\n') == Dialect(';', '"', True)
+    assert csvcheck.sniff("x|'a|b'\n1|2\n", complete=True).quotechar == "'"
+    # a single row is enough
+    assert csvcheck.sniff('a,b,c', complete=True).delimiter == ','
+    # times don't make colons the delimiter
+    assert csvcheck.sniff('t,n\n12:30,1\n12:45,2\n').delimiter == ','
+    # the incomplete last record is ignored
+    assert csvcheck.sniff('a,b\n1,2\n3,"4\n5') == Dialect()
+    assert csvcheck.sniff('a,b\n1,2\n3,4,5,6').delimiter == ','
+    for sample in ['a,b,c\n1,2', 'Hello, world!\nNo problems here!\n',
+                   'no delimiters\n', '']:
+        with pytest.raises(csv.Error, match='Could not determine delimiter'):
+            csvcheck.sniff(sample, complete=True)
+
+
+def test_split():
+    data = _TEST_CSV.encode() * 3
+    for chunk_size in [1, 10, 30, 1000]:
+        ranges = csvcheck.split(data, chunk_size)
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+        assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+        rows = []
+        for start, end in ranges:
+            chunk = data[start:end].decode()
+            assert chunk.endswith('\n')
+            rows.extend(csv.reader(chunk.splitlines(True)))
+        if chunk_size > 20:
+            # (for smaller chunks, split gives up on finding the end of the
+            # multi-line field)
+            assert rows == list(csv.reader(data.decode().splitlines(True)))
+        file = BytesIO(data)
+        chunks = []
+        while True:
+            chunk = csvcheck.read_chunk(file, chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        assert chunks == [data[start:end] for start, end in ranges]
+    # a chunk doesn't end inside a quoted field, unless it's too long
+    assert csvcheck.split(b'a,"b\n\n\nc"\nd\n', 6) == [(0, 10), (10, 12)]
+    assert csvcheck.split(b'a,"b\n\n\nc"\nd\n', 2) \
+        == [(0, 5), (5, 7), (7, 12)]
+    assert csvcheck.split(b'a,"b\nc\n', 3) == [(0, 7)]
+    # a quote in an unquoted field makes it look like the rest of the data
+    # is quoted, so split gives up on finding the end of the field
+    data = b'tv 5" screen,1\n' + b'a,1\n' * 100
+    ranges = csvcheck.split(data, 20)
+    assert ranges[:2] == [(0, 43), (43, 63)]
+    assert max(end - start for start, end in ranges) < 2 * 20 + 4
+    file = BytesIO(data)
+    assert [csvcheck.read_chunk(file, 20) for _ in ranges] \
+        == [data[start:end] for start, end in ranges]
+
+
+def test_check_chunk():
+    res = csvcheck.check_chunk(_TEST_CSV.encode(), Dialect(), None, 'utf-8',
+                               head=2)
+    assert res == csvcheck.ChunkResult(
+        rows=4, lines=5, bad=0, errors=[],
+        head=[['name', 'note', 'quoted, with comma'],
+              ['a', 'multiple\nlines', '1']])
+
+    data = (b'a,b,c\n'
+            b'1,2\n'
+            b'\n'
+            b'1,"2"x,3\n'
+            b'1,"two\n'
+            b'lines",\xff\n'
+            b'1,2,3,4\n'
+            b'1,2,"unterminated\n')
+    res = csvcheck.check_chunk(data, Dialect(), 3, 'utf-8')
+    assert res.rows == 7
+    assert res.lines == 8
+    assert res.bad == 5
+    assert res.errors == [
+        (2, 2, '2 columns, expected 3'),
+        (4, 4, '\',\' expected after \'"\''),
+        (5, 5, "'utf-8' codec can't decode bytes 0xff: invalid start byte"),
+        (6, 7, '4 columns, expected 3'),
+        (7, 8, 'unexpected end of data')]
+    # the first row sets the number of columns if it isn't given
+    res = csvcheck.check_chunk(b'1,2\n1,2,3\n', Dialect(), None, 'utf-8')
+    assert res.errors == [(2, 2, '3 columns, expected 2')]
+
+    res = csvcheck.check_chunk(b'a,b\n' + b'1\n' * 20, Dialect(), None,
+                               'utf-8')
+    assert res.bad == 20
+    assert len(res.errors) == csvcheck.MAX_ERRORS
+
+
+def test_check_chunk_complete():
+    data = b'a,"multiple\nlines"\n'
+    assert csvcheck.check_chunk(data, Dialect(), None, 'utf-8').complete
+    res = csvcheck.check_chunk(data[:12], Dialect(), None, 'utf-8')
+    assert not res.complete
+    assert res.errors == [(1, 1, 'unexpected end of data')]
+
+
+def test_unquoted_quote():
+    # Quotes in unquoted fields must not make a chunk boundary split a
+    # later quoted field
+    rows = [f'{i},"multiple\nlines",{i}\n' for i in range(2000)]
+    rows[5] = '5,tv 5" screen,5\n'
+    data = ('a,b,c\n' + ''.join(rows)).encode()
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        req = CheckRequest(realpath=td.joinpath('test.csv'), tmpdir=td,
+                           virtpath=Path('test.csv'))
+        req.realpath.write_bytes(data)
+        for checker in [CSVChecker(jobs=1),
+                        CSVChecker(jobs=1, chunk_size=1000),
+                        CSVChecker(jobs=2, chunk_size=1000),
+                        CSVChecker(jobs=2, chunk_size=77)]:
+            res = checker.check(req)
+            assert res.errors == []
+
+
+def test_pickle():
+    dialect = csvcheck.sniff(_TEST_CSV)
+    assert pickle.loads(pickle.dumps(dialect)) == dialect
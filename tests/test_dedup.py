@@ -0,0 +1,61 @@
+from io import BytesIO
+from spot_check_files.dedup import ContentIndex
+
+
+def test_add():
+    opened = []
+
+    def opener(data):
+        def open():
+            opened.append(data)
+            return BytesIO(data)
+        return open
+
+    index = ContentIndex()
+    assert index.add(3, opener(b'abc'), 'first') is None
+    assert index.add(4, opener(b'abcd'), 'second') is None
+    # files are only read when their group collides
+    assert opened == []
+    assert index.add(3, opener(b'abd'), 'third') is None
+    assert index.add(3, opener(b'abc'), 'fourth') == 'first'
+    assert index.add(4, opener(b'abcd'), 'fifth') == 'second'
+
+    # a file that won't be available later is only hashed if its group
+    # collides when it's added
+    opened.clear()
+    assert index.add(5, opener(b'hello'), 'sixth', reopenable=False) is None
+    assert opened == []
+    # so it can't be compared with later files, but they're hashed in turn
+    assert index.add(5, opener(b'hello'), 'seventh',
+                     reopenable=False) is None
+    assert opened == [b'hello', b'hello']
+    opened.clear()
+    assert index.add(5, opener(b'hello'), 'eighth') == 'seventh'
+    assert opened == [b'hello', b'hello']
+
+
+def test_add_same_size():
+    opened = []
+
+    def opener(data):
+        def open():
+            opened.append(data)
+            return BytesIO(data)
+        return open
+
+    index = ContentIndex()
+    block = b'x' * 4096
+    files = [bytes([i]) * 4096 + block for i in range(100)]
+    for i, data in enumerate(files):
+        assert index.add(len(data), opener(data), i) is None
+    # each file's first block is only hashed once, and no whole file is
+    # hashed since no first blocks match
+    assert sorted(opened) == sorted(files)
+    opened.clear()
+    # files with the same first block are told apart by the full hash
+    other = files[50][:4096] + b'y' * 4096
+    assert index.add(len(other), opener(other), 'other') is None
+    assert opened == [other, files[50], other]
+    opened.clear()
+    assert index.add(len(files[50]), opener(files[50]), 'copy') == 50
+    assert opened == [files[50], files[50]]
@@ -0,0 +1,135 @@
+from io import StringIO
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from zipfile import ZipFile
+from spot_check_files import checker
+from spot_check_files.checker import CheckerRunner
+from spot_check_files.events import ChromeTracer, ProgressLine,\
+    RunnerListener
+from spot_check_files.sampling import Sampler
+
+
+class Recorder(RunnerListener):
+    totals = True
+
+    def __init__(self, root):
+        self.root = root
+        self.events = []
+
+    def _rel(self, virtpath):
+        return str(virtpath.relative_to(self.root))
+
+    def walk_started(self, path, files, size):
+        self.events.append(('walk_started', files, size))
+
+    def file_queued(self, virtpath, size, nesting):
+        self.events.append(('file_queued', self._rel(virtpath), nesting))
+
+    def checker_started(self, virtpath, checker):
+        self.events.append(('checker_started', self._rel(virtpath)))
+
+    def checker_finished(self, virtpath, stats):
+        assert stats.start is not None
+        self.events.append(('checker_finished', self._rel(virtpath)))
+
+    def archive_extracted(self, summary):
+        self.events.append(('archive_extracted', self._rel(summary.virtpath)))
+
+    def file_done(self, summary):
+        self.events.append(('file_done', self._rel(summary.virtpath)))
+
+    def walk_finished(self, path, elapsed):
+        assert elapsed > 0
+        self.events.append(('walk_finished',))
+
+
+def _make_tree(td):
+    td.joinpath('a.txt').write_text('hello')
+    with ZipFile(td.joinpath('b.zip'), 'w') as zf:
+        zf.writestr('c.txt', 'hi')
+
+
+def test_events():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        _make_tree(td)
+        size = sum(p.stat().st_size for p in td.iterdir())
+        for jobs in [1, 2]:
+            cr = CheckerRunner.default(jobs=jobs)
+            recorder = Recorder(td)
+            cr.listeners.append(recorder)
+            s = cr.check_path(td)
+            events = recorder.events
+            assert events[0] == ('walk_started', 2, size)
+            assert events[-1] == ('walk_finished',)
+            done = [e[1] for e in events if e[0] == 'file_done']
+            assert done == [str(x.virtpath.relative_to(td)) for x in s]
+            assert sorted(e[1:] for e in events if e[0] == 'file_queued') \
+                == [('a.txt', 0), ('b.zip', 0), ('b.zip/c.txt', 1)]
+            assert ('archive_extracted', 'b.zip') in events
+            for name in done:
+                # each file's checkers are reported before it's done
+                index = events.index(('file_done', name))
+                assert events[index - 1] == ('checker_finished', name)
+                assert ('checker_started', name) in events[:index]
+
+
+def test_totals_sampled(monkeypatch):
+    # when sampling a number of files, the totals are estimated from the
+    # walk that counts the files to sample from
+    walks = []
+    files = checker._files
+
+    def counting_files(*args):
+        walks.append(args[0])
+        return files(*args)
+    monkeypatch.setattr(checker, '_files', counting_files)
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        for i in range(4):
+            td.joinpath(f'{i}.txt').write_text('x' * 10)
+        cr = CheckerRunner.default()
+        cr.sampler = Sampler(count=2, seed=1)
+        recorder = Recorder(td)
+        cr.listeners.append(recorder)
+        cr.check_path(td)
+        assert recorder.events[0] == ('walk_started', 2, 20)
+        assert len(walks) == 2
+
+
+def test_progress_line():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        _make_tree(td)
+        for totals in [False, True]:
+            stream = StringIO()
+            progress = ProgressLine(stream, interval=0, totals=totals)
+            cr = CheckerRunner.default()
+            cr.listeners.append(progress)
+            cr.check_path(td)
+            out = stream.getvalue()
+            assert '3 files, ' in out
+            assert 'files/s' in out and 'MB/s' in out
+            # the files are only counted ahead of time if asked
+            assert ('ETA 0:00:00' in out) == totals
+            # the line is erased at the end
+            assert out.split('\r')[-2].strip() == ''
+
+
+def test_chrome_tracer():
+    with TemporaryDirectory() as td:
+        td = Path(td)
+        _make_tree(td)
+        trace = td.joinpath('trace.json')
+        with ChromeTracer(trace) as tracer:
+            cr = CheckerRunner.default(jobs=2)
+            cr.listeners.append(tracer)
+            cr.check_path(td.joinpath('b.zip'))
+        events = json.loads(trace.read_text())
+        checkers = [e for e in events if e.get('cat') == 'checker']
+        assert {e['args']['file'] for e in checkers} \
+            == {str(td.joinpath('b.zip')), str(td.joinpath('b.zip/c.txt'))}
+        assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in checkers)
+        assert [e['name'] for e in events if e['ph'] == 'i'] \
+            == ['queued', 'extracted', 'queued', 'done', 'done']
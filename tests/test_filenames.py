@@ -1,10 +1,11 @@
+import fnmatch
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from zipfile import ZipFile
 from spot_check_files.archives import ZipChecker
 from spot_check_files.basics import PlaintextChecker
 from spot_check_files.checker import CheckRequest
-from spot_check_files.filenames import FileNameChecker
+from spot_check_files.filenames import FileNameChecker, _PatternIndex
 
 
 def test_no_match():
@@ -73,3 +74,59 @@ def test_blacklist():
         assert res.recognizer is checker
         assert res.errors == []
         assert res.skipped
+
+
+def test_skips_tree():
+    checker = FileNameChecker(blacklist=['*/build/*', '*/docs', '*.txt'])
+    assert checker.skips_tree(Path('a/build'))
+    assert checker.skips_tree(Path('a/b.zip/build'))
+    assert checker.skips_tree(Path('a/build/sub'))
+    assert not checker.skips_tree(Path('a/builder'))
+    # files in docs itself wouldn't match
+    assert not checker.skips_tree(Path('a/docs'))
+    assert not checker.skips_tree(Path('a'))
+
+
+def test_pattern_index():
+    patterns = ['*.txt', 'a/*', '*.tar.gz', '*.gz', '*/b?.gz', '*.TXT',
+                '[xy]*', '*.txt', '*']
+    names = ['a/1.txt', 'b/1.txt', 'b/1.tar.gz', 'b/1.gz', 'c/bb.gz',
+             'x.tar.gz', '.txt', 'a.TXT', 'b/tar.gz', 'no_ext', 'a/',
+             'c/b.tar.gz.txt', 'c/1.gz.tar']
+    for start in range(len(patterns)):
+        for end in range(start, len(patterns) + 1):
+            index = _PatternIndex(patterns[start:end])
+            for name in names:
+                expected = next(
+                    (i for i, p in enumerate(patterns[start:end])
+                     if fnmatch.fnmatch(name, p)), None)
+                assert index.first(name) == expected, (start, end, name)
+
+
+def test_index_rebuilt():
+    checker = FileNameChecker([('*.txt', PlaintextChecker())])
+    req = CheckRequest(tmpdir=None, realpath=None, virtpath='a.txt',
+                       data=b'hi')
+    assert not checker.check(req).skipped
+    checker.blacklist.append('a.*')
+    assert checker.check(req).skipped
+    checker.blacklist.clear()
+    checker.checkers.insert(0, ('*.txt', ZipChecker()))
+    assert checker.check(req).errors[-1].startswith(
+        'expected to be recognized by ZipChecker')
+
+
+def test_contents_hint():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        req = CheckRequest(
+            tmpdir=tmpdir,
+            realpath=tmpdir.joinpath('test'),
+            virtpath='test.xml')
+        with ZipFile(req.realpath, 'w') as zf:
+            zf.writestr('a.txt', 'hello')
+        res = FileNameChecker.default().check(req)
+        assert res.errors[-2:] == [
+            'expected to be recognized by XMLChecker '
+            'because filename matched: *.xml',
+            'contents look like zip']
@@ -0,0 +1,94 @@
+from io import StringIO
+import json
+import pickle
+import pytest
+from spot_check_files import jsonstream
+from spot_check_files.jsonstream import JSONStreamError, validate
+from spot_check_files.preview import TextPreview
+
+
+_DOCS = [
+    '{"a": [1, 2.5, -3e+2, "x\\"y", true, false, null], "b": {}}',
+    '[]',
+    ' "just a string" ',
+    '[NaN, Infinity, -Infinity]',
+    '{"nested": [[{"deep": ["\\u00e9"]}]], "after": 1}',
+]
+
+
+_BAD = [
+    '',
+    '[1, 2',
+    '[1 2]',
+    '{"a" 1}',
+    '{a: 1}',
+    '[1,]',
+    '{"a": 1} x',
+    '["bad \\q escape"]',
+    '"unterminated',
+    '"unterminated \\',
+    '"cut off \\u00e',
+    '["cut off \\u',
+    '["control \x01 character"]',
+    '[\n  1,\n  2\n  3\n]',
+]
+
+
+@pytest.fixture(params=[1, 3, 4096])
+def chunk_size(request, monkeypatch):
+    monkeypatch.setattr(jsonstream, '_CHUNK_SIZE', request.param)
+
+
+def test_valid(chunk_size):
+    for doc in _DOCS:
+        assert validate(StringIO(doc)) is None
+
+
+def test_preview():
+    for doc in _DOCS:
+        preview = TextPreview()
+        validate(StringIO(doc), preview)
+        assert preview.lines() \
+            == json.dumps(json.loads(doc), indent=2).splitlines()
+
+
+def test_invalid(chunk_size):
+    for doc in _BAD:
+        with pytest.raises(json.JSONDecodeError) as info:
+            json.loads(doc)
+        expected = info.value
+        with pytest.raises(JSONStreamError) as info:
+            validate(StringIO(doc))
+        assert (info.value.msg, info.value.lineno, info.value.colno,
+                info.value.pos) \
+            == (expected.msg, expected.lineno, expected.colno, expected.pos)
+
+
+def test_deep():
+    # more deeply nested than json can parse, since it recurses
+    validate(StringIO('[' * 100000 + ']' * 100000))
+    validate(StringIO('{"a": ' + '[' * 100000 + ']' * 100000 + ', "b": 1}'))
+    with pytest.raises(JSONStreamError) as info:
+        validate(StringIO('[' * 100000))
+    assert (info.value.msg, info.value.pos) == ('Expecting value', 100000)
+
+
+def test_large():
+    doc = json.dumps({'rows': [{'id': i, 'name': f'row {i}'}
+                               for i in range(100000)],
+                      'blob': 'x' * 1000000})
+    preview = TextPreview(10, 15)
+    validate(StringIO(doc), preview)
+    assert preview.lines() == [
+        line[:15] for line in
+        json.dumps(json.loads(doc), indent=2).splitlines()[:10]]
+    with pytest.raises(JSONStreamError) as info:
+        validate(StringIO(doc[:-1] + ']'))
+    assert info.value.pos == len(doc) - 1
+
+
+def test_error_pickling():
+    error = JSONStreamError('Expecting value', 10, 2, 3)
+    copy = pickle.loads(pickle.dumps(error))
+    assert str(copy) == str(error) \
+        == 'Expecting value: line 2 column 3 (char 10)'
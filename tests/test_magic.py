@@ -0,0 +1,84 @@
+import gzip
+from io import BytesIO
+from pathlib import Path
+from PIL import Image
+import tarfile
+from tempfile import TemporaryDirectory
+from zipfile import ZipFile
+from spot_check_files.archives import TarChecker, ZipChecker
+from spot_check_files.basics import ImageChecker, JSONChecker, XMLChecker
+from spot_check_files.checker import CheckRequest
+from spot_check_files.magic import MagicChecker
+
+
+def _request(data: bytes) -> CheckRequest:
+    return CheckRequest(realpath=None, tmpdir=None, virtpath=Path('noext'),
+                        extract=False, data=data)
+
+
+def _tar(mode: str) -> bytes:
+    out = BytesIO()
+    with tarfile.open(fileobj=out, mode=mode) as tf:
+        info = tarfile.TarInfo('a.txt')
+        info.size = 5
+        tf.addfile(info, BytesIO(b'hello'))
+    return out.getvalue()
+
+
+def _image(format: str) -> bytes:
+    out = BytesIO()
+    Image.new('RGB', (10, 10)).save(out, format)
+    return out.getvalue()
+
+
+def test_identify():
+    zipdata = BytesIO()
+    with ZipFile(zipdata, 'w') as zf:
+        zf.writestr('a.txt', 'hello')
+    cases = [
+        (zipdata.getvalue(), 'zip', ZipChecker),
+        (_tar('w'), 'tar', TarChecker),
+        (_tar('w:gz'), 'gzip', TarChecker),
+        (_tar('w:bz2'), 'bz2', TarChecker),
+        (_tar('w:xz'), 'xz', TarChecker),
+        (Path('tests', 'testimage.jpg').read_bytes(), 'jpeg', ImageChecker),
+        (Path('tests', 'csv.png').read_bytes(), 'png', ImageChecker),
+        (_image('gif'), 'gif', ImageChecker),
+        (_image('webp'), 'webp', ImageChecker),
+        (b'<?xml version="1.0"?><a/>', 'xml', XMLChecker),
+        (b'\n  {"a": 1}', 'json', JSONChecker),
+        (b'[1, 2]', 'json', JSONChecker),
+    ]
+    checker = MagicChecker.default()
+    for data, kind, cls in cases:
+        match = checker.identify(_request(data))
+        assert match and match[0] == kind and isinstance(match[1], cls)
+        res = checker.check(_request(data))
+        assert isinstance(res.recognizer, cls), kind
+        assert res.errors == []
+    assert checker.identify(_request(b'hello')) is None
+    assert checker.check(_request(b'hello')).recognizer is None
+
+
+def test_not_recognized():
+    checker = MagicChecker.default()
+    # a gzipped file that isn't a tar
+    res = checker.check(_request(gzip.compress(b'hello')))
+    assert res.recognizer is None
+    assert res.errors == []
+    res = checker.check(_request(b'{"a": '))
+    assert res.recognizer is None
+    assert res.errors == []
+
+
+def test_header_read_once():
+    with TemporaryDirectory() as td:
+        path = Path(td).joinpath('noext')
+        path.write_text('{"a": 1}')
+        req = CheckRequest(realpath=path, tmpdir=Path(td), virtpath=path,
+                           quick=True)
+        assert MagicChecker.default().identify(req)[0] == 'json'
+        assert req.header == b'{"a": 1}'
+        path.write_text('changed')
+        assert isinstance(MagicChecker.default().check(req).recognizer,
+                          JSONChecker)
@@ -0,0 +1,23 @@
+from spot_check_files.preview import TextPreview
+
+
+def test_text_preview():
+    preview = TextPreview(3, 5)
+    preview.write('ab')
+    preview.write('cdefg\nhi')
+    assert not preview.full
+    assert preview.lines() == ['abcde', 'hi']
+    preview.write('\n')
+    assert preview.lines() == ['abcde', 'hi']
+    preview.write('x' * 1000000 + '\nignored\n')
+    assert preview.full
+    assert preview.lines() == ['abcde', 'hi', 'xxxxx']
+    preview.write('more')
+    assert preview.lines() == ['abcde', 'hi', 'xxxxx']
+
+
+def test_text_preview_matches_splitlines():
+    for text in ['', 'a', 'a\n', 'a\n\nb', '\n\n']:
+        preview = TextPreview()
+        preview.write(text)
+        assert preview.lines() == text.splitlines()
@@ -1,12 +1,14 @@
 from pathlib import Path
-from PIL import Image
+from PIL import Image, features
+import pytest
 import re
 from spot_check_files.archives import ZipChecker
 from spot_check_files.basics import CSVChecker, ImageChecker, PlaintextChecker
-from spot_check_files.checker import CheckResult, FileSummary
+from spot_check_files.checker import CheckerStats, CheckResult, FileSummary
 from spot_check_files.filenames import FileNameChecker
 from spot_check_files.quicklook import QLChecker
-from spot_check_files.report import CheckReport
+from spot_check_files.report import CheckReport, file_record
+from spot_check_files.thumbs import ThumbnailStore
 
 
 _HTMLDIR = Path('tmp')
@@ -25,6 +27,15 @@ def test_empty(capsys):
     _HTMLDIR.joinpath('empty.html').write_text(html)
 
 
+def test_summaries_deprecated():
+    summaries = [FileSummary(size=1, virtpath=Path('a.txt'),
+                             result=CheckResult())]
+    with pytest.deprecated_call():
+        assert CheckReport(summaries).summaries is summaries
+    with pytest.deprecated_call(), pytest.raises(AttributeError):
+        CheckReport(iter(summaries)).summaries
+
+
 def test_errors(capsys):
     s1 = FileSummary(
         size=15, virtpath=Path('alpha/file1.txt'),
@@ -212,3 +223,162 @@ def test_thumbs(capsys):
     assert re.search(r'^.*thumbnails.*\b68%.*$', cap.out, re.MULTILINE)
     html = report.html()
     _HTMLDIR.joinpath('thumbs.html').write_text(html)
+
+
+def test_max_thumbs():
+    thumb = Image.open(Path('tests').joinpath('csv.png'))
+    summaries = [FileSummary(size=i, virtpath=Path(f'{i}.csv'),
+                             result=CheckResult(recognizer=CSVChecker(),
+                                                thumb=thumb))
+                 for i in range(100)]
+    report = CheckReport(max_thumbs=10)
+    for summary in summaries:
+        report.add(summary)
+    assert len(report.thumb_summaries) == 10
+    sizes = [s.size for s in report.thumb_summaries]
+    assert sizes == sorted(sizes)
+    assert sizes != list(range(10))
+    groups = [g for g in report.groups if g.name == 'Files with thumbnails']
+    assert groups[0].count == 100
+    assert groups[0].count_pct == '100%'
+    assert CheckReport(summaries, 10).thumb_summaries \
+        == report.thumb_summaries
+
+
+def test_max_thumbs_store(tmp_path):
+    # Only the thumbnails the report keeps stay in the store
+    thumb = Image.new('RGB', (10, 10), 'red')
+    for keep in [True, False]:
+        with ThumbnailStore(tmp_path) as store:
+            report = CheckReport(max_thumbs=10, keep_summaries=keep)
+            for i in range(100):
+                report.add(FileSummary(
+                    size=i, virtpath=Path(f'{i}.csv'),
+                    result=CheckResult(recognizer=CSVChecker(),
+                                       thumb=store.add(thumb))))
+            assert len(store._memory) == (10 if keep else 0)
+            for summary in report.thumb_summaries:
+                assert summary.result.thumb.image().size == (10, 10)
+
+
+def test_sampled(capsys):
+    summaries = [FileSummary(size=10, virtpath=Path(f'{i}.txt'),
+                             result=CheckResult(recognizer=PlaintextChecker(),
+                                                errors=['bad'] * (i < 5)))
+                 for i in range(50)]
+    report = CheckReport(summaries)
+    report.print()
+    assert 'error rate' not in capsys.readouterr().out
+    report = CheckReport(summaries, sampled=True)
+    groups = [g for g in report.groups
+              if g.name == 'Recognized by PlaintextChecker']
+    assert groups[0].error_rate == '10.0% (4.3%-21.4%)'
+    report.print()
+    cap = capsys.readouterr()
+    assert re.search(r'^.*Recognized by PlaintextChecker.*10\.0% \(4\.3%-'
+                     r'21\.4%\).*$', cap.out, re.MULTILINE)
+    html = report.html()
+    assert '4.3%-21.4%' in html
+    _HTMLDIR.joinpath('sampled.html').write_text(html)
+    # the error rate of the files with errors isn't an estimate
+    groups = {g.name: g for g in report.groups}
+    assert groups['Files with ERRORS'].error_rate == ''
+    assert groups['Archives (without errors)'].error_rate == ''
+    # files that weren't randomly chosen are left out of the estimate
+    for summary in summaries[:5]:
+        summary.forced = True
+    report = CheckReport(summaries, sampled=True)
+    groups = {g.name: g for g in report.groups}
+    assert groups['Recognized by PlaintextChecker'].count == 50
+    assert groups['Recognized by PlaintextChecker'].error_rate.startswith(
+        '0.0% ')
+
+
+def test_performance(capsys):
+    summaries = [FileSummary(size=i * 1024 * 1024, virtpath=Path(f'{i}.txt'),
+                             result=CheckResult(recognizer=PlaintextChecker()),
+                             stats=[CheckerStats('ZipChecker', wall=0.5),
+                                    CheckerStats('PlaintextChecker', wall=i,
+                                                 cpu=i / 2, bytes_read=i,
+                                                 max_rss=i * 1024 * 1024)])
+                 for i in range(1, 31)]
+    report = CheckReport(summaries)
+    report.print()
+    assert 'Slowest' not in capsys.readouterr().out
+    report = CheckReport(summaries, performance=True)
+    assert [p.name for p in report.checker_perf] \
+        == ['ZipChecker', 'PlaintextChecker']
+    perf = report.checker_perf[1]
+    assert perf.count == 30
+    assert perf.wall == 465
+    assert perf.bytes_read == 465
+    assert perf.throughput == '1.0'
+    assert perf.peak_memory == '30 MB'
+    slowest = report.slowest_summaries
+    assert [s.size // 1024 // 1024 for s in slowest] == list(range(30, 10, -1))
+    report.print()
+    cap = capsys.readouterr()
+    assert re.search(r'^.*Files \(excludes.*480\.00.*$', cap.out, re.MULTILINE)
+    assert re.search(r'^.*30\.txt.*30\.50.*PlaintextChecker.*$', cap.out,
+                     re.MULTILINE)
+    html = report.html()
+    assert '<td>30.txt</td>' in html
+    _HTMLDIR.joinpath('performance.html').write_text(html)
+
+
+def test_records():
+    summaries = [
+        FileSummary(size=10, virtpath=Path('a.txt'),
+                    result=CheckResult(recognizer=PlaintextChecker()),
+                    stats=[CheckerStats('PlaintextChecker', wall=0.5)]),
+        FileSummary(size=10, virtpath=Path('b.txt'),
+                    result=CheckResult(recognizer=PlaintextChecker(),
+                                       errors=[ValueError('bad')]),
+                    duplicate_of=Path('c.txt'))]
+    assert file_record(summaries[0]) == {
+        'type': 'file', 'virtpath': 'a.txt', 'size': 10,
+        'recognizer': 'PlaintextChecker', 'skipped': False, 'errors': [],
+        'duplicate_of': None, 'forced': False, 'wall': 0.5,
+        'stats': [{'checker': 'PlaintextChecker', 'wall': 0.5, 'cpu': 0,
+                   'bytes_read': 0, 'max_rss': None}]}
+    record = file_record(summaries[1])
+    assert record['errors'] == ['bad']
+    assert record['duplicate_of'] == 'c.txt'
+    report = CheckReport(summaries, keep_summaries=False)
+    assert report.err_summaries == []
+    record = report.summary_record()
+    groups = {g['name']: g for g in record['groups']}
+    assert groups['All files'] == {'name': 'All files', 'count': 2,
+                                   'size': 20, 'errors': 1, 'wall': 0.5}
+    assert groups['Files with ERRORS']['count'] == 1
+    assert record['checkers'][0]['checker'] == 'PlaintextChecker'
+
+
+def test_write_html(tmp_path):
+    summaries = [
+        FileSummary(size=i, virtpath=Path(f'{i}.txt'),
+                    result=CheckResult(
+                        recognizer=PlaintextChecker(),
+                        thumb=Image.new('RGBA', (20, 10), 'blue'),
+                        errors=['bad <thing>'] * (i % 2)))
+        for i in range(5)]
+    report = CheckReport(summaries, performance=True)
+    report.write_html(tmp_path, page_size=2)
+    ext = 'webp' if features.check('webp') else 'jpg'
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'errors-1.html', 'index.html', 'style.css', 'thumbs',
+        'thumbs-1.html', 'thumbs-2.html', 'thumbs-3.html']
+    assert sorted(p.name for p in tmp_path.joinpath('thumbs').iterdir()) \
+        == [f'{i}.{ext}' for i in range(5)]
+    with Image.open(tmp_path.joinpath('thumbs', f'4.{ext}')) as img:
+        assert img.size == (20, 10)
+    index = tmp_path.joinpath('index.html').read_text()
+    assert 'Files with ERRORS' in index
+    assert 'Slowest' in index or 'slowest' in index
+    assert 'href="thumbs-3.html"' in index
+    errors = tmp_path.joinpath('errors-1.html').read_text()
+    assert errors.count('bad &lt;thing&gt;') == 2
+    page = tmp_path.joinpath('thumbs-3.html').read_text()
+    assert f'src="thumbs/4.{ext}" loading="lazy"' in page
+    assert 'href="thumbs-1.html"' in page
+    assert 'data:image' not in page
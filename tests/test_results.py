@@ -0,0 +1,54 @@
+from pathlib import Path
+from PIL import Image
+from tempfile import TemporaryDirectory
+from spot_check_files import thumbs
+from spot_check_files.basics import PlaintextChecker
+from spot_check_files.checker import CheckerStats, CheckResult,\
+    FileSummary, NamedChecker
+from spot_check_files.filenames import FileNameChecker
+from spot_check_files.results import ResultsReader, ResultsWriter
+
+
+class Unpicklable(Exception):
+    def __reduce__(self):
+        raise TypeError('nope')
+
+
+def test_round_trip():
+    thumb = Image.new('RGB', (10, 10), 'red')
+    summaries = [
+        FileSummary(size=10, virtpath=Path('a.txt'),
+                    result=CheckResult(recognizer=PlaintextChecker(),
+                                       thumb=thumb),
+                    stats=[CheckerStats('PlaintextChecker', wall=0.5)]),
+        FileSummary(size=20, virtpath=Path('b.txt'),
+                    result=CheckResult(errors=[Unpicklable('odd')]),
+                    duplicate_of=Path('c.txt'), forced=True),
+        FileSummary(size=30, virtpath=Path('d.zip'),
+                    result=CheckResult(recognizer=FileNameChecker.default(),
+                                       members=[], skipped=True))]
+    with TemporaryDirectory() as td:
+        path = Path(td).joinpath('results')
+        with ResultsWriter(path, sampled=True) as writer:
+            for summary in summaries:
+                writer.add(summary)
+        reader = ResultsReader(path)
+        assert reader.sampled
+        loaded = list(reader)
+    assert [(s.virtpath, s.size, s.duplicate_of, s.forced) for s in loaded] \
+        == [(Path('a.txt'), 10, None, False),
+            (Path('b.txt'), 20, Path('c.txt'), True),
+            (Path('d.zip'), 30, None, False)]
+    # recognizers are only saved by name
+    assert loaded[0].result.recognizer == NamedChecker('PlaintextChecker')
+    assert loaded[1].result.recognizer is None
+    assert loaded[2].result == CheckResult(
+        recognizer=NamedChecker('FileNameChecker'), members=[],
+        skipped=True)
+    assert loaded[0].stats == summaries[0].stats
+    assert thumbs.to_image(loaded[0].result.thumb).tobytes() \
+        == thumbs.decode(thumbs.encode(thumb)).tobytes()
+    assert loaded[1].result.thumb is None
+    assert loaded[1].result.errors == ['odd']
+    # the original isn't changed
+    assert isinstance(summaries[1].result.errors[0], Unpicklable)
@@ -0,0 +1,53 @@
+import pytest
+from spot_check_files.sampling import Sampler
+
+
+def test_selection():
+    sampler = Sampler(fraction=0.25, seed=1)
+    names = [f'dir/file{i}.txt' for i in range(1000)]
+    select = sampler.selection()
+    chosen = [n for n in names if select(n, 50)]
+    # the first file of the stratum is always chosen
+    assert chosen[0] == 'dir/file0.txt'
+    assert 200 < len(chosen) < 300
+    select = sampler.selection()
+    assert [n for n in names if select(n, 50)] == chosen
+    select = Sampler(fraction=0.25, seed=2).selection()
+    assert [n for n in names if select(n, 50)] != chosen
+
+    # rare extensions and sizes are still represented
+    select = sampler.selection()
+    for name in names:
+        select(name, 50)
+    assert select('dir/other.csv', 50)
+    assert select('dir/big.txt', 50000)
+    assert not all(select(f'dir/big{i}.txt', 50000) for i in range(20))
+
+
+def test_selection_parent():
+    sampler = Sampler(fraction=0.25)
+    names = [f'file{i}.txt' for i in range(1000)]
+    chosen = {}
+    for parent in ['a.zip', 'b.zip']:
+        select = sampler.selection(parent)
+        chosen[parent] = [n for n in names if select(n, 50)]
+        # other than the first of the stratum, the files chosen are the
+        # random sample
+        assert chosen[parent][1:] == [
+            n for n in names[1:] if sampler.chosen(f'{parent}/{n}')]
+    # archives with the same member names are sampled independently
+    assert chosen['a.zip'] != chosen['b.zip']
+
+
+def test_resolve():
+    sampler = Sampler(count=10, seed=3).resolve(40)
+    assert sampler.fraction == 0.25
+    assert sampler.seed == 3
+    assert Sampler(count=10).resolve(5).fraction == 1
+    assert Sampler(count=10).resolve(0).fraction == 1
+    with pytest.raises(ValueError):
+        Sampler(count=10).selection()
+    with pytest.raises(ValueError):
+        Sampler(count=10, fraction=0.5)
+    with pytest.raises(ValueError):
+        Sampler(fraction=1.5)
@@ -0,0 +1,73 @@
+from io import BytesIO
+from pathlib import Path
+import pickle
+from PIL import Image
+import pytest
+from tempfile import TemporaryDirectory
+from spot_check_files import thumbs
+from spot_check_files.thumbs import Thumbnail, ThumbnailStore
+
+
+def _round_trip(img):
+    return thumbs.decode(thumbs.encode(img)).tobytes()
+
+
+def test_thumbnail():
+    img = Image.new('RGBA', (20, 10), 'red')
+    thumb = Thumbnail.from_image(img)
+    assert thumbs.encode(thumb) == thumb.data
+    assert thumbs.to_image(thumb).size == (20, 10)
+    assert thumbs.to_image(thumb).tobytes() == _round_trip(img)
+    copy = pickle.loads(pickle.dumps(thumb))
+    assert type(copy) is Thumbnail
+    assert copy.data == thumb.data
+
+
+def test_encode(monkeypatch):
+    noise = Image.effect_noise((100, 100), 64).convert('RGB')
+    png = BytesIO()
+    noise.save(png, 'png')
+    clear = Image.new('RGBA', (10, 10), (255, 0, 0, 0))
+    for webp in [True, False]:
+        monkeypatch.setattr(thumbs.features, 'check', lambda _: webp)
+        # opaque images are saved in a lossy format
+        data = thumbs.encode(noise)
+        assert thumbs.media_type(data) \
+            == ('image/webp' if webp else 'image/jpeg')
+        assert len(data) < len(png.getvalue()) / 2
+        # transparency is kept
+        data = thumbs.encode(clear)
+        assert thumbs.media_type(data) \
+            == ('image/webp' if webp else 'image/png')
+        assert thumbs.decode(data).convert('RGBA').getchannel('A') \
+            .getextrema() == (0, 0)
+
+
+def test_store():
+    # noise, so that the images don't compress well
+    images = [Image.effect_noise((50, 50), 64) for _ in range(5)]
+    with TemporaryDirectory() as td:
+        with ThumbnailStore(Path(td), max_memory=1000) as store:
+            stored = [store.add(img) for img in images]
+            assert store.add(stored[0]) is stored[0]
+            assert store._spilled
+            assert len(store._memory) == 1
+            for _ in range(2):
+                for img, thumb in zip(images, stored):
+                    assert thumb.image().tobytes() == _round_trip(img)
+            copy = pickle.loads(pickle.dumps(stored[3]))
+            assert copy.image().tobytes() == _round_trip(images[3])
+
+            # stored[0] was added twice, so it's kept until it's been
+            # discarded twice
+            thumbs.discard(stored[0])
+            assert stored[0].image().tobytes() == _round_trip(images[0])
+            thumbs.discard(stored[0])
+            with pytest.raises(KeyError):
+                stored[0].image()
+            for thumb in stored[1:]:
+                thumbs.discard(thumb)
+            assert not store._memory and not store._spilled
+            # thumbnails that aren't stored are left alone
+            thumbs.discard(images[0])
+        assert not store._spilled
@@ -0,0 +1,69 @@
+import os
+import time
+import pytest
+from spot_check_files import workers
+
+
+def _add(a, b):
+    return a + b
+
+
+def _sleep(seconds):
+    workers.progress('file', 'sleepy.txt')
+    time.sleep(seconds)
+    return seconds
+
+
+def _fail():
+    raise ValueError('bad')
+
+
+def _die():
+    os._exit(1)
+
+
+def test_submit():
+    with workers.WorkerPool(2) as pool:
+        futures = [pool.submit(_add, i, 1) for i in range(5)]
+        assert [f.result() for f in futures] == [1, 2, 3, 4, 5]
+        with pytest.raises(ValueError):
+            pool.submit(_fail).result()
+
+
+def test_file_timeout():
+    with workers.WorkerPool(1, file_timeout=0.5) as pool:
+        slow = pool.submit(_sleep, 30)
+        fast = pool.submit(_add, 1, 2)
+        with pytest.raises(workers.TaskTimeout) as exc:
+            slow.result(10)
+        assert str(exc.value).startswith('gave up checking sleepy.txt after')
+        assert exc.value.elapsed < 10
+        # the worker is replaced
+        assert fast.result(10) == 3
+
+
+def test_deadline():
+    with workers.WorkerPool(1, deadline=time.monotonic() + 0.5) as pool:
+        slow = pool.submit(_sleep, 30)
+        later = pool.submit(_add, 1, 2)
+        with pytest.raises(workers.TaskTimeout):
+            slow.result(10)
+        with pytest.raises(workers.TaskTimeout) as exc:
+            later.result(10)
+        assert 'not checked' in str(exc.value)
+
+
+def test_worker_died():
+    with workers.WorkerPool(1) as pool:
+        with pytest.raises(workers.TaskFailed) as exc:
+            pool.submit(_die).result(10)
+        assert 'worker process died' in str(exc.value)
+        assert pool.submit(_add, 2, 2).result(10) == 4
+
+
+def test_start_method():
+    # Replacement workers are started from the pool's thread, so they
+    # mustn't be forked from this process
+    with workers.WorkerPool(1) as pool:
+        assert pool._context.get_start_method() in ('forkserver', 'spawn')
+        assert pool.submit(_add, 1, 1).result(10) == 2